@@ -2,6 +2,8 @@
 ASGI config for web_django project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with ``uvicorn web_django.asgi:application`` so the live event
+stream can hold its connections open without tying up a worker thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
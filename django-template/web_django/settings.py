@@ -19,6 +19,70 @@ ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "127.0.0.1,localhost").sp
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 GOOGLE_REDIRECT_URI = os.environ.get("GOOGLE_REDIRECT_URI")
+GOOGLE_DRIVE_FOLDER_ID = os.environ.get("GOOGLE_DRIVE_FOLDER_ID")
+GOOGLE_DRIVE_CREDENTIALS_FILE = os.environ.get("GOOGLE_DRIVE_CREDENTIALS_FILE", os.path.join(BASE_DIR, "credentials.json"))
+GOOGLE_OAUTH_SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+# Upstream endpoints; point both at a local stub (wedding/google_stub.py) for tests and benchmarks
+GOOGLE_OAUTH_TOKEN_URL = os.environ.get("GOOGLE_OAUTH_TOKEN_URL", "https://oauth2.googleapis.com/token")
+GOOGLE_API_ROOT = os.environ.get("GOOGLE_API_ROOT", "https://www.googleapis.com").rstrip("/")
+# Shared Drive/OAuth HTTP client (see wedding/drive_client.py)
+GOOGLE_HTTP_TIMEOUT = float(os.environ.get("GOOGLE_HTTP_TIMEOUT", "30"))
+GOOGLE_HTTP_POOL_SIZE = int(os.environ.get("GOOGLE_HTTP_POOL_SIZE", "16"))
+# Resumable upload chunk size; must be a multiple of 256 KiB
+GOOGLE_DRIVE_CHUNK_SIZE = int(os.environ.get("GOOGLE_DRIVE_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# Permission grants and metadata updates go to Drive in batch requests (wedding/drive_batch.py):
+# a batch is sent once this many are due, or when the oldest has waited DRIVE_BATCH_INTERVAL seconds.
+# Google accepts at most 100 calls per batch.
+DRIVE_BATCH_SIZE = int(os.environ.get("DRIVE_BATCH_SIZE", "50"))
+DRIVE_BATCH_INTERVAL = float(os.environ.get("DRIVE_BATCH_INTERVAL", "2.0"))
+# Refresh access tokens this many seconds before they expire
+GOOGLE_TOKEN_REFRESH_MARGIN = int(os.environ.get("GOOGLE_TOKEN_REFRESH_MARGIN", "300"))
+
+# Gallery media storage (see wedding/storage.py): "drive", "local" or "memory"
+GALLERY_STORAGE = os.environ.get("GALLERY_STORAGE", "drive")
+GALLERY_STORAGE_BACKENDS = {
+    "drive": "wedding.storage.DriveStorage",
+    "local": "wedding.storage.LocalStorage",
+    "memory": "wedding.storage.MemoryStorage",
+}
+# Root for the "local" backend; defaults to MEDIA_ROOT/gallery/objects. Django serves it only with
+# DEBUG: point the front web server's MEDIA_URL/gallery/objects/ at it, with a long cache lifetime
+# (the files are named after their content and never change)
+GALLERY_LOCAL_STORAGE_ROOT = os.environ.get("GALLERY_LOCAL_STORAGE_ROOT")
+
+# Hash uploads while they stream in (content dedup, see wedding/uploads.py)
+FILE_UPLOAD_HANDLERS = [
+    "wedding.uploads.HashingMemoryFileUploadHandler",
+    "wedding.uploads.HashingTemporaryFileUploadHandler",
+]
+# Store a perceptual hash of each photo so admins can find near-duplicates
+GALLERY_PERCEPTUAL_HASH = os.environ.get("GALLERY_PERCEPTUAL_HASH", "True").lower() in ("1", "true", "yes")
+# Digests accepted per gallery/check-hashes/ request
+GALLERY_HASH_CHECK_MAX = int(os.environ.get("GALLERY_HASH_CHECK_MAX", "500"))
+
+# Gallery upload pipeline
+# Uploads are spooled to MEDIA_ROOT and pushed to GALLERY_STORAGE by a background pool.
+GALLERY_DRIVE_CLIENT = os.environ.get("GALLERY_DRIVE_CLIENT", "wedding.drive_client.GoogleDriveClient")
+# "queued" spools and returns 202; "stream" pushes the upload to Drive inline
+GALLERY_UPLOAD_MODE = os.environ.get("GALLERY_UPLOAD_MODE", "queued")
+GALLERY_UPLOAD_WORKERS = int(os.environ.get("GALLERY_UPLOAD_WORKERS", "4"))
+# Bounded pool for multi-file uploads posted to gallery/upload-batch/
+GALLERY_BATCH_WORKERS = int(os.environ.get("GALLERY_BATCH_WORKERS", "8"))
+GALLERY_BATCH_MAX_FILES = int(os.environ.get("GALLERY_BATCH_MAX_FILES", "50"))
+GALLERY_UPLOAD_MAX_ATTEMPTS = int(os.environ.get("GALLERY_UPLOAD_MAX_ATTEMPTS", "3"))
+# Seconds after which an upload still marked "uploading" counts as abandoned by a dead worker
+GALLERY_UPLOAD_CLAIM_TIMEOUT = int(os.environ.get("GALLERY_UPLOAD_CLAIM_TIMEOUT", "900"))
+# Resized copies generated for each photo (longest side in pixels)
+GALLERY_IMAGE_VARIANTS = {"full": 2048, "medium": 1024, "thumbnail": 320}
+GALLERY_IMAGE_FORMAT = os.environ.get("GALLERY_IMAGE_FORMAT", "WEBP")
+GALLERY_IMAGE_QUALITY = int(os.environ.get("GALLERY_IMAGE_QUALITY", "80"))
+# Run uploads inline on commit instead of on the pool (tests, one-off scripts)
+GALLERY_UPLOAD_EAGER = os.environ.get("GALLERY_UPLOAD_EAGER", "False").lower() in ("1", "true", "yes")
+# Admission control, per process: uploads beyond these get 429 (wedding/throttling.py)
+GALLERY_UPLOAD_MAX_IN_FLIGHT = int(os.environ.get("GALLERY_UPLOAD_MAX_IN_FLIGHT", "16"))
+# Request bodies being received plus spooled files still queued for the pool
+GALLERY_UPLOAD_MAX_SPOOL_BYTES = int(os.environ.get("GALLERY_UPLOAD_MAX_SPOOL_BYTES", str(512 * 1024 * 1024)))
+GALLERY_UPLOAD_RETRY_AFTER = int(os.environ.get("GALLERY_UPLOAD_RETRY_AFTER", "5"))
 
 # Application definition
 
@@ -53,6 +117,22 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'wedding.pagination.NewestFirstPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Token-bucket rate limits on the public write endpoints (wedding/throttling.py),
+# as "requests/period": per client IP, and per guest for the ".guest" scopes.
+# Guests at the venue share the Wi-Fi's address, so the IP limits are generous.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "True").lower() in ("1", "true", "yes")
+RATE_LIMITS = {
+    "rsvp": "60/min",
+    "rsvp.guest": "10/min",
+    "reserve": "60/min",
+    "reserve.guest": "10/min",
+    "wish": "60/min",
+    "wish.guest": "5/min",
+    "upload": "120/min",
 }
 
 SIMPLE_JWT = {
@@ -119,10 +199,29 @@ else:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # A file rather than shared-cache memory, so concurrent test
+            # connections wait on locks instead of failing with "table is locked"
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
         }
     }
 
 
+# CACHES
+# Local memory by default; point DJANGO_CACHE_BACKEND at
+# django.core.cache.backends.filebased.FileBasedCache (LOCATION = a directory) or
+# django.core.cache.backends.redis.RedisCache (LOCATION = redis://...) to share
+# the cache between worker processes.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("DJANGO_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", "wedding"),
+    }
+}
+# Upper bound on how long a cached public list/detail response is served
+WEDDING_RESPONSE_CACHE_TTL = int(os.environ.get("WEDDING_RESPONSE_CACHE_TTL", "60"))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -159,7 +258,59 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
+MIDDLEWARE.insert(1, 'wedding.middleware.StaticFilesMiddleware')
+# After static files, so /metrics only reports application requests
+MIDDLEWARE.insert(2, 'wedding.middleware.RequestMetricsMiddleware')
+
+# Request metrics (wedding/metrics.py), served at /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() in ("1", "true", "yes")
+# Bearer token Prometheus must send; without one, only staff users may read /metrics
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_SLOW_REQUEST_SECONDS = float(os.environ.get("METRICS_SLOW_REQUEST_SECONDS", "1.0"))
+# Slowest statements kept per request for the slow-request log
+METRICS_SQL_SAMPLE_SIZE = int(os.environ.get("METRICS_SQL_SAMPLE_SIZE", "5"))
+
+# Guest and wish search (wedding/search.py): rows fetched from the index per
+# query before they are ranked
+SEARCH_CANDIDATE_LIMIT = int(os.environ.get("SEARCH_CANDIDATE_LIMIT", "200"))
+
+# Background jobs (wedding/jobs.py), run by `manage.py run_jobs`: the OAuth token
+# exchange, uploads to a user's Drive and batched Drive permission grants and metadata updates
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "8"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+# Retry delays double from the base up to the cap
+JOB_RETRY_BASE_SECONDS = float(os.environ.get("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.environ.get("JOB_RETRY_MAX_SECONDS", "600"))
+# How long a worker holds a job before another may take it over, unless the task sets its own
+JOB_VISIBILITY_TIMEOUT = int(os.environ.get("JOB_VISIBILITY_TIMEOUT", "300"))
+# Finished jobs are deleted after this; dead ones are kept
+JOB_RETENTION_HOURS = int(os.environ.get("JOB_RETENTION_HOURS", "72"))
+# Run jobs in-process as soon as they are committed (tests, single-process development)
+JOBS_EAGER = os.environ.get("JOBS_EAGER", "False").lower() in ("1", "true", "yes")
+
+# Guest check-in at the door (wedding/checkin.py), under /api/checkin/
+CHECKIN_SYNC_MAX_ARRIVALS = int(os.environ.get("CHECKIN_SYNC_MAX_ARRIVALS", "1000"))
+# The snapshot is compressed once per version, so spend the CPU on a smaller download
+CHECKIN_SNAPSHOT_GZIP_LEVEL = int(os.environ.get("CHECKIN_SNAPSHOT_GZIP_LEVEL", "9"))
+
+# Live updates over Server-Sent Events (wedding/live.py), served at /api/live/.
+# LocalBroker suits a single ASGI process; with several workers use
+# wedding.live.DatabaseBroker (or another broker with publish/start).
+LIVE_BROKER = os.environ.get("LIVE_BROKER", "wedding.live.LocalBroker")
+# Events kept for clients resuming from a cursor
+LIVE_EVENT_RETENTION = int(os.environ.get("LIVE_EVENT_RETENTION", "1000"))
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get("LIVE_HEARTBEAT_SECONDS", "15"))
+# Events a slow client may fall behind before it is told to refetch
+LIVE_SUBSCRIBER_BUFFER = int(os.environ.get("LIVE_SUBSCRIBER_BUFFER", "100"))
+LIVE_POLL_INTERVAL = float(os.environ.get("LIVE_POLL_INTERVAL", "0.5"))
+# How far below the newest event id a late-committing event may land and still be delivered
+LIVE_REORDER_WINDOW = int(os.environ.get("LIVE_REORDER_WINDOW", "100"))
+# Reconnect delay suggested to EventSource clients
+LIVE_RETRY_MS = int(os.environ.get("LIVE_RETRY_MS", "3000"))
+
+MEDIA_URL = "media/"
+MEDIA_ROOT = os.environ.get("DJANGO_MEDIA_ROOT", os.path.join(BASE_DIR, 'media'))
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+from django.views.static import serve
+from wedding.storage import LocalStorage
+from wedding.views import MetricsView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
@@ -7,4 +11,15 @@ urlpatterns = [
     path('api/', include('wedding.urls')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-]
\ No newline at end of file
+    path('metrics', MetricsView.as_view(), name='metrics'),
+]
+if settings.DEBUG:
+    # The "local" storage backend during development; in production the front web server
+    # serves MEDIA_URL/gallery/objects/ (see GALLERY_LOCAL_STORAGE_ROOT)
+    urlpatterns += [
+        re_path(
+            r'^%s%s/(?P<path>.*)$' % (settings.MEDIA_URL.lstrip('/'), LocalStorage.prefix),
+            serve,
+            {'document_root': LocalStorage().files.location},
+        ),
+    ]
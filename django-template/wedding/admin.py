@@ -1,20 +1,58 @@
 from django.contrib import admin
-from .models import Guest, Gift, Wish, GalleryItem
+from . import jobs, search
+from .models import Guest, Gift, Wish, GalleryItem, Job
+
+
+class IndexedSearchAdmin(admin.ModelAdmin):
+    """
+    Answer the changelist search box from the full-text index (``search.py``)
+    instead of ``search_fields`` LIKE scans; ``search_fields`` only turns the
+    box on.
+    """
+    search_document = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(pk__in=search.matching_ids(self.search_document, search_term)), False
+
 
 @admin.register(Guest)
-class GuestAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email', 'rsvp_status', 'created_at')
+class GuestAdmin(IndexedSearchAdmin):
+    list_display = ('name', 'email', 'rsvp_status', 'checked_in_at', 'created_at')
     search_fields = ('name', 'email')
+    search_document = 'guest'
 
 @admin.register(Gift)
 class GiftAdmin(admin.ModelAdmin):
     list_display = ('title', 'reserved', 'reserved_by')
     list_filter = ('reserved',)
+    list_select_related = ('reserved_by',)
 
 @admin.register(Wish)
-class WishAdmin(admin.ModelAdmin):
+class WishAdmin(IndexedSearchAdmin):
     list_display = ('guest', 'message', 'created_at')
+    list_select_related = ('guest',)
+    search_fields = ('message',)
+    search_document = 'wish'
 
 @admin.register(GalleryItem)
 class GalleryAdmin(admin.ModelAdmin):
-    list_display = ('id', 'guest', 'uploaded_at')
\ No newline at end of file
+    list_display = ('id', 'guest', 'storage_backend', 'uploaded_at')
+    list_filter = ('storage_backend',)
+    list_select_related = ('guest',)
+    search_fields = ('title', '=sha256', '=phash')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'task')
+    readonly_fields = ('lease', 'locked_until', 'result', 'error', 'created_at', 'finished_at')
+    # Payloads may carry tokens until the job finishes
+    exclude = ('payload',)
+    actions = ['requeue']
+
+    @admin.action(description="Requeue selected jobs")
+    def requeue(self, request, queryset):
+        self.message_user(request, f"Requeued {jobs.requeue(queryset)} job(s).")
@@ -5,3 +5,6 @@ class WeddingConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "wedding"
     verbose_name = "Wedding"
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
@@ -0,0 +1,204 @@
+"""
+Guest check-in at the venue door.
+
+Door devices keep the whole guest list locally so looking a guest up costs
+no round-trip:
+
+* ``snapshot`` serves every guest as compact rows under a version made of
+  two ``response_cache`` tokens: "checkin", replaced when a guest is added,
+  edited or removed, and "checkin.arrivals", replaced by each sync. The
+  gzipped body is built once per version and shared through the cache, and
+  devices revalidate it with ``If-None-Match``.
+* ``lookup`` answers from an in-process ``GuestIndex`` for devices without a
+  snapshot yet. It maps word prefixes and trigrams to guests, so a query
+  touches only the guests sharing its rarest key rather than scanning the
+  table. The index follows the "checkin" token alone, so syncs do not force
+  a rebuild; arrival times are read fresh for the results.
+* ``sync`` applies arrivals queued on a device (possibly while offline) in
+  one transaction, with a single ``bulk_update``.
+
+Two doors can check the same guest in, and a device may replay its queue, so
+the earliest arrival wins: a guest's ``checked_in_at`` only ever moves back
+in time. Device clocks running ahead are clamped to the server's.
+"""
+import gzip
+import json
+import threading
+import uuid
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from . import search
+from .models import Guest
+from .response_cache import bump_version, get_version
+
+SCOPE = "checkin"
+ARRIVALS_SCOPE = "checkin.arrivals"
+FIELDS = ("id", "name", "email", "phone", "rsvp_status", "checked_in_at")
+# Query terms shorter than this are matched as word prefixes, longer ones by n-grams
+NGRAM = 3
+BATCH_SIZE = 500
+
+
+def load_rows():
+    """
+    Every guest as a tuple of ``FIELDS``, ordered by name.
+    """
+    rows = [(str(pk), *rest) for pk, *rest in Guest.objects.values_list(*FIELDS).order_by()]
+    rows.sort(key=lambda row: (row[1].lower(), row[0]))
+    return rows
+
+
+def current_version():
+    return f"{get_version(SCOPE)}.{get_version(ARRIVALS_SCOPE)}"
+
+
+def snapshot():
+    """
+    ``(version, body)``: the guest list as gzipped JSON, built once per version.
+    """
+    version = current_version()
+    key = f"wedding:checkin:snapshot:{version}"
+    body = cache.get(key)
+    if body is None:
+        payload = {"version": version, "fields": FIELDS, "guests": load_rows()}
+        content = json.dumps(payload, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+        body = gzip.compress(content, compresslevel=settings.CHECKIN_SNAPSHOT_GZIP_LEVEL, mtime=0)
+        cache.set(key, body, timeout=settings.WEDDING_RESPONSE_CACHE_TTL)
+    return version, body
+
+
+# ---------------------- Lookup ----------------------
+
+class GuestIndex:
+    """
+    Prefix and trigram index over the guest list of one version. Each query
+    term must match every result: a short term as the start of a word (name,
+    email parts, phone digits), a longer one anywhere within one ("mina.k"
+    finds amina.k@example.com, "4567" a phone number). Guests whose words
+    start with every term come first, then by name.
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = rows
+        # Each guest's words, space-led, so one substring test checks a whole row
+        self.haystacks = []
+        self.prefixes = defaultdict(set)
+        self.grams = defaultdict(set)
+        for position, (_, name, email, phone, *_) in enumerate(rows):
+            digits = "".join(ch for ch in phone or "" if ch.isdigit())
+            words = set(search.tokenize(name) + search.tokenize(email) + ([digits] if digits else []))
+            self.haystacks.append(" " + " ".join(words))
+            for word in words:
+                for size in range(1, min(len(word), NGRAM - 1) + 1):
+                    self.prefixes[word[:size]].add(position)
+                for start in range(len(word) - NGRAM + 1):
+                    self.grams[word[start:start + NGRAM]].add(position)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _postings(self, term):
+        """
+        Guests that may match ``term``: those sharing its rarest key.
+        """
+        if len(term) < NGRAM:
+            return self.prefixes.get(term, _NONE)
+        return min((self.grams.get(term[start:start + NGRAM], _NONE) for start in range(len(term) - NGRAM + 1)),
+                   key=len)
+
+    def lookup(self, query, limit=20):
+        terms = list(dict.fromkeys(search.tokenize(query)))[:search.MAX_TERMS]
+        if not terms:
+            return []
+        postings = sorted((self._postings(term) for term in terms), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+
+        word_starts = [" " + term for term in terms]
+        needles = [" " + term if len(term) < NGRAM else term for term in terms]
+        prefixed, inside = [], []
+        # Positions follow name order, so the first hits are the best of their kind
+        for position in sorted(candidates):
+            haystack = self.haystacks[position]
+            if all(start in haystack for start in word_starts):
+                prefixed.append(position)
+                if len(prefixed) == limit:
+                    break
+            elif len(inside) < limit and all(needle in haystack for needle in needles):
+                inside.append(position)
+        return [self.rows[position] for position in (prefixed + inside)[:limit]]
+
+
+_NONE = frozenset()
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    This process's ``GuestIndex`` for the current version.
+    """
+    global _index
+    version = get_version(SCOPE)
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = GuestIndex(version, load_rows())
+            index = _index
+    return index
+
+
+def lookup(query, limit=20):
+    """
+    Matching guests as dicts of ``FIELDS``, with their current arrival time.
+    """
+    results = [dict(zip(FIELDS, row)) for row in get_index().lookup(query, limit)]
+    if results:
+        arrivals = dict(Guest.objects.filter(pk__in=[r["id"] for r in results]).values_list("id", "checked_in_at"))
+        for result in results:
+            result["checked_in_at"] = arrivals.get(uuid.UUID(result["id"]))
+    return results
+
+
+# ---------------------- Arrivals ----------------------
+
+def sync(arrivals):
+    """
+    Record ``(guest_id, checked_in_at)`` arrivals and return one result per
+    guest: "checked_in" if this batch set the time, "already_checked_in" if
+    an earlier arrival stands (its time is returned for the device to
+    adopt), or "not_found".
+    """
+    now = timezone.now()
+    earliest = {}
+    for guest_id, checked_in_at in arrivals:
+        checked_in_at = min(checked_in_at, now)
+        if guest_id not in earliest or checked_in_at < earliest[guest_id]:
+            earliest[guest_id] = checked_in_at
+
+    results, changed = [], []
+    with transaction.atomic():
+        guests = Guest.objects.select_for_update().only("id", "checked_in_at").in_bulk(list(earliest))
+        for guest_id, checked_in_at in earliest.items():
+            guest = guests.get(guest_id)
+            if guest is None:
+                results.append({"guest_id": guest_id, "status": "not_found", "checked_in_at": None})
+                continue
+            if guest.checked_in_at is None or checked_in_at < guest.checked_in_at:
+                guest.checked_in_at = checked_in_at
+                changed.append(guest)
+                outcome = "checked_in"
+            else:
+                outcome = "already_checked_in"
+            results.append({"guest_id": guest_id, "status": outcome, "checked_in_at": guest.checked_in_at})
+        Guest.objects.bulk_update(changed, ["checked_in_at"], batch_size=BATCH_SIZE)
+
+    if changed:
+        # bulk_update sends no post_save; the lookup index needs no rebuild
+        bump_version(ARRIVALS_SCOPE)
+    return results
@@ -0,0 +1,135 @@
+"""
+Google batch HTTP for small Drive calls.
+
+Every upload to a user's Drive is followed by a permission grant (share by
+link) and, when the guest added a description, a metadata update. Each is a
+tiny request, and during the photo rush they come by the hundred. ``execute``
+packs up to ``MAX_CALLS`` of them into one ``multipart/mixed`` POST to
+Drive's batch endpoint, one ``application/http`` part per call, and returns
+each call's status and body in order. Google answers every part on its own,
+so one refused call does not fail the rest of the batch.
+
+The ``drive.grant_permission`` and ``drive.update_metadata`` job tasks use
+it; workers send a batch every ``DRIVE_BATCH_SIZE`` items or once the oldest
+has waited ``DRIVE_BATCH_INTERVAL`` seconds.
+"""
+import json
+import re
+import uuid
+from dataclasses import dataclass
+from email import policy
+from email.parser import BytesParser
+from typing import Optional
+from django.conf import settings
+from .drive_client import get_http_session
+
+BATCH_PATH = "/batch/drive/v3"
+# Google's limit per batch request
+MAX_CALLS = 100
+
+_CONTENT_ID = re.compile(r"item-(\d+)")
+_HEAD_END = re.compile(rb"\r?\n\r?\n")
+
+
+@dataclass
+class Call:
+    method: str
+    path: str
+    body: Optional[dict] = None
+
+
+@dataclass
+class Reply:
+    status: int
+    body: dict
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+
+class BatchError(Exception):
+    """
+    Google refused or failed the batch request as a whole.
+    """
+
+    def __init__(self, status, detail=""):
+        super().__init__(f"Drive batch failed with {status}: {detail}")
+        self.status = status
+
+
+def grant_public_read(file_id):
+    return Call("POST", f"/drive/v3/files/{file_id}/permissions", {"role": "reader", "type": "anyone"})
+
+
+def update_metadata(file_id, metadata):
+    return Call("PATCH", f"/drive/v3/files/{file_id}", metadata)
+
+
+def encode(calls, boundary):
+    """
+    The body of a batch request carrying ``calls``.
+    """
+    parts = []
+    for number, call in enumerate(calls):
+        head = [f"{call.method} {call.path} HTTP/1.1"]
+        payload = b""
+        if call.body is not None:
+            payload = json.dumps(call.body).encode()
+            head += ["Content-Type: application/json; charset=UTF-8", f"Content-Length: {len(payload)}"]
+        parts.append(
+            f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <item-{number}>\r\n\r\n".encode()
+            + "\r\n".join(head).encode() + b"\r\n\r\n" + payload + b"\r\n"
+        )
+    return b"".join(parts) + f"--{boundary}--\r\n".encode()
+
+
+def parse(content_type, body):
+    """
+    ``{call number: Reply}`` from a batch response. Google names each part
+    after the Content-ID of its call and may answer them in any order.
+    """
+    message = BytesParser(policy=policy.HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    replies = {}
+    for part in message.iter_parts():
+        match = _CONTENT_ID.search(part.get("Content-ID", ""))
+        if match is None:
+            continue
+        head, payload = (_HEAD_END.split(part.get_payload(decode=True), 1) + [b""])[:2]
+        status = int(head.split(None, 2)[1])
+        try:
+            reply_body = json.loads(payload) if payload.strip() else {}
+        except ValueError:
+            reply_body = {"body": payload[:200].decode(errors="replace")}
+        replies[int(match[1])] = Reply(status, reply_body)
+    return replies
+
+
+def _send(access_token, calls):
+    boundary = f"batch_{uuid.uuid4().hex}"
+    response = get_http_session().post(
+        f"{settings.GOOGLE_API_ROOT}{BATCH_PATH}",
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": f"multipart/mixed; boundary={boundary}",
+        },
+        data=encode(calls, boundary),
+        timeout=settings.GOOGLE_HTTP_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise BatchError(response.status_code, response.text[:200])
+    replies = parse(response.headers.get("Content-Type", ""), response.content)
+    # A call Google left unanswered is worth another try, like a 503
+    return [replies.get(number, Reply(503, {"error": "No reply in the batch response"})) for number in range(len(calls))]
+
+
+def execute(access_token, calls):
+    """
+    Send ``calls`` as few batch requests as possible and return a ``Reply``
+    per call, in order. Raises ``BatchError`` (or a ``requests`` exception)
+    if a batch request fails as a whole.
+    """
+    replies = []
+    for start in range(0, len(calls), MAX_CALLS):
+        replies += _send(access_token, calls[start:start + MAX_CALLS])
+    return replies
@@ -0,0 +1,273 @@
+"""
+Per-process Google Drive client state shared by every upload path.
+
+Building a Drive service from scratch re-reads ``credentials.json``, parses the
+200 KB discovery document and opens a fresh TLS connection. Everything here is
+created lazily on first use (so it happens after gunicorn forks) and reused:
+
+* the discovery document is parsed once per process;
+* credentials are loaded once and refreshed ahead of expiry under a lock;
+* raw HTTP calls go through one pooled keep-alive ``requests.Session``;
+* googleapiclient services are kept per thread, because httplib2 connections
+  are not thread-safe.
+"""
+import datetime
+import os
+import threading
+import uuid
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.utils.module_loading import import_string
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import MediaIoBaseUpload
+from . import metrics
+
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+GOOGLE_DRIVE_RESUMABLE_URL = "{root}/upload/drive/v3/files?uploadType=resumable"
+# 308 answers in a row that store nothing new before a resumable upload gives up
+MAX_STALLED_CHUNKS = 5
+
+_lock = threading.RLock()
+_local = threading.local()
+_state = {}
+
+
+def reset():
+    """
+    Drop all cached clients, sessions and credentials (tests, credential rotation).
+    """
+    with _lock:
+        session = _state.get("http_session")
+        if session is not None:
+            session.close()
+        _state.clear()
+        _local.__dict__.clear()
+
+
+def get_http_session():
+    """
+    Process-wide keep-alive session for direct calls to Google's REST endpoints.
+    """
+    session = _state.get("http_session")
+    if session is None:
+        with _lock:
+            session = _state.get("http_session")
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4, pool_maxsize=settings.GOOGLE_HTTP_POOL_SIZE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.hooks["response"].append(metrics.record_requests_response)
+                _state["http_session"] = session
+    return session
+
+
+def _discovery_document():
+    doc = _state.get("discovery")
+    if doc is None:
+        with _lock:
+            doc = _state.get("discovery")
+            if doc is None:
+                doc = _state["discovery"] = get_static_doc("drive", "v3")
+    return doc
+
+
+def _needs_refresh(creds):
+    if not creds.token:
+        return True
+    if creds.expiry is None:
+        return False
+    margin = datetime.timedelta(seconds=settings.GOOGLE_TOKEN_REFRESH_MARGIN)
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now <= margin
+
+
+def get_credentials():
+    """
+    Stored OAuth credentials, refreshed once per process when they near expiry.
+    """
+    creds = _state.get("credentials")
+    if creds is not None and not _needs_refresh(creds):
+        return creds
+    with _lock:
+        creds = _state.get("credentials")
+        if creds is None:
+            creds = Credentials.from_authorized_user_file(settings.GOOGLE_DRIVE_CREDENTIALS_FILE, DRIVE_SCOPES)
+        if _needs_refresh(creds):
+            creds.refresh(Request(session=get_http_session()))
+        _state["credentials"] = creds
+    return creds
+
+
+def get_service():
+    """
+    Drive v3 service for the calling thread, built from the cached discovery document.
+    """
+    creds = get_credentials()
+    service = getattr(_local, "service", None)
+    if service is None or _local.credentials is not creds:
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=settings.GOOGLE_HTTP_TIMEOUT))
+        service = build_from_document(_discovery_document(), http=http)
+        _local.service = service
+        _local.credentials = creds
+    return service
+
+
+def get_drive_client():
+    """
+    Shared instance of the client class named by ``GALLERY_DRIVE_CLIENT``.
+    """
+    path = settings.GALLERY_DRIVE_CLIENT
+    clients = _state.setdefault("clients", {})
+    client = clients.get(path)
+    if client is None:
+        with _lock:
+            client = clients.get(path)
+            if client is None:
+                client = clients[path] = import_string(path)()
+    return client
+
+
+def _file_size(fileobj):
+    size = getattr(fileobj, "size", None)
+    if size is None:
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+    return size
+
+
+class UploadedFileMedia(MediaIoBaseUpload):
+    """
+    Resumable media that reads straight from a Django ``File``/``UploadedFile``.
+
+    Works for both memory-backed and temp-file-backed uploads without copying
+    them anywhere first; only one chunk is held in memory at a time.
+    """
+
+    def __init__(self, fileobj, mimetype=None, chunksize=None):
+        mimetype = mimetype or getattr(fileobj, "content_type", None) or "application/octet-stream"
+        super().__init__(fileobj, mimetype, chunksize=chunksize or settings.GOOGLE_DRIVE_CHUNK_SIZE, resumable=True)
+        self._size = _file_size(fileobj)
+
+
+class UploadStalled(Exception):
+    """
+    Drive kept asking for more of a resumable upload without storing any of it.
+    """
+
+
+def resumable_upload(access_token, fileobj, name, mime_type=None, parents=None, chunk_size=None):
+    """
+    Stream ``fileobj`` to Drive with the resumable upload protocol over the shared
+    session, one chunk at a time. Returns the final ``requests.Response``; raises
+    ``UploadStalled`` after ``MAX_STALLED_CHUNKS`` answers that do not advance.
+    """
+    session = get_http_session()
+    chunk_size = chunk_size or settings.GOOGLE_DRIVE_CHUNK_SIZE
+    mime_type = mime_type or getattr(fileobj, "content_type", None) or "application/octet-stream"
+    size = _file_size(fileobj)
+    metadata = {"name": name}
+    if parents:
+        metadata["parents"] = parents
+
+    response = session.post(
+        GOOGLE_DRIVE_RESUMABLE_URL.format(root=settings.GOOGLE_API_ROOT),
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "X-Upload-Content-Type": mime_type,
+            "X-Upload-Content-Length": str(size),
+        },
+        json=metadata,
+        timeout=settings.GOOGLE_HTTP_TIMEOUT,
+    )
+    if response.status_code != 200:
+        return response
+    location = response.headers["Location"]
+
+    offset = 0
+    stalled = 0
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if chunk:
+            content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+        else:
+            content_range = f"bytes */{size}"
+        response = session.put(
+            location,
+            headers={"Content-Range": content_range},
+            data=chunk,
+            timeout=settings.GOOGLE_HTTP_TIMEOUT,
+        )
+        if response.status_code != 308:
+            return response
+        # Drive reports the bytes it has stored so far as "Range: bytes=0-N"
+        received = response.headers.get("Range")
+        stored = int(received.rsplit("-", 1)[1]) + 1 if received else 0
+        stalled = stalled + 1 if stored <= offset else 0
+        if stalled >= MAX_STALLED_CHUNKS:
+            raise UploadStalled(f"Drive stored nothing past byte {stored} of {size} in {stalled} answers")
+        offset = stored
+        fileobj.seek(offset)
+
+
+class GoogleDriveClient:
+    """
+    Uploads files to the wedding Drive folder using the stored OAuth credentials.
+    """
+
+    def __init__(self, folder_id=None):
+        self.folder_id = folder_id or settings.GOOGLE_DRIVE_FOLDER_ID
+
+    def upload(self, fileobj, name, mime_type=None):
+        file_metadata = {"name": name}
+        if self.folder_id:
+            file_metadata["parents"] = [self.folder_id]
+        media = UploadedFileMedia(fileobj, mime_type)
+        request = get_service().files().create(body=file_metadata, media_body=media, fields="id, webViewLink")
+        with metrics.time_google("drive.files.create"):
+            return request.execute(num_retries=2)
+
+    def download(self, file_id):
+        with metrics.time_google("drive.files.get_media"):
+            return get_service().files().get_media(fileId=file_id).execute(num_retries=2)
+
+    def delete(self, file_id):
+        with metrics.time_google("drive.files.delete"):
+            get_service().files().delete(fileId=file_id).execute(num_retries=2)
+
+
+class InMemoryDriveClient:
+    """
+    Local stand-in for Google Drive, used by tests and offline development.
+    Uploaded bytes are kept in ``InMemoryDriveClient.files`` keyed by file id.
+    """
+
+    files = {}
+
+    def __init__(self, folder_id=None):
+        self.folder_id = folder_id
+
+    def upload(self, fileobj, name, mime_type=None):
+        media = UploadedFileMedia(fileobj, mime_type)
+        data = b"".join(
+            media.getbytes(offset, media.chunksize()) for offset in range(0, media.size(), media.chunksize())
+        )
+        file_id = uuid.uuid4().hex
+        self.files[file_id] = {"name": name, "mime_type": mime_type, "data": data}
+        return {"id": file_id, "webViewLink": f"https://drive.google.com/file/d/{file_id}/view"}
+
+    def download(self, file_id):
+        return self.files[file_id]["data"]
+
+    def delete(self, file_id):
+        self.files.pop(file_id, None)
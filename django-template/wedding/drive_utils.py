@@ -1,39 +1,43 @@
-import requests
+from . import jobs
+from .drive_client import resumable_upload
 
-GOOGLE_DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files?uploadType=multipart"
-GOOGLE_DRIVE_PERMISSIONS_URL = "https://www.googleapis.com/drive/v3/files/{file_id}/permissions"
 
-def upload_to_drive(access_token, file, filename, mime_type="image/jpeg"):
+def upload_to_drive(access_token, file, filename, mime_type="image/jpeg", description=None):
     """
-    Uploads a file to Google Drive and returns the file's metadata.
+    Uploads a file to Google Drive and returns the file's metadata. Sharing
+    it by link and setting its description are queued, see
+    ``queue_follow_ups``.
     """
 
-    # Prepare metadata and file content
-    metadata = {"name": filename}
-    files = {
-        "data": ("metadata", str(metadata), "application/json"),
-        "file": (filename, file, mime_type),
-    }
-
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    # Upload file
-    response = requests.post(GOOGLE_DRIVE_UPLOAD_URL, headers=headers, files=files)
+    # Stream the file in resumable chunks instead of building a multipart body in memory
+    response = resumable_upload(access_token, file, filename, mime_type)
     response_json = response.json()
 
-    if response.status_code != 200:
+    if response.status_code not in (200, 201):
         raise Exception(f"Drive upload failed: {response_json}")
 
     file_id = response_json["id"]
-
-    # Set file permissions (anyone with the link can view)
-    perm_data = {"role": "reader", "type": "anyone"}
-    requests.post(
-        GOOGLE_DRIVE_PERMISSIONS_URL.format(file_id=file_id),
-        headers=headers,
-        json=perm_data
-    )
+    queue_follow_ups(access_token, file_id, description)
 
     # Return file link
     response_json["webViewLink"] = f"https://drive.google.com/file/d/{file_id}/view"
     return response_json
+
+
+def queue_follow_ups(access_token, file_id, description=None):
+    """
+    Queue the calls that finish an upload: a permission grant so anyone with
+    the link can view the file and, with ``description``, a metadata update.
+    Workers send them to Drive in batches with those of other uploads.
+    """
+    jobs.enqueue(
+        "drive.grant_permission",
+        {"access_token": access_token, "file_id": file_id},
+        idempotency_key=f"drive-permission:{file_id}",
+    )
+    if description:
+        jobs.enqueue(
+            "drive.update_metadata",
+            {"access_token": access_token, "file_id": file_id, "metadata": {"description": description}},
+            idempotency_key=f"drive-metadata:{file_id}",
+        )
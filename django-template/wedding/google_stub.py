@@ -0,0 +1,289 @@
+"""
+Local stand-in for Google's OAuth token endpoint and the Drive upload API.
+
+Speaks just enough of the real protocols for the app's HTTP clients:
+
+* ``POST /token`` exchanges any non-empty code (except ``"bad"``) for a token;
+* ``POST /upload/drive/v3/files?uploadType=resumable`` opens an upload session;
+* ``PUT /upload/session/<id>`` stores a chunk and answers 308 with ``Range``
+  until the last byte arrives, then 200 with the file's metadata;
+* ``POST /drive/v3/files/<id>/permissions`` records a permission;
+* ``PATCH /drive/v3/files/<id>`` updates a stored file's metadata;
+* ``POST /batch/drive/v3`` unpacks a ``multipart/mixed`` batch, answers each
+  ``application/http`` part as if it had been sent alone and packs the
+  replies the same way, each under ``response-<Content-ID>``.
+
+The server runs on its own asyncio loop in a background thread, so hundreds
+of slow (``latency``) responses can be pending at once without a thread
+each. Point the app at it with ``settings_overrides()`` or the
+``GOOGLE_OAUTH_TOKEN_URL``/``GOOGLE_API_ROOT`` environment variables.
+"""
+import asyncio
+import json
+import re
+import threading
+import uuid
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+ACCESS_TOKEN = "stub-access-token"
+
+_SESSION_PATH = re.compile(r"^/upload/session/(?P<session>[\w-]+)$")
+_PERMISSIONS_PATH = re.compile(r"^/drive/v3/files/(?P<file_id>[\w-]+)/permissions$")
+_FILE_PATH = re.compile(r"^/drive/v3/files/(?P<file_id>[\w-]+)$")
+_BOUNDARY = re.compile(r'boundary="?(?P<boundary>[^";]+)"?')
+# Google's limit on calls per batch request
+BATCH_LIMIT = 100
+
+
+class StubRequest:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        self.url = urlsplit(target)
+        self.path = self.url.path
+        self.query = parse_qs(self.url.query)
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b"{}")
+
+
+def reply(status, payload=None, headers=None):
+    return status, payload, headers or {}
+
+
+class GoogleStubServer:
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.sessions = {}
+        self.files = {}
+        self.permissions = []
+        # Number of calls in each batch request received
+        self.batches = []
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._connections = {}
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def settings_overrides(self):
+        return {"GOOGLE_OAUTH_TOKEN_URL": f"{self.url}/token", "GOOGLE_API_ROOT": self.url}
+
+    # ----- lifecycle -----
+
+    def start(self):
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._serve_connection, self.host, self.port, backlog=1024)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="google-stub", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            # Keep-alive connections outlive the listening socket; end them too
+            tasks = list(self._connections.values())
+            for writer in self._connections:
+                writer.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # ----- HTTP/1.1 plumbing -----
+
+    async def _serve_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, payload, extra = self.handle(StubRequest(method, target, headers, body))
+                writer.write(self._encode(status, payload, extra))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            self._connections.pop(writer, None)
+
+    @staticmethod
+    def _encode(status, payload, headers):
+        # Raw bytes (a batch response) go out as they are, with the caller's Content-Type
+        if isinstance(payload, bytes):
+            body = payload
+        else:
+            body = json.dumps(payload).encode() if payload is not None else b""
+            if payload is not None:
+                headers = {"Content-Type": "application/json", **headers}
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Content-Length: {len(body)}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+    # ----- Google endpoints -----
+
+    def handle(self, request):
+        if request.method == "POST" and request.path == "/token":
+            code = parse_qs(request.body.decode()).get("code", [""])[0]
+            if not code or code == "bad":
+                return reply(400, {"error": "invalid_grant"})
+            return reply(200, {"access_token": ACCESS_TOKEN, "expires_in": 3599, "token_type": "Bearer"})
+
+        if request.method == "PUT":
+            match = _SESSION_PATH.match(request.path)
+            if match:
+                return self._upload_chunk(request, match["session"])
+
+        if request.headers.get("authorization") != f"Bearer {ACCESS_TOKEN}":
+            return reply(401, {"error": {"code": 401, "message": "Invalid Credentials"}})
+
+        if request.method == "POST":
+            if request.path == "/batch/drive/v3":
+                return self._batch(request)
+            if request.path == "/upload/drive/v3/files" and request.query.get("uploadType") == ["resumable"]:
+                return self._open_upload(request)
+            match = _PERMISSIONS_PATH.match(request.path)
+            if match:
+                self.permissions.append((match["file_id"], request.json()))
+                return reply(200, {"id": "anyoneWithLink", **request.json()})
+
+        if request.method == "PATCH":
+            match = _FILE_PATH.match(request.path)
+            if match:
+                stored = self.files.get(match["file_id"])
+                if stored is None:
+                    return reply(404, {"error": {"code": 404, "message": f"File not found: {match['file_id']}"}})
+                stored.update(request.json())
+                return reply(200, {"id": match["file_id"], "name": stored["name"], **request.json()})
+
+        return reply(404, {"error": "not found"})
+
+    def _batch(self, request):
+        match = _BOUNDARY.search(request.headers.get("content-type", ""))
+        if not request.headers.get("content-type", "").startswith("multipart/mixed") or match is None:
+            return reply(400, {"error": "Batch requests must be multipart/mixed with a boundary"})
+        delimiter = b"--" + match["boundary"].encode()
+        sections = request.body.split(delimiter)
+        # Preamble first, then one section per part; the last one starts with "--"
+        if len(sections) < 3 or not sections[-1].startswith(b"--"):
+            return reply(400, {"error": "Malformed multipart body"})
+        parts = sections[1:-1]
+        if len(parts) > BATCH_LIMIT:
+            return reply(400, {"error": f"A batch may hold at most {BATCH_LIMIT} calls"})
+
+        boundary = f"batch_{uuid.uuid4().hex}"
+        out = []
+        for part in parts:
+            part_headers, inner = self._split_message(part.removeprefix(b"\r\n").removesuffix(b"\r\n"))
+            if part_headers.get("content-type") != "application/http":
+                return reply(400, {"error": "Each part must be application/http"})
+            inner_head, inner_body = inner.split(b"\r\n", 1) if b"\r\n" in inner else (inner, b"")
+            method, target, _ = inner_head.decode("latin-1").split(" ", 2)
+            call_headers, call_body = self._split_message(inner_body)
+            # Headers of the outer request (Authorization) apply to every part
+            call_headers = {"authorization": request.headers.get("authorization", ""), **call_headers}
+            status, payload, _ = self.handle(StubRequest(method, target, call_headers, call_body))
+
+            body = json.dumps(payload).encode() if payload is not None else b""
+            content_id = part_headers.get("content-id", "").strip("<>")
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode() + body + b"\r\n"
+            )
+        self.batches.append(len(parts))
+        body = b"".join(out) + f"--{boundary}--\r\n".encode()
+        return reply(200, body, {"Content-Type": f"multipart/mixed; boundary={boundary}"})
+
+    @staticmethod
+    def _split_message(data):
+        """
+        ``(headers, body)`` of a header block, a blank line and a body.
+        """
+        if data.startswith(b"\r\n"):
+            return {}, data[2:]
+        head, _, body = data.partition(b"\r\n\r\n")
+        headers = {}
+        for line in head.decode("latin-1").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+        return headers, body
+
+    def _open_upload(self, request):
+        session = uuid.uuid4().hex
+        self.sessions[session] = {
+            "metadata": request.json(),
+            "mime_type": request.headers.get("x-upload-content-type", "application/octet-stream"),
+            "data": bytearray(),
+        }
+        return reply(200, headers={"Location": f"{self.url}/upload/session/{session}"})
+
+    def _upload_chunk(self, request, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return reply(404, {"error": "no such upload session"})
+
+        # "bytes 0-99/1000", or "bytes */1000" for a status check / empty last chunk
+        spec, total = request.headers.get("content-range", "").removeprefix("bytes ").split("/")
+        if spec != "*":
+            start = int(spec.split("-")[0])
+            del session["data"][start:]
+            session["data"] += request.body
+        if len(session["data"]) < int(total):
+            headers = {"Range": f"bytes=0-{len(session['data']) - 1}"} if session["data"] else {}
+            return reply(308, headers=headers)
+
+        self.sessions.pop(session_id)
+        file_id = uuid.uuid4().hex
+        name = session["metadata"].get("name")
+        self.files[file_id] = {"name": name, "mime_type": session["mime_type"], "data": bytes(session["data"])}
+        return reply(200, {
+            "id": file_id,
+            "name": name,
+            "mimeType": session["mime_type"],
+            "webViewLink": f"https://drive.google.com/file/d/{file_id}/view",
+        })
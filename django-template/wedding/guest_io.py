@@ -0,0 +1,148 @@
+"""
+Guest upserts keyed on email: single RSVPs, bulk import, and streaming export.
+"""
+import csv
+import io
+import json
+from collections import defaultdict
+from dataclasses import dataclass, field
+from django.core.serializers.json import DjangoJSONEncoder
+from . import search, stats
+from .models import Guest
+from .response_cache import bump_version
+from .serializers import GuestUpsertSerializer
+
+EXPORT_FIELDS = ["id", "name", "email", "phone", "rsvp_status", "created_at"]
+IMPORT_FIELDS = ["name", "email", "phone", "rsvp_status"]
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    errors: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {"created": self.created, "updated": self.updated, "errors": self.errors}
+
+
+def rsvp_guest(data):
+    """
+    Validate RSVP form data and create or update the guest with that email.
+    Returns ``(guest, created)``; raises ``ValidationError`` on bad input.
+
+    Uses ``update_or_create`` rather than a ``bulk_create`` upsert: the UUID
+    primary key is generated in Python, so an upsert could not hand back the
+    id of the row that already existed, and it would skip the signals that
+    keep cached responses and dashboard counters current.
+    """
+    serializer = GuestUpsertSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    # A form post that leaves out the rsvp_status checkbox validates as False;
+    # only overwrite the fields the client actually sent
+    defaults = {key: value for key, value in serializer.validated_data.items() if key in data}
+    email = defaults.pop("email")
+    return Guest.objects.update_or_create(email=email, defaults=defaults)
+
+
+def read_rows(stream, fmt):
+    """
+    Yield dict rows from a text stream of CSV (with a header) or NDJSON.
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield {"__error__": f"Invalid JSON: {exc}"}
+
+
+def import_guests(rows, batch_size=500):
+    """
+    Validate rows and upsert them in batches of ``batch_size`` with
+    ``bulk_create(update_conflicts=True)`` keyed on email, one statement per
+    set of columns in the batch, so an existing guest only has the columns
+    present in its own row overwritten. Invalid rows are skipped and reported
+    by their 1-based position.
+    """
+    result = ImportResult()
+    batch = {}
+
+    for number, row in enumerate(rows, start=1):
+        if "__error__" in row:
+            result.errors.append({"row": number, "errors": {"non_field_errors": [row["__error__"]]}})
+            continue
+        row = {key: value for key, value in row.items() if key in IMPORT_FIELDS and value not in (None, "")}
+        serializer = GuestUpsertSerializer(data=row)
+        if not serializer.is_valid():
+            result.errors.append({"row": number, "errors": serializer.errors})
+            continue
+
+        data = serializer.validated_data
+        # A repeated email within one batch would hit the same row twice in one
+        # INSERT ... ON CONFLICT statement; the later row wins.
+        batch[data["email"]] = data
+        if len(batch) >= batch_size:
+            _flush(batch, result)
+            batch = {}
+
+    if batch:
+        _flush(batch, result)
+    if result.created or result.updated:
+        # Bulk writes send no signals; gifts, photos and the check-in list embed guest data
+        bump_version("gift", "gallery", "checkin")
+        stats.recount_guests()
+    return result
+
+
+def _flush(batch, result):
+    existing = dict(Guest.objects.filter(email__in=batch).values_list("email", "pk"))
+    # Guest(**data) fills the columns a row leaves out with defaults, so each
+    # statement may only overwrite the columns all of its rows carry
+    groups = defaultdict(list)
+    for data in batch.values():
+        groups[frozenset(data)].append(Guest(**data))
+    for columns, guests in groups.items():
+        Guest.objects.bulk_create(
+            guests,
+            update_conflicts=True,
+            unique_fields=["email"],
+            update_fields=sorted(columns - {"email"}),
+        )
+    # bulk_create sends no post_save; index under the id each row ended up with
+    # (name and email, the indexed fields, are in every row)
+    guests = [guest for group in groups.values() for guest in group]
+    for guest in guests:
+        guest.pk = existing.get(guest.email, guest.pk)
+    search.index("guest", guests)
+    result.updated += len(existing)
+    result.created += len(batch) - len(existing)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_guests(fmt, chunk_size=2000):
+    """
+    Yield the guest list as CSV or NDJSON lines, reading rows from the
+    database ``chunk_size`` at a time so memory stays flat.
+    """
+    rows = Guest.objects.order_by("created_at").values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    if fmt == "csv":
+        writer = csv.writer(_Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def text_stream(binary_file):
+    return io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
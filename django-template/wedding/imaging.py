@@ -0,0 +1,104 @@
+"""
+Responsive image variants for gallery uploads.
+
+Each photo is decoded once (JPEGs at a reduced DCT scale when the largest
+variant is smaller than the source), rotated according to its EXIF
+orientation, and then downscaled step by step from the largest configured
+size to the smallest, encoding each step as it goes. The perceptual hash is
+taken from the smallest step, so it needs no second decode.
+"""
+import io
+import logging
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+logger = logging.getLogger(__name__)
+
+
+def _output_format():
+    if settings.GALLERY_IMAGE_FORMAT.upper() == "WEBP" and features.check("webp"):
+        return "WEBP", "image/webp", "webp"
+    return "JPEG", "image/jpeg", "jpg"
+
+
+def render_variants(fileobj):
+    """
+    Return ``(name, buffer, info)`` for every size in ``GALLERY_IMAGE_VARIANTS``,
+    largest first. ``info`` holds width, height, format and mime_type.
+    Files Pillow cannot read (videos, corrupt uploads) or refuses to decode
+    (decompression bombs) produce no variants.
+    """
+    return render(fileobj)[0]
+
+
+def render(fileobj, with_hash=False):
+    """
+    ``(variants, phash)``: the variants of ``render_variants`` and, with
+    ``with_hash``, the ``perceptual_hash`` of the same decoded image ("" for
+    non-images, None without ``with_hash``).
+    """
+    sizes = sorted(settings.GALLERY_IMAGE_VARIANTS.items(), key=lambda kv: kv[1], reverse=True)
+    if not sizes:
+        return [], perceptual_hash(fileobj) if with_hash else None
+    fmt, mime_type, extension = _output_format()
+    empty = ([], "" if with_hash else None)
+
+    fileobj.seek(0)
+    try:
+        image = Image.open(fileobj)
+        largest = sizes[0][1]
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA") or (fmt == "JPEG" and image.mode == "RGBA"):
+            image = image.convert("RGB")
+    except UnidentifiedImageError:
+        return empty
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        logger.warning("Could not decode image for variants: %s", exc)
+        return empty
+
+    variants = []
+    for name, max_side in sizes:
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, fmt, quality=settings.GALLERY_IMAGE_QUALITY)
+        buffer.seek(0)
+        variants.append((name, buffer, {
+            "width": image.width,
+            "height": image.height,
+            "format": extension,
+            "mime_type": mime_type,
+        }))
+    return variants, _dhash(image) if with_hash else None
+
+
+def perceptual_hash(fileobj):
+    """
+    64-bit difference hash (dHash) as 16 hex digits, or "" for non-images.
+    Resized or recompressed copies of a photo (e.g. forwarded through
+    WhatsApp) land within a few bits of the original; compare with
+    ``hamming_distance``.
+    """
+    fileobj.seek(0)
+    try:
+        image = Image.open(fileobj)
+        image.draft("L", (64, 64))
+        return _dhash(ImageOps.exif_transpose(image))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return ""
+    finally:
+        fileobj.seek(0)
+
+
+def _dhash(image):
+    pixels = list(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def hamming_distance(first, second):
+    return bin(int(first, 16) ^ int(second, 16)).count("1")
@@ -0,0 +1,420 @@
+"""
+Database-backed background jobs for outbound work that should not hold up a
+request.
+
+A view records what has to happen with ``enqueue``, in the same transaction
+as its own writes, and returns. ``manage.py run_jobs`` workers claim due jobs
+and run them on a thread pool, so slow calls to Google scale with the number
+of workers instead of tying up web threads.
+
+* Tasks are plain functions registered with ``@task(name)`` and called with
+  the job's payload as keyword arguments. Their return value is stored as
+  the job's result.
+* Claiming is a conditional UPDATE, as in ``upload_queue``. It leases the
+  job to one worker for the task's visibility timeout. If the worker dies,
+  the lease runs out and another worker takes the job, so a task may run
+  more than once and must tolerate that.
+* A failed attempt is retried after an exponential backoff with jitter:
+  ``JOB_RETRY_BASE_SECONDS``, doubling per attempt up to
+  ``JOB_RETRY_MAX_SECONDS``. When the attempts run out, or the task raises
+  ``PermanentError``, the job is dead. It stays in the table with its last
+  error until an admin requeues it.
+* ``enqueue`` with an idempotency key already in use returns the existing
+  job instead of adding another, e.g. when a browser replays a callback.
+* Payload keys listed in a task's ``secret_fields`` (tokens, one-time codes)
+  are never shown in the job status endpoint. They stay in the payload only
+  while a retry may need them, and are dropped once the job is finished.
+  The same keys in a result are for one reader, who takes them with
+  ``collect_result``; that clears them from the table.
+* A batch task (``batch_size``) gets many jobs in one call, for upstream APIs
+  that accept several operations per request. Each job still has its own
+  attempts, backoff and outcome.
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Optional
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Job, JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentError(Exception):
+    """
+    Raised by a task when another attempt cannot succeed (refused input,
+    revoked access); the job goes straight to dead.
+    """
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    func: Callable
+    max_attempts: Optional[int] = None
+    # Seconds a worker may hold the job before another one takes it over
+    timeout: Optional[int] = None
+    secret_fields: tuple = ()
+    # Called with the payload when the job dies, to release what it held (spooled files)
+    on_dead: Optional[Callable] = None
+    # Jobs per call of a batch task, and how long the oldest may wait for a batch to fill;
+    # numbers or callables, so they can follow settings
+    batch_size: Optional[object] = None
+    batch_wait: Optional[object] = None
+
+
+TASKS = {}
+
+
+def task(name, max_attempts=None, timeout=None, secret_fields=(), on_dead=None, batch_size=None, batch_wait=None):
+    """
+    Register the decorated function as the task ``name``.
+
+    With ``batch_size`` the function takes a list of payloads instead and
+    returns one outcome per payload, in order: its result, or the exception
+    that failed it. Workers call it once ``batch_size`` jobs are due or the
+    oldest has waited ``batch_wait`` seconds.
+    """
+    def register(func):
+        TASKS[name] = Task(name, func, max_attempts, timeout, tuple(secret_fields), on_dead, batch_size, batch_wait)
+        return func
+    return register
+
+
+def _value(setting):
+    return setting() if callable(setting) else setting
+
+
+def _batch_tasks(tasks=None):
+    return [name for name, spec in TASKS.items() if spec.batch_size and (not tasks or name in tasks)]
+
+
+def _timeout(name):
+    spec = TASKS.get(name)
+    return (spec and spec.timeout) or settings.JOB_VISIBILITY_TIMEOUT
+
+
+def backoff(attempts):
+    """
+    Seconds to wait before retrying a job that has failed ``attempts`` times.
+    """
+    delay = min(settings.JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_SECONDS)
+    # Jitter, so jobs that failed together (Google hiccup) do not retry together
+    return delay * random.uniform(0.5, 1)
+
+
+# ---------------------- Producing ----------------------
+
+def enqueue(name, payload, idempotency_key="", delay=0):
+    """
+    Queue task ``name`` with ``payload`` and return the job, or the existing
+    job if ``idempotency_key`` was used before. Workers see the job once the
+    surrounding transaction commits.
+    """
+    if name not in TASKS:
+        raise ValueError(f"Unknown task {name!r}")
+    job = Job(
+        task=name,
+        payload=payload,
+        idempotency_key=idempotency_key,
+        max_attempts=TASKS[name].max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if idempotency_key:
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            return Job.objects.get(idempotency_key=idempotency_key)
+    else:
+        job.save()
+    if settings.JOBS_EAGER and not delay:
+        def run_now():
+            run(job.pk)
+            job.refresh_from_db()
+        transaction.on_commit(run_now)
+    return job
+
+
+def requeue(queryset):
+    """
+    Give dead (or stuck) jobs a fresh set of attempts, due now.
+    """
+    return queryset.exclude(status=JobStatus.DONE).update(
+        status=JobStatus.QUEUED, attempts=0, run_at=timezone.now(), lease="", locked_until=None, error="",
+        finished_at=None,
+    )
+
+
+def public_result(job):
+    """
+    The job's result without its task's secret fields, for status responses.
+    """
+    if not isinstance(job.result, dict):
+        return job.result
+    secret = TASKS[job.task].secret_fields if job.task in TASKS else ()
+    return {key: value for key, value in job.result.items() if key not in secret}
+
+
+def collect_result(job):
+    """
+    Hand over the result of a finished job, secret fields included, and clear
+    those fields from the stored result so they are handed over only once.
+    """
+    public = public_result(job)
+    if public != job.result:
+        Job.objects.filter(pk=job.pk).update(result=public)
+    return job.result
+
+
+# ---------------------- Consuming ----------------------
+
+def _claimable(now):
+    return Q(status=JobStatus.QUEUED, run_at__lte=now) | Q(status=JobStatus.RUNNING, locked_until__lt=now)
+
+
+def _lease(job_id, name, now):
+    lease = uuid.uuid4().hex
+    claimed = Job.objects.filter(_claimable(now), pk=job_id).update(
+        status=JobStatus.RUNNING,
+        lease=lease,
+        locked_until=now + timedelta(seconds=_timeout(name)),
+        attempts=F("attempts") + 1,
+    )
+    return lease if claimed else None
+
+
+def claim(limit, tasks=None):
+    """
+    Lease up to ``limit`` due jobs, oldest first, including running jobs
+    whose worker let the lease expire. Returns ``(job_id, lease)`` pairs.
+    """
+    now = timezone.now()
+    # Batch tasks are claimed by claim_batch
+    queued = Job.objects.filter(status=JobStatus.QUEUED, run_at__lte=now).exclude(task__in=_batch_tasks())
+    expired = Job.objects.filter(status=JobStatus.RUNNING, locked_until__lt=now).exclude(task__in=_batch_tasks())
+    if tasks:
+        queued, expired = queued.filter(task__in=tasks), expired.filter(task__in=tasks)
+    candidates = list(expired.order_by("locked_until").values_list("pk", "task")[:limit])
+    candidates += queued.order_by("run_at").values_list("pk", "task")[:limit]
+
+    claimed = []
+    for job_id, name in candidates:
+        # Workers polling side by side race for the same rows; the UPDATE picks one
+        lease = _lease(job_id, name, now)
+        if lease:
+            claimed.append((job_id, lease))
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def claim_batch(name, force=False):
+    """
+    Lease the next batch of the batch task ``name``: its oldest due jobs, up
+    to its batch size, once that many are due or the oldest has waited the
+    batch wait; with ``force``, whatever is due. Returns ``(job_id, lease)``
+    pairs, empty while the batch is still filling.
+    """
+    spec = TASKS[name]
+    now = timezone.now()
+    due = list(
+        Job.objects.filter(_claimable(now), task=name).order_by("run_at").values_list("pk", "run_at")
+        [:_value(spec.batch_size)]
+    )
+    if not due:
+        return []
+    full = len(due) == _value(spec.batch_size)
+    waited = due[0][1] <= now - timedelta(seconds=_value(spec.batch_wait) or 0)
+    if not (force or full or waited):
+        return []
+    claimed = []
+    for job_id, _ in due:
+        lease = _lease(job_id, name, now)
+        if lease:
+            claimed.append((job_id, lease))
+    return claimed
+
+
+def _finish(job, lease, **fields):
+    spec = TASKS.get(job.task)
+    if fields["status"] in (JobStatus.DONE, JobStatus.DEAD) and spec and spec.secret_fields:
+        fields["payload"] = {key: value for key, value in job.payload.items() if key not in spec.secret_fields}
+    # Only the lease holder may record the outcome
+    recorded = Job.objects.filter(pk=job.pk, lease=lease, status=JobStatus.RUNNING).update(
+        lease="", locked_until=None, **fields,
+    )
+    if not recorded:
+        logger.warning("Job %s (%s) lost its lease before finishing", job.pk, job.task)
+    return recorded
+
+
+def _call(spec, batch):
+    """
+    Outcome of each job in ``batch``: its task's result or the exception it raised.
+    """
+    try:
+        if spec is None:
+            raise PermanentError(f"Unknown task {batch[0].task!r}")
+        if not spec.batch_size:
+            return [spec.func(**job.payload) for job in batch]
+        outcomes = list(spec.func([job.payload for job in batch]))
+        if len(outcomes) != len(batch):
+            raise RuntimeError(f"Batch task returned {len(outcomes)} outcomes for {len(batch)} jobs")
+        return outcomes
+    except Exception as exc:
+        return [exc] * len(batch)
+
+
+def _settle(job, lease, spec, outcome):
+    """
+    Record ``outcome`` for ``job``: done, retried after a backoff, or dead.
+    """
+    if not isinstance(outcome, Exception):
+        _finish(job, lease, status=JobStatus.DONE, result=outcome, error="", finished_at=timezone.now())
+    elif isinstance(outcome, PermanentError) or job.attempts >= job.max_attempts:
+        logger.error("Job %s (%s) is dead after %s attempt(s): %s", job.pk, job.task, job.attempts, outcome)
+        recorded = _finish(job, lease, status=JobStatus.DEAD, error=str(outcome), finished_at=timezone.now())
+        if recorded and spec and spec.on_dead:
+            try:
+                spec.on_dead(**job.payload)
+            except Exception:
+                logger.exception("Cleaning up dead job %s failed", job.pk)
+    else:
+        delay = backoff(job.attempts)
+        logger.warning("Job %s (%s) failed (attempt %s), retrying in %.0f s: %s",
+                       job.pk, job.task, job.attempts, delay, outcome)
+        _finish(job, lease, status=JobStatus.QUEUED, error=str(outcome), run_at=timezone.now() + timedelta(seconds=delay))
+
+
+def run(job_id, lease=None):
+    """
+    Run one job. Without ``lease`` the job is claimed first (eager mode);
+    returns None if it is not due or another worker holds it.
+    """
+    if lease is None:
+        name = Job.objects.filter(pk=job_id).values_list("task", flat=True).first()
+        lease = _lease(job_id, name, timezone.now()) if name else None
+        if lease is None:
+            return None
+    job = Job.objects.get(pk=job_id)
+    spec = TASKS.get(job.task)
+    [outcome] = _call(spec, [job])
+    _settle(job, lease, spec, outcome)
+    job.refresh_from_db()
+    return job
+
+
+def run_batch(claimed):
+    """
+    Run the jobs of one batch (from ``claim_batch``) in a single call of
+    their task; returns the jobs.
+    """
+    leases = dict(claimed)
+    batch = list(Job.objects.filter(pk__in=leases).order_by("run_at", "pk"))
+    if not batch:
+        return []
+    spec = TASKS.get(batch[0].task)
+    for job, outcome in zip(batch, _call(spec, batch)):
+        _settle(job, leases[job.pk], spec, outcome)
+    finished = Job.objects.in_bulk(leases)
+    return [finished[job.pk] for job in batch]
+
+
+def run_due(tasks=None):
+    """
+    Run every due job on this thread, including jobs queued along the way,
+    and return them. Batches are sent without waiting for them to fill.
+    ``work`` is the worker loop; this is for tests and one-off use.
+    """
+    finished = []
+    while True:
+        ran = [run(job_id, lease) for job_id, lease in claim(100, tasks)]
+        for name in _batch_tasks(tasks):
+            while batch := claim_batch(name, force=True):
+                ran += run_batch(batch)
+        if not ran:
+            return finished
+        finished += ran
+
+
+def _run_in_worker(job_id, lease):
+    close_old_connections()
+    try:
+        run(job_id, lease)
+    except Exception:
+        logger.exception("Job %s crashed", job_id)
+    finally:
+        close_old_connections()
+    return 1
+
+
+def _run_batch_in_worker(claimed):
+    close_old_connections()
+    try:
+        run_batch(claimed)
+    except Exception:
+        logger.exception("Batch of jobs %s crashed", [job_id for job_id, _ in claimed])
+    finally:
+        close_old_connections()
+    return len(claimed)
+
+
+def purge(older_than=None):
+    """
+    Delete jobs that finished successfully more than ``older_than`` ago
+    (default ``JOB_RETENTION_HOURS``). Dead jobs are kept for inspection.
+    """
+    older_than = older_than or timedelta(hours=settings.JOB_RETENTION_HOURS)
+    return Job.objects.filter(status=JobStatus.DONE, finished_at__lt=timezone.now() - older_than).delete()[0]
+
+
+def work(threads, tasks=None, once=False, poll_interval=None, stop=None):
+    """
+    Claim jobs and run them on ``threads`` threads until ``stop`` is set or,
+    with ``once``, until nothing is due (sending batches without waiting for
+    them to fill). Returns the number of jobs run.
+    """
+    stop = stop or threading.Event()
+    poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    running, ran = set(), 0
+    purged_at = 0
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="jobs") as pool:
+        while not stop.is_set():
+            finished = {future for future in running if future.done()}
+            running -= finished
+            ran += sum(future.result() for future in finished)
+
+            if time.monotonic() - purged_at > 3600:
+                purge()
+                purged_at = time.monotonic()
+
+            claimed = claim(threads - len(running), tasks) if len(running) < threads else []
+            for job_id, lease in claimed:
+                running.add(pool.submit(_run_in_worker, job_id, lease))
+            batches = []
+            for name in _batch_tasks(tasks):
+                if len(running) >= threads:
+                    break
+                batch = claim_batch(name, force=once)
+                if batch:
+                    batches.append(batch)
+                    running.add(pool.submit(_run_batch_in_worker, batch))
+            if claimed or batches:
+                continue
+            if once and not running:
+                break
+            if running:
+                wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            else:
+                close_old_connections()
+                stop.wait(poll_interval)
+    return ran + sum(future.result() for future in running)
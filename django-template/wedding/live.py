@@ -0,0 +1,381 @@
+"""
+Live updates for the venue screen and guests' phones, over Server-Sent Events.
+
+Writes that matter to a live view (a new wish, a photo that finished
+uploading, a gift being reserved or released) publish a small delta once
+their transaction commits. ``publish`` appends it to the ``LiveEvent`` log,
+whose id doubles as the resume cursor, and hands it to the broker.
+
+The broker named by ``LIVE_BROKER`` gets the event to every process serving
+streams:
+
+* ``LocalBroker`` (default) delivers straight to this process's hub, which
+  is all a single uvicorn process needs;
+* ``DatabaseBroker`` lets each process poll the log for new rows (one query
+  per interval, only while it has subscribers), for several workers without
+  extra infrastructure. Anything with ``publish(event)`` and ``start()``
+  (e.g. a Redis pub/sub bridge) can be plugged in the same way.
+
+The hub fans an event out with one ``call_soon_threadsafe`` per event loop,
+and the SSE frame is encoded once for all subscribers. An idle subscriber is
+a coroutine parked on its queue, so hundreds of open connections cost nothing
+between events. A subscriber that falls more than ``LIVE_SUBSCRIBER_BUFFER``
+events behind is told to reset and refetch instead of being buffered without
+bound.
+
+Ids come from the database sequence when a row is inserted, but rows become
+visible when they commit, which is not always in id order. So neither a
+stream nor the ``DatabaseBroker`` trusts a single high-water mark: each
+remembers the ids it has handled within ``LIVE_REORDER_WINDOW`` of the
+highest (``RecentIds``) and lets a late, lower id through once.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+from .models import LiveEvent
+
+logger = logging.getLogger(__name__)
+
+TOPICS = ("wishes", "gallery", "gifts")
+# Wishes carry the message and the guest's name, which only staff may read (as on /api/wishes/)
+STAFF_TOPICS = ("wishes",)
+
+
+@dataclass
+class Event:
+    id: int
+    topic: str
+    kind: str
+    data: dict
+    frame: bytes = field(init=False, repr=False)
+
+    def __post_init__(self):
+        payload = json.dumps({"kind": self.kind, "topic": self.topic, "data": self.data}, cls=DjangoJSONEncoder)
+        self.frame = f"id: {self.id}\ndata: {payload}\n\n".encode()
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.pk, row.topic, row.kind, row.data)
+
+
+def control_frame(name, data, cursor=None):
+    """
+    SSE frame for a named control event ("hello", "reset").
+    """
+    cursor_line = f"id: {cursor}\n" if cursor is not None else ""
+    return f"{cursor_line}event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+HEARTBEAT_FRAME = b": keep-alive\n\n"
+
+
+def retry_frame():
+    return f"retry: {settings.LIVE_RETRY_MS}\n\n".encode()
+
+
+class RecentIds:
+    """
+    Ids handled lately: everything within ``LIVE_REORDER_WINDOW`` of the
+    highest one is remembered, anything further below counts as handled.
+    """
+
+    def __init__(self, high=0, ids=()):
+        self.high = high
+        self.ids = set()
+        for event_id in ids:
+            self.add(event_id)
+
+    def add(self, event_id):
+        """
+        Record ``event_id``; False if it was already handled.
+        """
+        if event_id in self.ids or event_id <= self.high - settings.LIVE_REORDER_WINDOW:
+            return False
+        self.ids.add(event_id)
+        if event_id > self.high:
+            self.high = event_id
+            floor = event_id - settings.LIVE_REORDER_WINDOW
+            self.ids = {seen for seen in self.ids if seen > floor}
+        return True
+
+
+# ---------------------- In-process fan-out ----------------------
+
+class Subscription:
+    OVERFLOW = object()
+
+    def __init__(self, topics, loop, size):
+        self.topics = frozenset(topics)
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(self.OVERFLOW)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Hub:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_loop = {}
+
+    def subscribe(self, topics):
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(topics, loop, settings.LIVE_SUBSCRIBER_BUFFER)
+        with self._lock:
+            self._by_loop.setdefault(loop, set()).add(subscription)
+        get_broker().start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._by_loop.get(subscription.loop)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._by_loop[subscription.loop]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._by_loop.values())
+
+    def dispatch(self, event):
+        """
+        Hand ``event`` to every subscriber of its topic; safe from any thread.
+        """
+        with self._lock:
+            targets = [(loop, [s for s in subscribers if event.topic in s.topics])
+                       for loop, subscribers in self._by_loop.items()]
+        for loop, subscribers in targets:
+            if not subscribers:
+                continue
+            try:
+                loop.call_soon_threadsafe(_fan_out, subscribers, event)
+            except RuntimeError:
+                # The loop has closed under its subscribers
+                with self._lock:
+                    self._by_loop.pop(loop, None)
+
+
+def _fan_out(subscribers, event):
+    for subscription in subscribers:
+        subscription.deliver(event)
+
+
+hub = Hub()
+
+
+# ---------------------- Brokers ----------------------
+
+class LocalBroker:
+    """
+    Deliver events only within this process.
+    """
+
+    def publish(self, event):
+        hub.dispatch(event)
+
+    def start(self):
+        pass
+
+
+class DatabaseBroker:
+    """
+    Every process polls the event log, so events reach subscribers whichever
+    worker wrote them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.seen = None
+
+    def publish(self, event):
+        # The poller picks it up from the log, in this process as in the others
+        pass
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="live-events-poller", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if len(hub):
+                    self.poll()
+                else:
+                    # Nobody listening: pick up from the newest event when someone does
+                    self.seen = None
+            except Exception:
+                logger.exception("Polling live events failed")
+            finally:
+                close_old_connections()
+            time.sleep(settings.LIVE_POLL_INTERVAL)
+
+    def poll(self):
+        if self.seen is None:
+            self.seen = RecentIds(latest_cursor())
+            return
+        # Re-read the window below the newest id for rows that committed late
+        since = self.seen.high - settings.LIVE_REORDER_WINDOW
+        rows = LiveEvent.objects.filter(id__gt=since).order_by("id")[:settings.LIVE_EVENT_RETENTION]
+        for row in rows:
+            if self.seen.add(row.pk):
+                hub.dispatch(Event.from_row(row))
+
+
+_brokers = {}
+
+
+def get_broker():
+    path = settings.LIVE_BROKER
+    broker = _brokers.get(path)
+    if broker is None:
+        broker = _brokers.setdefault(path, import_string(path)())
+    return broker
+
+
+# ---------------------- Publishing and replay ----------------------
+
+def publish(topic, kind, data):
+    """
+    Record a delta and broadcast it. Returns the ``Event``.
+    """
+    row = LiveEvent.objects.create(topic=topic, kind=kind, data=data)
+    if row.pk % 100 == 0:
+        LiveEvent.objects.filter(id__lte=row.pk - settings.LIVE_EVENT_RETENTION).delete()
+    event = Event.from_row(row)
+    get_broker().publish(event)
+    return event
+
+
+def publish_on_commit(topic, kind, data):
+    transaction.on_commit(lambda: publish(topic, kind, data))
+
+
+def latest_cursor():
+    return LiveEvent.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def replay(cursor, topics):
+    """
+    Events after ``cursor`` for ``topics``, oldest first, or None if the log
+    no longer reaches back that far and the client has to refetch.
+    """
+    oldest = LiveEvent.objects.order_by("id").values_list("id", flat=True).first()
+    if oldest is not None and cursor < oldest - 1:
+        return None
+    rows = LiveEvent.objects.filter(id__gt=cursor, topic__in=topics).order_by("id")[:settings.LIVE_EVENT_RETENTION]
+    return [Event.from_row(row) for row in rows]
+
+
+def parse_cursor(value):
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor >= 0 else None
+
+
+def opening(cursor, topics):
+    """
+    Frames that bring a client up to date, and the cursor they reach. Without
+    a cursor the client starts from now; with one it gets what it missed, or
+    a reset telling it to refetch if that is no longer in the log.
+    """
+    frames, latest, _ = _catch_up(cursor, topics)
+    return frames, latest
+
+
+def _catch_up(cursor, topics):
+    # ``opening``, plus the ids of the events it replayed
+    latest = latest_cursor()
+    if cursor is None:
+        return [control_frame("hello", {"cursor": latest}, latest)], latest, []
+    if cursor >= latest:
+        return [control_frame("hello", {"cursor": cursor}, cursor)], cursor, []
+    events = replay(cursor, topics)
+    if events is None:
+        return [control_frame("reset", {"cursor": latest}, latest)], latest, []
+    events = [event for event in events if event.id <= latest]
+    frames = [event.frame for event in events] + [control_frame("hello", {"cursor": latest}, latest)]
+    return frames, latest, [event.id for event in events]
+
+
+async def stream(topics, cursor):
+    """
+    Async iterator of SSE frames for one client, until it disconnects.
+    """
+    yield retry_frame()
+    # Subscribe before reading the log so nothing committed in between is lost
+    subscription = hub.subscribe(topics)
+    try:
+        frames, latest, replayed = await sync_to_async(_catch_up)(cursor, topics)
+        # Events may reach the hub out of id order, and those replayed may reach it too
+        delivered = RecentIds(latest, replayed)
+        for frame in frames:
+            yield frame
+        while True:
+            try:
+                event = await subscription.get(settings.LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT_FRAME
+                continue
+            if event is Subscription.OVERFLOW:
+                # Too far behind: tell the client to refetch from now, and close
+                latest = await sync_to_async(latest_cursor)()
+                yield control_frame("reset", {"cursor": latest}, latest)
+                return
+            if delivered.add(event.id):
+                yield event.frame
+    finally:
+        hub.unsubscribe(subscription)
+
+
+# ---------------------- Deltas ----------------------
+
+def wish_delta(wish):
+    return {
+        "id": str(wish.pk),
+        "message": wish.message,
+        "guest_name": wish.guest.name,
+        "created_at": wish.created_at,
+    }
+
+
+def photo_delta(item):
+    return {
+        "id": str(item.pk),
+        "title": item.title,
+        "caption": item.caption,
+        "image": item.image,
+        "variants": {name: variant["url"] for name, variant in (item.variants or {}).items()},
+        "uploaded_at": item.uploaded_at,
+    }
+
+
+def gift_delta(gift):
+    return {"id": str(gift.pk), "title": gift.title, "reserved": gift.reserved}
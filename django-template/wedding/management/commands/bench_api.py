@@ -0,0 +1,479 @@
+import io
+import json
+import math
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from PIL import Image
+from wedding import seed
+from wedding.drive_client import InMemoryDriveClient
+from wedding.models import Guest, Gift, Wish, GalleryItem
+from wedding.urls import router
+
+
+@dataclass
+class Endpoint:
+    route: str
+    method: str
+    # Request number -> (path, client keyword arguments)
+    request: Callable
+    # Most SQL queries one request may run, whatever the table sizes
+    max_queries: int
+    admin: bool = False
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "max_ms": None, "mean_ms": None}
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[max(math.ceil(len(latencies) * 0.95) - 1, 0)] * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+def as_json(data):
+    return {"data": data, "content_type": "application/json"}
+
+
+def as_multipart(data):
+    # Client only encodes multipart bodies itself for POST
+    return {"data": encode_multipart(BOUNDARY, data), "content_type": MULTIPART_CONTENT}
+
+
+def wait_for_sqlite_locks(sender, connection, **kwargs):
+    # Each peak worker thread opens its own connection
+    if connection.vendor == "sqlite":
+        connection.connection.execute("PRAGMA busy_timeout = 30000")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every API router route in-process (latency, throughput and SQL queries per request) "
+        "on seeded data, then replay a concurrent reception-peak traffic mix. Uploads go to an in-memory "
+        "fake Drive. Runs on a throwaway test database unless --in-place is given."
+    )
+
+    # Reception peak: what guests do at once, by weight
+    PEAK_MIX = {
+        "browse_gallery": 35,
+        "browse_gifts": 10,
+        "post_wish": 20,
+        "upload_photo": 20,
+        "rsvp": 10,
+        "reserve": 5,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument("--guests", type=int, default=500)
+        parser.add_argument("--gifts", type=int, default=100)
+        parser.add_argument("--wishes", type=int, default=1000)
+        parser.add_argument("--photos", type=int, default=1000)
+        parser.add_argument("--iterations", type=int, default=30, help="Measured requests per endpoint.")
+        parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per endpoint.")
+        parser.add_argument("--peak-requests", type=int, default=400, help="Requests in the reception peak; 0 skips it.")
+        parser.add_argument("--concurrency", type=int, default=16, help="Guests acting at once during the peak.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--in-place", action="store_true",
+                            help="Use the configured database instead of a throwaway test database.")
+        parser.add_argument("--check", action="store_true", help="Fail if an endpoint exceeds its query budget.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--compare", help="JSON results of an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        old_name = None
+        if not options["in_place"]:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        media_root = tempfile.mkdtemp()
+        overrides = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            MEDIA_ROOT=media_root,
+            GALLERY_STORAGE="drive",
+            GALLERY_DRIVE_CLIENT="wedding.drive_client.InMemoryDriveClient",
+            GALLERY_UPLOAD_MODE="queued",
+            # Push uploads to the fake Drive inside the request, so their cost is measured
+            GALLERY_UPLOAD_EAGER=True,
+            # Measure the endpoints, not the limiter turning repeats away
+            RATE_LIMIT_ENABLED=False,
+        )
+        try:
+            with overrides:
+                results = self._run(options)
+        finally:
+            InMemoryDriveClient.files.clear()
+            shutil.rmtree(media_root, ignore_errors=True)
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(results, fh, indent=2)
+        if options["compare"]:
+            self._compare(results, options["compare"])
+
+        violations = results["query_budget_violations"]
+        for violation in violations:
+            self.stderr.write(
+                f"{violation['method']} {violation['route']}: {violation['queries']} queries, "
+                f"budget {violation['max_queries']}"
+            )
+        if violations and options["check"]:
+            raise CommandError(f"{len(violations)} endpoint(s) over their query budget")
+
+    def _run(self, options):
+        cache.clear()
+        counts = seed.seed(
+            guests=options["guests"], gifts=options["gifts"], wishes=options["wishes"],
+            photos=options["photos"], rng_seed=options["seed"],
+        )
+        self.run_id = uuid.uuid4().hex[:8]
+        self.photo = self._base_photo()
+        count = options["warmup"] + options["iterations"]
+        endpoints = self._endpoints(count)
+
+        covered = {endpoint.route for endpoint in endpoints}
+        missing = sorted({url.name for url in router.urls} - covered)
+        if missing:
+            raise CommandError(f"No benchmark for routes: {', '.join(missing)}")
+
+        admin = get_user_model().objects.create_superuser(f"bench-{self.run_id}", "bench@example.com", "bench")
+        anonymous, staff = Client(), Client()
+        staff.force_login(admin)
+
+        rows, violations = [], []
+        for endpoint in endpoints:
+            row = self._measure(staff if endpoint.admin else anonymous, endpoint, count, options["warmup"])
+            rows.append(row)
+            if row["queries"] > endpoint.max_queries:
+                violations.append({key: row[key] for key in ("route", "method", "queries", "max_queries")})
+            self.stdout.write(
+                f"{endpoint.method:6} {endpoint.route:28} p50 {row['p50_ms']:7.2f} ms  p95 {row['p95_ms']:7.2f} ms  "
+                f"{row['throughput_rps']:7.1f} req/s  {row['queries']:3} queries  {dict(row['statuses'])}"
+            )
+
+        peak = None
+        if options["peak_requests"]:
+            peak = self._peak(options)
+            self.stdout.write(
+                f"reception peak: {peak['throughput_rps']:.1f} req/s at concurrency {peak['concurrency']}, "
+                f"p95 {peak['p95_ms']:.1f} ms, {peak['errors']} errors"
+                + (f", {peak['locked']} lost to SQLite locks" if peak["locked"] else "")
+            )
+
+        return {
+            "meta": {
+                "run_at": timezone.now().isoformat(),
+                "commit": self._commit(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "seed": {**counts, "rng_seed": options["seed"]},
+                "iterations": options["iterations"],
+                "warmup": options["warmup"],
+            },
+            "endpoints": rows,
+            "peak": peak,
+            "query_budget_violations": violations,
+        }
+
+    # ----- fixtures -----
+
+    def _base_photo(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (1024, 768), (200, 170, 120)).save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+
+    def _photo(self, tag):
+        # Trailing bytes after the JPEG end marker keep each upload's content (and hash) unique
+        return SimpleUploadedFile(
+            f"bench-{tag}.jpg", self.photo + f"{self.run_id}-{tag}".encode(), content_type="image/jpeg"
+        )
+
+    def _victims(self, model, count, **fields):
+        """
+        Fresh rows for endpoints that consume one per request (deletes, reservations).
+        """
+        if model is Guest:
+            rows = [Guest(name=f"Victim {n}", email=f"victim{n}-{self.run_id}@{seed.EMAIL_DOMAIN}") for n in range(count)]
+        elif model is Gift:
+            rows = [Gift(title=f"Spare gift {n}") for n in range(count)]
+        else:
+            rows = [model(**fields) for _ in range(count)]
+        return [row.pk for row in model.objects.bulk_create(rows)]
+
+    def _endpoints(self, count):
+        guests = list(Guest.objects.values_list("pk", flat=True)[:count])
+        gifts = list(Gift.objects.values_list("pk", flat=True)[:count])
+        wishes = list(Wish.objects.values_list("pk", flat=True)[:count])
+        photos = list(GalleryItem.objects.values_list("pk", flat=True)[:count])
+        digests = list(GalleryItem.objects.values_list("sha256", flat=True)[:50])
+        if not (guests and gifts and wishes and photos):
+            raise CommandError("Seed at least one guest, gift, wish and photo.")
+
+        def pick(rows, n):
+            return rows[n % len(rows)]
+
+        doomed_guests = self._victims(Guest, count)
+        doomed_gifts = self._victims(Gift, count)
+        open_gifts = self._victims(Gift, count)
+        rsvp_gifts = self._victims(Gift, count)
+        doomed_wishes = self._victims(Wish, count, guest_id=guests[0], message="bye")
+        doomed_photos = self._victims(GalleryItem, count, title="doomed.jpg")
+        missing = [uuid.uuid4().hex + uuid.uuid4().hex for _ in range(50)]
+        run = self.run_id
+
+        def arrivals(n):
+            # A door device's queue: 20 arrivals, some of them already synced by another door
+            at = timezone.now() - timedelta(minutes=count - n)
+            return {"arrivals": [
+                {"guest_id": str(pick(guests, n * 10 + i)), "checked_in_at": at.isoformat()} for i in range(20)
+            ]}
+
+        def guest_csv(n):
+            lines = ["name,email,rsvp_status"] + [
+                f"Imported {n}-{row},import{row}-{run}@{seed.EMAIL_DOMAIN},true" for row in range(50)
+            ]
+            return SimpleUploadedFile("guests.csv", "\n".join(lines).encode())
+
+        return [
+            Endpoint("api-root", "GET", lambda n: ("/api/", {}), 2),
+            Endpoint("guest-list", "GET", lambda n: ("/api/guests/", {}), 3, admin=True),
+            Endpoint("guest-list", "POST", lambda n: ("/api/guests/", as_json(
+                {"name": f"New {n}", "email": f"new{n}-{run}@{seed.EMAIL_DOMAIN}"})), 6),
+            Endpoint("guest-detail", "GET", lambda n: (f"/api/guests/{pick(guests, n)}/", {}), 3, admin=True),
+            Endpoint("guest-detail", "PATCH", lambda n: (f"/api/guests/{pick(guests, n)}/", as_json(
+                {"phone": f"0700{n:06d}"})), 8, admin=True),
+            Endpoint("guest-detail", "DELETE", lambda n: (f"/api/guests/{doomed_guests[n]}/", {}), 12, admin=True),
+            Endpoint("guest-rsvp", "POST", lambda n: ("/api/guests/rsvp/", as_json(
+                # Half new guests, half returning ones
+                {"name": f"Rsvp {n}", "email": f"rsvp{n // 2}-{run}@{seed.EMAIL_DOMAIN}", "rsvp_status": True})), 8),
+            Endpoint("guest-import-guests", "POST", lambda n: ("/api/guests/import/", {"data": {"file": guest_csv(n)}}),
+                     9, admin=True),
+            Endpoint("guest-export-guests", "GET", lambda n: ("/api/guests/export/", {}), 3, admin=True),
+            Endpoint("guest-search", "GET", lambda n: ("/api/guests/search/", {"data": {"q": f"guest {n}"}}), 5,
+                     admin=True),
+            Endpoint("gift-list", "GET", lambda n: ("/api/gifts/", {}), 1),
+            Endpoint("gift-list", "POST", lambda n: ("/api/gifts/", as_json({"title": f"Bench gift {n}"})), 6,
+                     admin=True),
+            Endpoint("gift-detail", "GET", lambda n: (f"/api/gifts/{pick(gifts, n)}/", {}), 1),
+            Endpoint("gift-detail", "PATCH", lambda n: (f"/api/gifts/{pick(gifts, n)}/", as_json(
+                {"link": f"https://shop.example.com/bench/{n}"})), 7, admin=True),
+            Endpoint("gift-detail", "DELETE", lambda n: (f"/api/gifts/{doomed_gifts[n]}/", {}), 8, admin=True),
+            Endpoint("gift-reserve", "PATCH", lambda n: (f"/api/gifts/{open_gifts[n]}/reserve/", as_json(
+                {"guest_id": str(pick(guests, n))})), 4),
+            Endpoint("gift-rsvp-and-reserve", "POST", lambda n: (f"/api/gifts/{rsvp_gifts[n]}/rsvp-and-reserve/", as_json(
+                {"name": f"Walk-in {n}", "email": f"walkin{n}-{run}@{seed.EMAIL_DOMAIN}"})), 11),
+            Endpoint("wish-list", "GET", lambda n: ("/api/wishes/", {}), 3, admin=True),
+            Endpoint("wish-list", "POST", lambda n: ("/api/wishes/", as_json(
+                {"guest_id": str(pick(guests, n)), "message": f"Congratulations! ({n})"})), 6),
+            Endpoint("wish-search", "GET", lambda n: ("/api/wishes/search/", {"data": {"q": f"hongera {n}"}}), 5,
+                     admin=True),
+            Endpoint("wish-detail", "GET", lambda n: (f"/api/wishes/{pick(wishes, n)}/", {}), 3, admin=True),
+            Endpoint("wish-detail", "PATCH", lambda n: (f"/api/wishes/{pick(wishes, n)}/", as_json(
+                {"message": f"Edited ({n})"})), 8, admin=True),
+            Endpoint("wish-detail", "DELETE", lambda n: (f"/api/wishes/{doomed_wishes[n]}/", {}), 9, admin=True),
+            Endpoint("gallery-list", "GET", lambda n: ("/api/gallery/", {}), 1),
+            Endpoint("gallery-list", "POST", lambda n: ("/api/gallery/", {"data": {
+                "title": f"link-{n}.jpg", "image": f"https://photos.example.com/{run}/{n}.jpg"}}), 6),
+            Endpoint("gallery-detail", "GET", lambda n: (f"/api/gallery/{pick(photos, n)}/", {}), 1),
+            Endpoint("gallery-detail", "PATCH", lambda n: (f"/api/gallery/{pick(photos, n)}/", as_multipart(
+                {"caption": f"Caption {n}"})), 8, admin=True),
+            Endpoint("gallery-detail", "DELETE", lambda n: (f"/api/gallery/{doomed_photos[n]}/", {}), 8, admin=True),
+            Endpoint("gallery-upload-to-drive", "POST", lambda n: ("/api/gallery/upload/", {
+                "data": {"file": self._photo(f"single-{n}")}}), 14),
+            Endpoint("gallery-upload-batch", "POST", lambda n: ("/api/gallery/upload-batch/", {
+                "data": {"files": [self._photo(f"batch-{n}-{i}") for i in range(5)]}}), 40),
+            Endpoint("gallery-check-hashes", "POST", lambda n: ("/api/gallery/check-hashes/", as_json(
+                {"sha256": digests + missing})), 2),
+            Endpoint("checkin-list", "GET", lambda n: ("/api/checkin/", {"HTTP_ACCEPT_ENCODING": "gzip"}), 3,
+                     admin=True),
+            Endpoint("checkin-lookup", "GET", lambda n: ("/api/checkin/lookup/", {"data": {"q": f"guest{n}"}}), 4,
+                     admin=True),
+            Endpoint("checkin-sync", "POST", lambda n: ("/api/checkin/sync/", as_json(arrivals(n))), 5, admin=True),
+            Endpoint("gallery-similar", "GET", lambda n: (f"/api/gallery/{pick(photos, n)}/similar/?distance=20", {}),
+                     5, admin=True),
+        ]
+
+    # ----- measurement -----
+
+    def _measure(self, client, endpoint, count, warmup):
+        latencies, queries, statuses = [], [], Counter()
+        path = None
+        for n in range(count):
+            path, kwargs = endpoint.request(n)
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                response = getattr(client, endpoint.method.lower())(path, **kwargs)
+                if response.streaming:
+                    b"".join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            if n < warmup:
+                continue
+            latencies.append(elapsed)
+            queries.append(counter.count)
+            statuses[response.status_code] += 1
+
+        return {
+            "route": endpoint.route,
+            "method": endpoint.method,
+            "path": path,
+            "iterations": len(latencies),
+            **summarize(latencies),
+            "throughput_rps": len(latencies) / sum(latencies) if latencies else 0.0,
+            "queries": max(queries, default=0),
+            "max_queries": endpoint.max_queries,
+            "statuses": {str(code): total for code, total in sorted(statuses.items())},
+        }
+
+    def _peak(self, options):
+        if connection.vendor == "sqlite":
+            self.stderr.write(
+                "SQLite runs one write at a time, so the reception peak mostly measures writers waiting on "
+                "each other; run it against PostgreSQL for numbers that mean something."
+            )
+            # Readers stop blocking the writer and writers queue for the lock; a transaction that reads
+            # before it writes can still lose the race, and those are counted apart from errors
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            connection_created.connect(wait_for_sqlite_locks)
+            try:
+                return self._run_peak(options)
+            finally:
+                connection_created.disconnect(wait_for_sqlite_locks)
+        return self._run_peak(options)
+
+    def _run_peak(self, options):
+        guests = list(Guest.objects.values_list("pk", flat=True))
+        gifts = list(Gift.objects.filter(reserved=False).values_list("pk", flat=True))
+        actions, weights = zip(*self.PEAK_MIX.items())
+        plan = random.Random(options["seed"]).choices(actions, weights=weights, k=options["peak_requests"])
+        run = self.run_id
+
+        def request(action, n, rng):
+            if action == "browse_gallery":
+                return "get", "/api/gallery/", {}
+            if action == "browse_gifts":
+                return "get", "/api/gifts/", {}
+            if action == "post_wish":
+                return "post", "/api/wishes/", as_json({"guest_id": str(rng.choice(guests)), "message": f"Cheers {n}"})
+            if action == "upload_photo":
+                return "post", "/api/gallery/upload/", {"data": {"file": self._photo(f"peak-{n}")}}
+            if action == "rsvp":
+                email = f"peak{rng.randrange(options['peak_requests'])}-{run}@{seed.EMAIL_DOMAIN}"
+                return "post", "/api/guests/rsvp/", as_json({"name": f"Peak {n}", "email": email})
+            return "patch", f"/api/gifts/{rng.choice(gifts)}/reserve/", as_json({"guest_id": str(rng.choice(guests))})
+
+        def guest_session(worker):
+            client = Client()
+            rng = random.Random(options["seed"] * 1000 + worker)
+            outcomes = []
+            try:
+                for n in range(worker, len(plan), options["concurrency"]):
+                    method, path, kwargs = request(plan[n], n, rng)
+                    started = time.perf_counter()
+                    try:
+                        status = getattr(client, method)(path, **kwargs).status_code
+                    except Exception as exc:
+                        status = f"{type(exc).__name__}: {exc}"
+                    outcomes.append((plan[n], status, time.perf_counter() - started))
+            finally:
+                connection.close()
+            return outcomes
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            outcomes = [row for rows in pool.map(guest_session, range(options["concurrency"])) for row in rows]
+        elapsed = time.perf_counter() - started
+
+        def locked(status):
+            # SQLite gave up on the write lock: contention, not an API error
+            return isinstance(status, str) and "database is locked" in status
+
+        def failed(action, status):
+            # A taken gift is an expected answer during the rush
+            return not (
+                locked(status)
+                or isinstance(status, int) and (status < 400 or (action == "reserve" and status == 409))
+            )
+
+        per_action = {}
+        for action in actions:
+            rows = [(status, latency) for name, status, latency in outcomes if name == action]
+            per_action[action] = {
+                "requests": len(rows),
+                **summarize([latency for _, latency in rows]),
+                "statuses": dict(Counter(str(status) for status, _ in rows)),
+            }
+        return {
+            "requests": len(outcomes),
+            "concurrency": options["concurrency"],
+            "elapsed_s": elapsed,
+            "throughput_rps": len(outcomes) / elapsed,
+            **summarize([latency for _, _, latency in outcomes]),
+            "errors": sum(failed(action, status) for action, status, _ in outcomes),
+            "locked": sum(locked(status) for _, status, _ in outcomes),
+            "actions": per_action,
+        }
+
+    # ----- reporting -----
+
+    def _commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except OSError:
+            return None
+
+    def _compare(self, results, path):
+        with open(path) as fh:
+            before = json.load(fh)
+        earlier = {(row["route"], row["method"]): row for row in before.get("endpoints", [])}
+        self.stdout.write(f"Compared with {path} ({before.get('meta', {}).get('commit') or 'unknown commit'}):")
+        for row in results["endpoints"]:
+            old = earlier.get((row["route"], row["method"]))
+            if not old or not old.get("p50_ms"):
+                continue
+            self.stdout.write(
+                f"{row['method']:6} {row['route']:28} p50 {old['p50_ms']:7.2f} -> {row['p50_ms']:7.2f} ms "
+                f"({row['p50_ms'] / old['p50_ms']:5.2f}x)  queries {old['queries']} -> {row['queries']}"
+            )
+        if results["peak"] and before.get("peak"):
+            self.stdout.write(
+                f"reception peak: {before['peak']['throughput_rps']:.1f} -> {results['peak']['throughput_rps']:.1f} req/s"
+            )
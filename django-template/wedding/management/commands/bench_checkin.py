@@ -0,0 +1,93 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from wedding import checkin, seed
+from wedding.management.commands.bench_api import QueryCounter, summarize
+from wedding.models import Guest
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the door check-in path on seeded guests: snapshot size raw and gzipped, lookup index "
+        "build and query latency against the search used by the admin API, and batch sync cost. Runs on "
+        "a throwaway test database unless --in-place is given."
+    )
+
+    # What door staff type: name prefixes, email fragments, phone digits
+    QUERIES = ["gu", "guest 42", "guest4217", "st42", "bench.example", "0712", "4217 bench"]
+
+    def add_arguments(self, parser):
+        parser.add_argument("--guests", type=int, default=5000)
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--arrivals", type=int, default=500, help="Arrivals in the synced batch.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--in-place", action="store_true",
+                            help="Use the configured database (which must already hold guests) instead of seeding one.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        old_name = None
+        if not options["in_place"]:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if old_name is not None:
+                seed.seed(guests=options["guests"], gifts=0, wishes=0, photos=0, rng_seed=options["seed"])
+            elif not Guest.objects.exists():
+                raise CommandError("The database has no guests; seed it or drop --in-place.")
+            results = self._run(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(results, fh, indent=2)
+
+    def _run(self, options):
+        version, body = checkin.snapshot()
+        raw = len(gzip.decompress(body))
+        self.stdout.write(
+            f"{Guest.objects.count()} guests; snapshot {raw / 1024:.1f} KiB, gzipped {len(body) / 1024:.1f} KiB "
+            f"({len(body) / raw:.0%})"
+        )
+
+        started = time.perf_counter()
+        index = checkin.GuestIndex(version, checkin.load_rows())
+        build_ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(f"index build {build_ms:.1f} ms")
+
+        rows = []
+        for query in self.QUERIES:
+            latencies, found = [], []
+            for _ in range(options["iterations"]):
+                started = time.perf_counter()
+                found = index.lookup(query)
+                latencies.append(time.perf_counter() - started)
+            row = {"query": query, **summarize(latencies), "results": len(found)}
+            rows.append(row)
+            self.stdout.write(
+                f"lookup {query!r:16} p50 {row['p50_ms']:7.3f} ms  p95 {row['p95_ms']:7.3f} ms  {len(found):3} results"
+            )
+
+        at = timezone.now() - timedelta(hours=1)
+        arrivals = [(pk, at) for pk in Guest.objects.values_list("pk", flat=True)[:options["arrivals"]]]
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            checkin.sync(arrivals)
+            sync_ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(f"sync of {len(arrivals)} arrivals: {sync_ms:.1f} ms, {counter.count} queries")
+
+        return {
+            "database": connection.vendor,
+            "guests": len(index),
+            "snapshot_bytes": raw,
+            "snapshot_gzip_bytes": len(body),
+            "index_build_ms": build_ms,
+            "lookups": rows,
+            "sync": {"arrivals": len(arrivals), "ms": sync_ms, "queries": counter.count},
+        }
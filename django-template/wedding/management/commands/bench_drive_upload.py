@@ -0,0 +1,97 @@
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+from wedding.drive_client import UploadedFileMedia
+from wedding.storage import get_backend
+
+
+class DiscardingDriveClient:
+    """
+    Consumes media exactly like a resumable upload does, then throws the bytes away.
+    """
+
+    def upload(self, fileobj, name, mime_type=None):
+        media = UploadedFileMedia(fileobj, mime_type)
+        sent = 0
+        while sent < media.size():
+            sent += len(media.getbytes(sent, media.chunksize()))
+        return {"id": name, "webViewLink": ""}
+
+
+class BackendClient:
+    """
+    Drive-client shaped adapter over a gallery storage backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def upload(self, fileobj, name, mime_type=None):
+        stored = self.backend.put(fileobj, name, mime_type)
+        return {"id": stored.key, "webViewLink": stored.url}
+
+
+class Command(BaseCommand):
+    help = "Measure latency and peak memory of gallery uploads for large files (e.g. phone videos)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=int, nargs="+", default=[20, 50])
+        parser.add_argument("--mode", choices=["stream", "spool"], default="stream",
+                            help="stream: read the UploadedFile directly; spool: copy it to /tmp first (old behaviour).")
+        parser.add_argument("--client", default=None,
+                            help="Dotted path of a Drive client class. Defaults to a local client that discards bytes.")
+        parser.add_argument("--storage", choices=sorted(settings.GALLERY_STORAGE_BACKENDS), default=None,
+                            help="Store through this gallery storage backend instead of a Drive client.")
+
+    def handle(self, *args, **options):
+        if options["storage"]:
+            client = BackendClient(get_backend(options["storage"]))
+        else:
+            client = import_string(options["client"])() if options["client"] else DiscardingDriveClient()
+        for size_mb in options["size_mb"]:
+            uploaded = self._make_upload(size_mb)
+            try:
+                tracemalloc.start()
+                started = time.perf_counter()
+                if options["mode"] == "spool":
+                    self._spool_and_upload(client, uploaded)
+                else:
+                    client.upload(uploaded, uploaded.name, uploaded.content_type)
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            finally:
+                uploaded.close()
+
+            max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            self.stdout.write(
+                f"{options['mode']} {size_mb} MB: {elapsed * 1000:.1f} ms, "
+                f"peak python alloc {peak / 1024 / 1024:.1f} MB, max RSS {max_rss_mb:.1f} MB"
+            )
+
+    def _make_upload(self, size_mb):
+        uploaded = TemporaryUploadedFile("video.mp4", "video/mp4", size_mb * 1024 * 1024, None)
+        block = os.urandom(1024 * 1024)
+        for _ in range(size_mb):
+            uploaded.write(block)
+        uploaded.seek(0)
+        return uploaded
+
+    def _spool_and_upload(self, client, uploaded):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(spool_dir, uploaded.name)
+            with open(path, "wb+") as spool:
+                for chunk in uploaded.chunks():
+                    spool.write(chunk)
+            with open(path, "rb") as fh:
+                client.upload(fh, uploaded.name, uploaded.content_type)
+        finally:
+            shutil.rmtree(spool_dir)
@@ -0,0 +1,110 @@
+import gzip
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+from wedding import seed
+from wedding.management.commands.bench_api import summarize
+from wedding.models import Guest, Gift, Wish, GalleryItem
+from wedding.serializers import GallerySerializer, GiftSerializer, GuestSerializer, WishSerializer, parse_fieldset
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare sparse fieldsets on large lists: for each serializer, the full staff shape (what every "
+        "client got before), the public default and a few ?fields=/?expand= selections. Reports JSON and "
+        "gzipped payload size, and the time to load, serialize and render the rows. Runs on a throwaway "
+        "test database unless --in-place is given."
+    )
+
+    # (queryset, serializer, [(label, fields, expand, staff)]); the first variant is the baseline
+    CASES = {
+        "gifts": (Gift.objects.order_by("title", "id"), GiftSerializer, [
+            ("full (staff)", None, None, True),
+            ("public default", None, None, False),
+            ("fields=id,title,reserved", "id,title,reserved", None, False),
+        ]),
+        "wishes": (Wish.objects.order_by("-created_at", "-id"), WishSerializer, [
+            ("full (staff)", None, None, True),
+            ("public default", None, None, False),
+            ("expand=guest", None, "guest", False),
+            ("fields=message,guest.name", "message,guest.name", None, False),
+        ]),
+        "gallery": (GalleryItem.objects.order_by("-uploaded_at", "-id"), GallerySerializer, [
+            ("full (staff)", None, None, True),
+            ("public default", None, None, False),
+            ("fields=id,image,variants", "id,image,variants", None, False),
+        ]),
+        "guests": (Guest.objects.order_by("-created_at", "-id"), GuestSerializer, [
+            ("full (staff)", None, None, True),
+            ("fields=id,name,email", "id,name,email", None, True),
+        ]),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=2000, help="Rows seeded per table.")
+        parser.add_argument("--iterations", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--in-place", action="store_true",
+                            help="Use the configured database (which must already hold rows) instead of seeding one.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        old_name = None
+        if not options["in_place"]:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if old_name is not None:
+                rows = options["rows"]
+                seed.seed(guests=rows, gifts=rows, wishes=rows, photos=rows, rng_seed=options["seed"])
+            elif not Guest.objects.exists():
+                raise CommandError("The database has no guests; seed it or drop --in-place.")
+            results = [self._measure(name, *case, options["iterations"]) for name, case in self.CASES.items()]
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump({"database": connection.vendor, "lists": results}, fh, indent=2)
+
+    def _measure(self, name, queryset, serializer_class, variants, iterations):
+        rows = []
+        for label, fields, expand, staff in variants:
+            options = {"fields": parse_fieldset(fields), "expand": parse_fieldset(expand), "staff": staff}
+            columns, relations = serializer_class(**options).only()
+            trimmed = queryset.select_related(*relations).only(*columns)
+
+            load, serialize, render = [], [], []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                instances = list(trimmed.all())
+                loaded = time.perf_counter()
+                data = serializer_class(instances, many=True, **options).data
+                serialized = time.perf_counter()
+                content = JSONRenderer().render(data)
+                load.append(loaded - started)
+                serialize.append(serialized - loaded)
+                render.append(time.perf_counter() - serialized)
+
+            row = {
+                "variant": label,
+                "rows": len(instances),
+                "bytes": len(content),
+                "gzip_bytes": len(gzip.compress(content)),
+                "load_ms": summarize(load)["p50_ms"],
+                "serialize_ms": summarize(serialize)["p50_ms"],
+                "render_ms": summarize(render)["p50_ms"],
+            }
+            rows.append(row)
+
+        baseline = rows[0]
+        self.stdout.write(f"{name} ({baseline['rows']} rows)")
+        for row in rows:
+            self.stdout.write(
+                f"  {row['variant']:28} {row['bytes'] / 1024:8.1f} KiB ({row['bytes'] / baseline['bytes']:4.0%}), "
+                f"gzip {row['gzip_bytes'] / 1024:7.1f} KiB  load {row['load_ms']:7.1f} ms  "
+                f"serialize {row['serialize_ms']:7.1f} ms  render {row['render_ms']:6.1f} ms"
+            )
+        return {"list": name, "variants": rows}
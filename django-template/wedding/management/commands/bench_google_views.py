@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import aiohttp
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from wedding.google_stub import GoogleStubServer
+from wedding.models import Job, JobStatus
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the Drive upload view against a local Google stub with a fixed upstream "
+        "latency, with a run_jobs worker doing the uploads. The view is sync and only spools the "
+        "file and queues a job; it is served by gunicorn (WSGI worker threads) and by uvicorn "
+        "(ASGI, where Django runs sync views on its thread pool), to compare the servers' overhead "
+        "in accepting uploads. The Google latency is paid by the worker either way. Reports how fast "
+        "uploads are accepted and how long the worker takes to finish them. Uses the configured "
+        "database for sessions and jobs, so run migrate first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", nargs="+", choices=["wsgi", "asgi"], default=["wsgi", "asgi"])
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds the stub waits before each reply.")
+        parser.add_argument("--size-kb", type=int, default=256)
+        parser.add_argument("--workers", type=int, default=1, help="Server processes.")
+        parser.add_argument("--threads", type=int, default=8, help="Threads per gunicorn worker.")
+        parser.add_argument("--job-threads", type=int, default=32, help="Threads of the run_jobs worker.")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        results = []
+        with GoogleStubServer(latency=options["latency"]) as stub:
+            for kind in options["servers"]:
+                stub.batches.clear()
+                server = self._start_server(kind, stub, options)
+                worker = self._start_worker(stub, options)
+                try:
+                    self._wait_for_port(options["port"])
+                    result = asyncio.run(self._load(f"http://127.0.0.1:{options['port']}", options))
+                    result.update(self._wait_for_jobs(result.pop("jobs"), result["elapsed_s"]))
+                    result.update(self._wait_for_follow_ups(stub))
+                finally:
+                    for process in (server, worker):
+                        process.terminate()
+                        process.wait(timeout=10)
+                result.update(server=kind, workers=options["workers"],
+                              threads=options["threads"] if kind == "wsgi" else None,
+                              job_threads=options["job_threads"])
+                results.append(result)
+                self.stdout.write(
+                    f"{kind}: {result['throughput_rps']:.1f} req/s, p50 {result['p50_ms']:.0f} ms, "
+                    f"p95 {result['p95_ms']:.0f} ms, {result['errors']} errors in {result['elapsed_s']:.2f} s; "
+                    f"uploads done after {result['drained_s']:.2f} s, {result['dead_jobs']} dead; "
+                    f"{result['batched_calls']} permission grants in {result['batch_requests']} batch requests"
+                )
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(results, fh, indent=2)
+
+    def _env(self, stub, options):
+        return {
+            **os.environ,
+            "EXTERNAL_HOSTNAME": ",".join(filter(None, [os.environ.get("EXTERNAL_HOSTNAME"), "127.0.0.1"])),
+            "GOOGLE_OAUTH_TOKEN_URL": f"{stub.url}/token",
+            "GOOGLE_API_ROOT": stub.url,
+        }
+
+    def _start_worker(self, stub, options):
+        return subprocess.Popen(
+            [sys.executable, "manage.py", "run_jobs", "--threads", str(options["job_threads"]),
+             "--poll-interval", "0.05"],
+            cwd=settings.BASE_DIR, env=self._env(stub, options),
+        )
+
+    def _wait_for_jobs(self, job_ids, accepted_s, timeout=600):
+        """
+        Seconds from the first upload until the worker finished every upload job.
+        """
+        started = time.monotonic()
+        pending = Job.objects.filter(pk__in=job_ids, status__in=[JobStatus.QUEUED, JobStatus.RUNNING])
+        while pending.exists():
+            if time.monotonic() - started > timeout:
+                raise CommandError(f"{pending.count()} upload jobs still pending after {timeout} s")
+            time.sleep(0.05)
+        return {
+            "drained_s": accepted_s + time.monotonic() - started,
+            "dead_jobs": Job.objects.filter(pk__in=job_ids, status=JobStatus.DEAD).count(),
+        }
+
+    def _wait_for_follow_ups(self, stub, timeout=60):
+        """
+        Wait for the queued permission grants, and count the batch requests they took.
+        """
+        started = time.monotonic()
+        pending = Job.objects.filter(task="drive.grant_permission", status__in=[JobStatus.QUEUED, JobStatus.RUNNING])
+        while pending.exists():
+            if time.monotonic() - started > timeout:
+                raise CommandError(f"{pending.count()} permission grants still pending after {timeout} s")
+            time.sleep(0.05)
+        return {"batch_requests": len(stub.batches), "batched_calls": sum(stub.batches)}
+
+    def _start_server(self, kind, stub, options):
+        bind = f"127.0.0.1:{options['port']}"
+        if kind == "wsgi":
+            command = ["gunicorn", "web_django.wsgi:application", "--bind", bind,
+                       "--workers", str(options["workers"]), "--threads", str(options["threads"])]
+        else:
+            command = ["uvicorn", "web_django.asgi:application", "--host", "127.0.0.1",
+                       "--port", str(options["port"]), "--workers", str(options["workers"])]
+        return subprocess.Popen(
+            [sys.executable, "-m", *command, "--log-level", "warning"], cwd=settings.BASE_DIR,
+            env=self._env(stub, options),
+        )
+
+    def _wait_for_port(self, port, timeout=20):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"Server did not start listening on port {port}")
+
+    async def _load(self, base_url, options):
+        payload = os.urandom(options["size_kb"] * 1024)
+        connector = aiohttp.TCPConnector(limit=options["concurrency"])
+        # The default cookie jar ignores cookies from IP hosts
+        jar = aiohttp.CookieJar(unsafe=True)
+        async with aiohttp.ClientSession(base_url, connector=connector, cookie_jar=jar) as client:
+            await self._sign_in(client)
+
+            gate = asyncio.Semaphore(options["concurrency"])
+            latencies, errors, job_ids = [], 0, []
+
+            async def one(n):
+                nonlocal errors
+                async with gate:
+                    form = aiohttp.FormData()
+                    form.add_field("file", payload, filename=f"photo-{n}.jpg", content_type="image/jpeg")
+                    started = time.perf_counter()
+                    try:
+                        async with client.post("/api/drive/upload/", data=form) as response:
+                            body = await response.json(content_type=None)
+                            ok = response.status == 202
+                            if ok:
+                                job_ids.append(body["job"])
+                    except (aiohttp.ClientError, ValueError):
+                        ok = False
+                    latencies.append(time.perf_counter() - started)
+                    errors += not ok
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(n) for n in range(options["requests"])))
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "latency_s": options["latency"],
+            "size_kb": options["size_kb"],
+            "errors": errors,
+            "elapsed_s": elapsed,
+            "throughput_rps": options["requests"] / elapsed,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+            "max_ms": latencies[-1] * 1000,
+            "jobs": job_ids,
+        }
+
+    async def _sign_in(self, client, timeout=30):
+        async with client.get("/api/auth/callback/", params={"code": "bench"}) as response:
+            body = await response.json(content_type=None)
+            if response.status != 202:
+                raise CommandError(f"Sign-in against the stub failed: {response.status} {body}")
+        # The token exchange runs on the worker
+        deadline = time.monotonic() + timeout
+        while body["status"] != "done":
+            if body["status"] == "dead" or time.monotonic() > deadline:
+                raise CommandError(f"Sign-in against the stub failed: {body}")
+            await asyncio.sleep(0.05)
+            async with client.get(f"/api/jobs/{body['job']}/") as response:
+                body = await response.json()
@@ -0,0 +1,83 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from wedding import search, seed
+from wedding.management.commands.bench_api import summarize
+from wedding.models import Guest, Wish
+
+
+class Command(BaseCommand):
+    help = (
+        "Time guest and wish search through the full-text index against the icontains scans "
+        "it replaces, on seeded data. Runs on a throwaway test database unless --in-place is given."
+    )
+
+    # (document, query): selective and broad, whole words and prefixes
+    QUERIES = [
+        ("guest", "guest 4217"),
+        ("guest", "guest 42"),
+        ("guest", "gue"),
+        ("guest", "guest17 bench"),
+        ("wish", "hongera"),
+        ("wish", "lifetime joy 12"),
+        ("wish", "joy 9999"),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument("--guests", type=int, default=5000)
+        parser.add_argument("--wishes", type=int, default=20000)
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--in-place", action="store_true",
+                            help="Use the configured database (which must already hold data) instead of seeding one.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        old_name = None
+        if not options["in_place"]:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if old_name is not None:
+                seed.seed(guests=options["guests"], gifts=0, wishes=options["wishes"], photos=0,
+                          rng_seed=options["seed"])
+            elif not Guest.objects.exists():
+                raise CommandError("The database has no guests; seed it or drop --in-place.")
+            results = self._run(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(results, fh, indent=2)
+
+    def _run(self, options):
+        indexed = search.get_backend()
+        scan = search.IContainsBackend()
+        self.stdout.write(
+            f"{Guest.objects.count()} guests, {Wish.objects.count()} wishes on {connection.vendor}; "
+            f"index: {indexed.name}"
+        )
+        rows = []
+        for kind, query in self.QUERIES:
+            row = {"document": kind, "query": query}
+            for label, backend in (("index", indexed), ("icontains", scan)):
+                latencies, found = [], []
+                for _ in range(options["iterations"]):
+                    started = time.perf_counter()
+                    found = search.search(kind, query, limit=20, backend=backend)
+                    latencies.append(time.perf_counter() - started)
+                row[label] = {**summarize(latencies), "results": len(found)}
+                row[f"{label}_top"] = [str(obj.pk) for obj in found]
+            # The scan stops at SEARCH_CANDIDATE_LIMIT rows in table order, so for
+            # broad queries it may miss the best matches the index finds
+            row["same_results"] = row.pop("index_top") == row.pop("icontains_top")
+            row["speedup"] = row["icontains"]["p50_ms"] / row["index"]["p50_ms"]
+            rows.append(row)
+            self.stdout.write(
+                f"{kind:5} {query!r:20} index p50 {row['index']['p50_ms']:8.2f} ms  "
+                f"icontains p50 {row['icontains']['p50_ms']:8.2f} ms  {row['speedup']:6.1f}x  "
+                f"{row['index']['results']:3} results{'' if row['same_results'] else '  (different results)'}"
+            )
+        return {"database": connection.vendor, "index": indexed.name, "queries": rows}
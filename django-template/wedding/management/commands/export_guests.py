@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from wedding import guest_io
+
+
+class Command(BaseCommand):
+    help = "Write every guest as CSV or NDJSON without loading the table into memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+        parser.add_argument("--output", default="-", help="File to write, or - for stdout.")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        lines = guest_io.export_guests(options["format"], chunk_size=options["chunk_size"])
+        if options["output"] == "-":
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        with open(options["output"], "w", encoding="utf-8", newline="") as fh:
+            fh.writelines(lines)
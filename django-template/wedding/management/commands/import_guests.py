@@ -0,0 +1,27 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from wedding import guest_io
+
+
+class Command(BaseCommand):
+    help = "Upsert guests from a CSV (with header) or NDJSON file, keyed on email."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, or - for stdin.")
+        parser.add_argument("--format", choices=["csv", "ndjson"], default=None,
+                            help="Defaults to ndjson for .ndjson/.jsonl files, csv otherwise.")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv")
+        try:
+            stream = sys.stdin if path == "-" else open(path, encoding="utf-8-sig", newline="")
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream:
+            result = guest_io.import_guests(guest_io.read_rows(stream, fmt), batch_size=options["batch_size"])
+
+        for error in result.errors:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        self.stdout.write(f"Created {result.created}, updated {result.updated}, {len(result.errors)} row(s) rejected.")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from wedding import upload_queue
+from wedding.models import UploadStatus
+
+
+class Command(BaseCommand):
+    help = "Push pending gallery uploads to Google Drive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retry-failed", action="store_true", help="Re-queue failed uploads that have attempts left.")
+        parser.add_argument("--limit", type=int, default=None, help="Process at most this many items.")
+
+    def handle(self, *args, **options):
+        processed = upload_queue.process_pending(retry_failed=options["retry_failed"], limit=options["limit"])
+        failed = sum(1 for item in processed if item.status == UploadStatus.FAILED)
+        self.stdout.write(f"Processed {len(processed)} upload(s), {failed} failed.")
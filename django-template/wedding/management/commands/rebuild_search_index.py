@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from wedding import search
+
+
+class Command(BaseCommand):
+    help = "Refill the guest and wish full-text search index from their tables."
+
+    def handle(self, *args, **options):
+        search.rebuild()
+        self.stdout.write(f"Search index rebuilt ({search.get_backend().name}).")
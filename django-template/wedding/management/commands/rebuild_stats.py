@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from wedding import stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard counters from the guest, gift, wish and gallery tables."
+
+    def handle(self, *args, **options):
+        stats.rebuild()
+        self.stdout.write("Dashboard counters rebuilt.")
@@ -0,0 +1,23 @@
+import threading
+from django.core.management.base import BaseCommand
+from wedding.google_stub import GoogleStubServer
+
+
+class Command(BaseCommand):
+    help = "Serve the local Google OAuth/Drive stub (wedding/google_stub.py) until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8790)
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each reply.")
+
+    def handle(self, *args, **options):
+        server = GoogleStubServer(port=options["port"], latency=options["latency"]).start()
+        self.stdout.write(
+            f"Google stub on {server.url}; set GOOGLE_OAUTH_TOKEN_URL={server.url}/token GOOGLE_API_ROOT={server.url}"
+        )
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
@@ -0,0 +1,30 @@
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from wedding import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (Google token exchanges, Drive uploads and permission grants) "
+        "on a thread pool until stopped. Run as many of these as the outbound load needs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=None, help="Jobs run at once (default JOB_WORKERS).")
+        parser.add_argument("--task", action="append", dest="tasks",
+                            help="Only run this task; may be repeated.")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due instead of polling.")
+        parser.add_argument("--poll-interval", type=float, default=None)
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        # Finish the jobs in hand on SIGTERM/Ctrl-C rather than leaving them to the lease timeout
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+        threads = options["threads"] or settings.JOB_WORKERS
+        ran = jobs.work(
+            threads, tasks=options["tasks"], once=options["once"], poll_interval=options["poll_interval"], stop=stop,
+        )
+        self.stdout.write(f"Ran {ran} job(s).")
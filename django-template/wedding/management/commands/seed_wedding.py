@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from wedding import seed
+from wedding.models import Guest, Gift, Wish, GalleryItem
+
+
+class Command(BaseCommand):
+    help = "Fill an empty database with deterministic guests, gifts, wishes and photos for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--guests", type=int, default=200)
+        parser.add_argument("--gifts", type=int, default=50)
+        parser.add_argument("--wishes", type=int, default=300)
+        parser.add_argument("--photos", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed gives the same data.")
+
+    def handle(self, *args, **options):
+        if any(model.objects.exists() for model in (Guest, Gift, Wish, GalleryItem)):
+            raise CommandError("The database already has wedding data; seed an empty one.")
+        counts = seed.seed(
+            guests=options["guests"], gifts=options["gifts"], wishes=options["wishes"],
+            photos=options["photos"], rng_seed=options["seed"],
+        )
+        self.stdout.write(", ".join(f"{count} {table}" for table, count in counts.items()) + " created.")
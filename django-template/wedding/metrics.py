@@ -0,0 +1,284 @@
+"""
+In-process request metrics, exported in the Prometheus text format.
+
+``RequestMetricsMiddleware`` starts a ``RequestStats`` for every request and
+keeps it in a context variable, which follows the request into
+``sync_to_async`` threads and async tasks. While it is set:
+
+* a wrapper installed on every database connection (``execute_wrapper``)
+  adds each query's count and time, and keeps the few slowest statements
+  (without parameters) as the request's SQL sample;
+* serializers (``serializers.TimedListSerializer``/``TimedSerializerMixin``)
+  add the time spent turning models into primitives;
+* calls to Google (OAuth, Drive uploads and permissions) add their latency.
+
+At the end of the request the totals go into histograms labelled by view
+name (bounded cardinality, unlike raw paths), and requests slower than
+``METRICS_SLOW_REQUEST_SECONDS`` are logged with their SQL sample to
+``wedding.slow_requests``.
+
+The cost per request is a handful of ``perf_counter`` calls and one lock per
+histogram observation, so this can stay on at peak. Metrics are per process:
+scrape each worker, or run one worker per container.
+"""
+import bisect
+import contextlib
+import contextvars
+import heapq
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger("wedding.slow_requests")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then sum
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def collect(self):
+        with self._lock:
+            series = {labels: ([*counts], total) for labels, (counts, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(series.items()):
+            base = _labels(self.labelnames, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{{{_labels(self.labelnames, labels)}}} {value}" for labels, value in sorted(values.items())]
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+REQUEST_SECONDS = Histogram(
+    "wedding_http_request_duration_seconds", "Time to produce a response.", ("view", "method", "status"),
+)
+REQUEST_QUERIES = Histogram(
+    "wedding_http_request_db_queries", "SQL queries run per request.", ("view",), COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "wedding_http_request_db_duration_seconds", "Time per request spent in SQL queries.", ("view",), FAST_BUCKETS,
+)
+SERIALIZER_SECONDS = Histogram(
+    "wedding_serializer_duration_seconds", "Time to serialize a response payload.", ("serializer",), FAST_BUCKETS,
+)
+GOOGLE_SECONDS = Histogram(
+    "wedding_google_request_duration_seconds", "Latency of calls to Google OAuth and Drive.", ("endpoint", "status"),
+)
+SLOW_REQUESTS = Counter(
+    "wedding_slow_requests_total", "Requests slower than METRICS_SLOW_REQUEST_SECONDS.", ("view",),
+)
+REGISTRY = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, SERIALIZER_SECONDS, GOOGLE_SECONDS, SLOW_REQUESTS]
+
+
+def render():
+    """
+    Every metric in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.collect()
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.clear()
+
+
+# ---------------------- Per-request stats ----------------------
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "serializer_seconds", "google_seconds", "slowest_sql")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.google_seconds = 0.0
+        # Min-heap of (seconds, sql) holding the slowest statements
+        self.slowest_sql = []
+
+    def add_query(self, seconds, sql):
+        self.queries += 1
+        self.db_seconds += seconds
+        if len(self.slowest_sql) < settings.METRICS_SQL_SAMPLE_SIZE:
+            heapq.heappush(self.slowest_sql, (seconds, sql))
+        elif self.slowest_sql and seconds > self.slowest_sql[0][0]:
+            heapq.heapreplace(self.slowest_sql, (seconds, sql))
+
+
+current = contextvars.ContextVar("wedding_request_stats", default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(time.perf_counter() - started, sql)
+
+
+def install_query_timer(sender=None, connection=None, **kwargs):
+    # First in line: execute_wrapper() blocks pop the last entry when they exit,
+    # and the connection may be opened inside one
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _time_query)
+
+
+def install_on_open_connections():
+    # Connections opened before this module was imported
+    for connection in connections.all(initialized_only=True):
+        install_query_timer(connection=connection)
+
+
+connection_created.connect(install_query_timer, dispatch_uid="wedding.metrics.query_timer")
+
+
+def observe_serializer(name, seconds):
+    SERIALIZER_SECONDS.observe(seconds, name)
+    stats = current.get()
+    if stats is not None:
+        stats.serializer_seconds += seconds
+
+
+def observe_google(endpoint, status, seconds):
+    GOOGLE_SECONDS.observe(seconds, endpoint, str(status))
+    stats = current.get()
+    if stats is not None:
+        stats.google_seconds += seconds
+
+
+def google_endpoint(url):
+    """
+    Short name of a Google endpoint, for labels.
+    """
+    parts = urlsplit(str(url))
+    if parts.path.endswith("/token"):
+        return "oauth.token"
+    if "upload_id=" in parts.query or parts.path.startswith("/upload/session/"):
+        return "drive.upload.chunk"
+    if parts.path.startswith("/upload/drive/"):
+        return "drive.upload.start"
+    if parts.path.endswith("/permissions"):
+        return "drive.permissions"
+    if parts.path.startswith("/batch/"):
+        return "drive.batch"
+    return "other"
+
+
+def record_requests_response(response, *args, **kwargs):
+    """
+    ``requests`` response hook: time to response headers of a sync Google call.
+    """
+    observe_google(google_endpoint(response.url), response.status_code, response.elapsed.total_seconds())
+
+
+@contextlib.contextmanager
+def time_google(endpoint):
+    """
+    Time a Google call made through a client library rather than our sessions.
+    """
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        observe_google(endpoint, status, time.perf_counter() - started)
+
+
+# ---------------------- Request bookkeeping ----------------------
+
+def begin():
+    stats = RequestStats()
+    return stats, current.set(stats), time.perf_counter()
+
+
+def finish(request, response, stats, token, started):
+    elapsed = time.perf_counter() - started
+    current.reset(token)
+    match = getattr(request, "resolver_match", None)
+    view = (match.view_name or match.url_name or "unnamed") if match else "unmatched"
+    status = response.status_code if response is not None else 500
+
+    REQUEST_SECONDS.observe(elapsed, view, request.method, str(status))
+    REQUEST_QUERIES.observe(stats.queries, view)
+    REQUEST_DB_SECONDS.observe(stats.db_seconds, view)
+
+    if elapsed >= settings.METRICS_SLOW_REQUEST_SECONDS:
+        SLOW_REQUESTS.inc(view)
+        sample = "".join(
+            f"\n  {seconds * 1000:8.1f} ms  {sql[:500]}" for seconds, sql in sorted(stats.slowest_sql, reverse=True)
+        )
+        logger.warning(
+            "Slow request %s %s (%s) -> %s in %.3fs: %d queries in %.3fs, serializers %.3fs, Google %.3fs%s",
+            request.method, request.path, view, status, elapsed, stats.queries, stats.db_seconds,
+            stats.serializer_seconds, stats.google_seconds, sample,
+        )
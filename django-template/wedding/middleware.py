@@ -0,0 +1,74 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import metrics
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that also runs natively under ASGI. The stock middleware is
+    sync-only, which makes Django run every request that passes through it on
+    one shared thread, so the async live-events stream (``LiveEventsView``)
+    would hold a thread per open connection.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    """
+    Time every request and record its SQL, serializer and Google totals (see
+    ``wedding.metrics``). Works natively in both sync and async stacks.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        metrics.install_on_open_connections()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token, started = metrics.begin()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            metrics.finish(request, response, stats, token, started)
+
+    async def __acall__(self, request):
+        stats, token, started = metrics.begin()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            metrics.finish(request, response, stats, token, started)
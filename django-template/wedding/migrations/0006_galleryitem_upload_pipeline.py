@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0005_remove_gift_price_remove_guest_meal_preference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='galleryitem',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='galleryitem',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='galleryitem',
+            name='file',
+            field=models.FileField(blank=True, null=True, upload_to='gallery/spool/'),
+        ),
+        migrations.AddField(
+            model_name='galleryitem',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('done', 'Done'), ('failed', 'Failed')], default='done', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='galleryitem',
+            name='title',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0006_galleryitem_upload_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='galleryitem',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-18 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0007_galleryitem_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='galleryitem',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='gallery_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gift',
+            index=models.Index(fields=['title', 'id'], name='gift_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='guest',
+            index=models.Index(fields=['-created_at', '-id'], name='guest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wish',
+            index=models.Index(fields=['-created_at', '-id'], name='wish_created_idx'),
+        ),
+    ]
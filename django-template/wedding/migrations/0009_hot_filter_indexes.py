@@ -0,0 +1,33 @@
+# Generated by Django 5.0.4 on 2026-10-18 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0008_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='galleryitem',
+            index=models.Index(fields=['guest', '-uploaded_at'], name='gallery_guest_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='galleryitem',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['uploaded_at'], name='gallery_upload_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gift',
+            index=models.Index(condition=models.Q(('reserved', True)), fields=['title'], name='gift_reserved_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gift',
+            index=models.Index(condition=models.Q(('reserved', False)), fields=['title'], name='gift_unreserved_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wish',
+            index=models.Index(fields=['guest', '-created_at'], name='wish_guest_created_idx'),
+        ),
+    ]
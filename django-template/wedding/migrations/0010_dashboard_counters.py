@@ -0,0 +1,40 @@
+# Generated by Django 5.0.4 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+def seed_counters(apps, schema_editor):
+    from wedding import stats
+    stats.rebuild(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0009_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('hour', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyactivity',
+            constraint=models.UniqueConstraint(fields=('kind', 'hour'), name='hourly_activity_kind_hour_uniq'),
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.4 on 2026-10-18 18:44
+
+import re
+from django.db import migrations, models
+
+
+def backfill_drive_keys(apps, schema_editor):
+    # Every existing object is on Drive; its file id is in the view link
+    GalleryItem = apps.get_model("wedding", "GalleryItem")
+    UploadedFile = apps.get_model("wedding", "UploadedFile")
+    for model, field in ((GalleryItem, "image"), (UploadedFile, "drive_link")):
+        for pk, link in model.objects.exclude(**{f"{field}__isnull": True}).values_list("pk", field).iterator():
+            match = re.search(r"/file/d/([^/]+)", link or "")
+            if match:
+                model.objects.filter(pk=pk).update(storage_key=match[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0010_dashboard_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='galleryitem',
+            name='storage_backend',
+            field=models.CharField(default='drive', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='galleryitem',
+            name='storage_key',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='storage_backend',
+            field=models.CharField(default='drive', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='storage_key',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_drive_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from wedding import search
+    search.install(apps, schema_editor)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from wedding import search
+    search.uninstall(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0013_live_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
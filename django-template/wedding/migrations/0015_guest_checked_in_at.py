@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guest',
+            name='checked_in_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
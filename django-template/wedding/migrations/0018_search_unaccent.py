@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def rebuild_search_index(apps, schema_editor):
+    # The Postgres index expressions now strip accents; SQLite's FTS5 tables already did
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    from wedding import search
+    search.uninstall(apps, schema_editor)
+    search.install(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wedding', '0017_galleryitem_claimed_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_search_index, migrations.RunPython.noop),
+    ]
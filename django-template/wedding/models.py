@@ -1,4 +1,6 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 import uuid
 
 class Guest(models.Model):
@@ -9,8 +11,13 @@ class Guest(models.Model):
     email = models.EmailField(unique=True)
     phone = models.CharField(max_length=30, blank=True, null=True)
     rsvp_status = models.BooleanField(default=False)
+    # Arrival at the venue, from the door's check-in devices (wedding/checkin.py)
+    checked_in_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["-created_at", "-id"], name="guest_created_idx")]
+
     def __str__(self):
         return f"{self.name} <{self.email}>"
 
@@ -23,6 +30,17 @@ class Gift(models.Model):
     reserved_by = models.ForeignKey(Guest, on_delete=models.SET_NULL, null=True, blank=True, related_name="reserved_gifts")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["title", "id"], name="gift_title_idx"),
+            # The reserved filter (admin list_filter) ordered by title. A pair of
+            # partial indexes rather than one (reserved, title) index, because
+            # the ORM emits "WHERE reserved" / "WHERE NOT reserved", which
+            # SQLite cannot match against an equality on an index column.
+            models.Index(fields=["title"], condition=models.Q(reserved=True), name="gift_reserved_title_idx"),
+            models.Index(fields=["title"], condition=models.Q(reserved=False), name="gift_unreserved_title_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -32,24 +50,146 @@ class Wish(models.Model):
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="wish_created_idx"),
+            models.Index(fields=["guest", "-created_at"], name="wish_guest_created_idx"),
+        ]
+
     def __str__(self):
         return f"Wish from {self.guest.name}"
 
+class UploadStatus(models.TextChoices):
+    PENDING = "pending", "Pending"
+    UPLOADING = "uploading", "Uploading"
+    DONE = "done", "Done"
+    FAILED = "failed", "Failed"
+
 class GalleryItem(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     guest = models.ForeignKey(Guest, on_delete=models.SET_NULL, null=True, blank=True, related_name="photos")
+    title = models.CharField(max_length=255, blank=True)
     image = models.URLField(blank=True, null=True)
+    # Resized copies keyed by size name: {"thumbnail": {"url", "width", "height", ...}}
+    variants = models.JSONField(default=dict, blank=True)
     caption = models.CharField(max_length=255, blank=True, null=True)
+    # Local spool copy of an upload that has not reached Drive yet
+    file = models.FileField(upload_to="gallery/spool/", blank=True, null=True)
+    status = models.CharField(max_length=16, choices=UploadStatus.choices, default=UploadStatus.DONE)
+    # Backend (settings.GALLERY_STORAGE_BACKENDS) holding the media, and its key there
+    storage_backend = models.CharField(max_length=16, default="drive")
+    storage_key = models.CharField(max_length=255, blank=True)
+    # SHA-256 of the original upload (the content index) and a 64-bit dHash for near-duplicates
+    sha256 = models.CharField(max_length=64, blank=True)
+    phash = models.CharField(max_length=16, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # When a worker last claimed the upload; an "uploading" row older than the claim timeout was abandoned
+    claimed_at = models.DateTimeField(blank=True, null=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["-uploaded_at", "-id"], name="gallery_uploaded_idx"),
+            models.Index(fields=["guest", "-uploaded_at"], name="gallery_guest_uploaded_idx"),
+            # Upload queue scan; finished rows (nearly all of them) stay out of the index
+            models.Index(fields=["uploaded_at"], condition=models.Q(status="pending"), name="gallery_upload_queue_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["sha256"], condition=~models.Q(sha256=""), name="gallery_sha256_uniq"),
+        ]
+
     def __str__(self):
         return f"Photo {self.id}"
 
 class UploadedFile(models.Model):
     filename = models.CharField(max_length=255)
     drive_link = models.URLField()
+    storage_backend = models.CharField(max_length=16, default="drive")
+    storage_key = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.filename
 
+
+class StatCounter(models.Model):
+    """
+    Running totals for the admin dashboard, kept up to date by the signal
+    handlers in ``wedding/signals.py`` (through ``wedding/stats.py``) so
+    reading them never scans the source tables.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+class HourlyActivity(models.Model):
+    kind = models.CharField(max_length=16)
+    hour = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["kind", "hour"], name="hourly_activity_kind_hour_uniq")]
+
+    def __str__(self):
+        return f"{self.kind} @ {self.hour:%Y-%m-%d %H:00}: {self.count}"
+
+
+class LiveEvent(models.Model):
+    """
+    Log of the deltas pushed to live clients (``wedding/live.py``). The id is
+    the cursor a reconnecting client resumes from; old rows are pruned.
+    """
+    topic = models.CharField(max_length=16)
+    kind = models.CharField(max_length=32)
+    data = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind}"
+
+
+class JobStatus(models.TextChoices):
+    QUEUED = "queued", "Queued"
+    RUNNING = "running", "Running"
+    DONE = "done", "Done"
+    # Out of attempts, or failed in a way retrying cannot fix
+    DEAD = "dead", "Dead"
+
+
+class Job(models.Model):
+    """
+    Background work for the ``run_jobs`` workers; see ``wedding/jobs.py``.
+    """
+    task = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    idempotency_key = models.CharField(max_length=128, blank=True)
+    status = models.CharField(max_length=16, choices=JobStatus.choices, default=JobStatus.QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # Earliest time a queued job may run; pushed back after a failed attempt
+    run_at = models.DateTimeField(default=timezone.now)
+    # Lease of the worker running the job; once it runs out, another worker takes the job
+    lease = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    result = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Claim scans; finished jobs (nearly all of them) stay out of both indexes
+            models.Index(fields=["run_at"], condition=models.Q(status="queued"), name="job_queue_idx"),
+            models.Index(fields=["locked_until"], condition=models.Q(status="running"), name="job_lease_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["idempotency_key"], condition=~models.Q(idempotency_key=""), name="job_idempotency_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+class NewestFirstPagination(CursorPagination):
+    """
+    Keyset pagination: each page is a range scan from the cursor position on an
+    indexed column, so deep pages cost the same as the first one. The primary
+    key breaks ties so rows sharing a timestamp or title keep a stable order.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = ("-created_at", "-id")
+
+
+class GalleryPagination(NewestFirstPagination):
+    ordering = ("-uploaded_at", "-id")
+
+
+class GiftPagination(NewestFirstPagination):
+    ordering = ("title", "id")
@@ -0,0 +1,93 @@
+"""
+Read-through cache for the public JSON list/retrieve endpoints.
+
+Cached entries live under a per-scope version token. Writes never hunt for
+keys to delete: they replace the token (``bump_version``), which orphans every
+entry of that scope at once and lets them age out. The token is replaced when
+the write commits, not before: a request reading in between would otherwise
+cache the old rows under the new token. Each entry carries an ETag so
+unchanged responses can be answered with 304 Not Modified.
+
+The cache backend is whatever ``CACHES["default"]`` is. With the local-memory
+default every process has its own tokens, so writes made in one gunicorn
+worker are only seen by the others once ``WEDDING_RESPONSE_CACHE_TTL`` expires;
+use the file or Redis backend to share them.
+"""
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+
+def _version_key(scope):
+    return f"wedding:version:{scope}"
+
+
+def get_version(scope):
+    version = cache.get(_version_key(scope))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(_version_key(scope), version, timeout=None):
+            version = cache.get(_version_key(scope), version)
+    return version
+
+
+def bump_version(*scopes):
+    """
+    Replace the tokens of ``scopes`` once the surrounding transaction commits
+    (straight away outside one).
+    """
+    def replace():
+        for scope in scopes:
+            cache.set(_version_key(scope), uuid.uuid4().hex, timeout=None)
+    transaction.on_commit(replace)
+
+
+def etag_matches(request, etag):
+    header = request.META.get("HTTP_IF_NONE_MATCH", "")
+    return etag in (tag.strip() for tag in header.split(",")) or header.strip() == "*"
+
+
+class CachedResponseMixin:
+    """
+    Serve ``cache_actions`` from the cache for JSON requests, keyed by
+    ``cache_scope`` version and the full request path. Staff and the public
+    get separate entries, as staff responses show more.
+    """
+    cache_scope = None
+    cache_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(request, super().retrieve, *args, **kwargs)
+
+    def _cached(self, request, handler, *args, **kwargs):
+        if self.action not in self.cache_actions or request.accepted_renderer.format != "json":
+            return handler(request, *args, **kwargs)
+
+        path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        audience = "staff" if request.user.is_staff else "public"
+        key = f"wedding:response:{self.cache_scope}:{get_version(self.cache_scope)}:{audience}:{path_hash}"
+        entry = cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            entry = (f'"{hashlib.md5(content).hexdigest()}"', content)
+            cache.set(key, entry, timeout=settings.WEDDING_RESPONSE_CACHE_TTL)
+
+        etag, content = entry
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type="application/json")
+        response["ETag"] = etag
+        # Let browsers keep the body but revalidate it with If-None-Match each time
+        response["Cache-Control"] = "no-cache"
+        return response
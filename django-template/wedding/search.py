@@ -0,0 +1,337 @@
+"""
+Full-text search over guests (name, email) and wishes (message).
+
+Each database gets its own index:
+
+* SQLite: FTS5 tables (``wedding_guest_fts``, ``wedding_wish_fts``) kept in
+  sync by signal handlers, in the same transaction as the write, and by the
+  bulk paths that bypass signals. A document's rowid is derived from its
+  UUID, so updating it is one ``INSERT OR REPLACE`` by primary key.
+* PostgreSQL: GIN indexes over ``to_tsvector('simple', ...)`` expressions,
+  which maintain themselves; queries repeat the indexed expression verbatim.
+  The text goes through ``unaccent`` (behind an immutable wrapper, as index
+  expressions require), so "zoe" finds "Zoë" as it does on SQLite.
+* Anything else, or SQLite built without FTS5: ``icontains`` scans. This is
+  also the baseline ``bench_search`` compares against.
+
+Queries are split into words and every word must match, the last one as a
+prefix, so results narrow as the user types ("amina ker" finds "Amina
+Kerubo"). Only the last word is a prefix because a short prefix of a common
+word expands to thousands of index terms. The index only finds candidates,
+best first by the engine's own rank, up to ``SEARCH_CANDIDATE_LIMIT`` (admin
+filters take them all). The
+final order comes from ``score``, computed in Python the same way on every
+backend, so a query ranks the same rows identically on SQLite and Postgres.
+"""
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import reduce
+from operator import and_, or_
+from typing import Callable
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.models import Q
+
+# Words past this are ignored; nobody types more to find a guest
+MAX_TERMS = 8
+_WORD = re.compile(r"[^\W_]+")
+
+
+@dataclass(frozen=True)
+class Document:
+    model: str
+    table: str
+    # Searchable field -> weight in ``score``
+    fields: dict
+    # Tie-break among equal scores (on a row of values), and the fields it reads
+    order: Callable
+    order_fields: tuple
+    select_related: tuple = ()
+
+    def get_model(self, apps=django_apps):
+        return apps.get_model("wedding", self.model)
+
+
+DOCUMENTS = {
+    "guest": Document(
+        "Guest", "wedding_guest", {"name": 3, "email": 1},
+        order=lambda row: (row["name"].lower(), str(row["pk"])), order_fields=("name",),
+    ),
+    "wish": Document(
+        "Wish", "wedding_wish", {"message": 1},
+        order=lambda row: (-row["created_at"].timestamp(), str(row["pk"])), order_fields=("created_at",),
+        select_related=("guest",),
+    ),
+}
+
+
+def normalize(text):
+    """
+    Lowercase and strip accents, as FTS5's ``remove_diacritics`` does.
+    """
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def tokenize(text):
+    return _WORD.findall(normalize(text))
+
+
+def score(document, row, terms):
+    """
+    Sum over the query terms of the best match in any field: a whole word
+    scores twice the field's weight, and for the last term a word prefix
+    scores its weight. None if a term matches nowhere.
+    """
+    words = {field: tokenize(str(row[field] or "")) for field in document.fields}
+    total = 0
+    for position, term in enumerate(terms, start=1):
+        prefix = position == len(terms)
+        best = 0
+        for field, weight in document.fields.items():
+            for word in words[field]:
+                if word == term:
+                    best = max(best, 2 * weight)
+                elif prefix and word.startswith(term):
+                    best = max(best, weight)
+        if not best:
+            return None
+        total += best
+    return total
+
+
+# ---------------------- Backends ----------------------
+
+class IContainsBackend:
+    name = "icontains"
+
+    def candidates(self, document, terms, limit):
+        model = document.get_model()
+        condition = reduce(and_, (
+            reduce(or_, (Q(**{f"{field}__icontains": term}) for field in document.fields)) for term in terms
+        ))
+        return list(model.objects.filter(condition).values_list("pk", flat=True)[:limit])
+
+    def index(self, document, objs):
+        pass
+
+    def remove(self, document, pks):
+        pass
+
+    def rebuild(self, apps=django_apps):
+        pass
+
+
+class SqliteFTSBackend(IContainsBackend):
+    name = "sqlite-fts5"
+
+    @staticmethod
+    def fts_table(document):
+        return f"{document.table}_fts"
+
+    @staticmethod
+    def rowid(pk):
+        # 60 bits of the UUID: collisions are out of reach at wedding scale
+        return int(str(pk).replace("-", "")[:15], 16)
+
+    def candidates(self, document, terms, limit):
+        table = self.fts_table(document)
+        weights = ", ".join(str(float(weight)) for weight in document.fields.values())
+        match = " AND ".join(f'"{term}"' for term in terms) + "*"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT object_id FROM {table} WHERE {table} MATCH %s "
+                f"ORDER BY bm25({table}, 0, {weights}) LIMIT %s",
+                [match, -1 if limit is None else limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, document, objs):
+        rows = [
+            (self.rowid(obj.pk), obj.pk.hex, *(getattr(obj, field) or "" for field in document.fields))
+            for obj in objs
+        ]
+        if not rows:
+            return
+        table = self.fts_table(document)
+        columns = ", ".join(document.fields)
+        placeholders = ", ".join(["%s"] * (len(document.fields) + 2))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {table} (rowid, object_id, {columns}) VALUES ({placeholders})", rows
+            )
+
+    def remove(self, document, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {self.fts_table(document)} WHERE rowid = %s", [(self.rowid(pk),) for pk in pks]
+            )
+
+    def rebuild(self, apps=django_apps):
+        for document in DOCUMENTS.values():
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {self.fts_table(document)}")
+            queryset = document.get_model(apps).objects.only("pk", *document.fields).order_by()
+            batch = []
+            for obj in queryset.iterator(chunk_size=2000):
+                batch.append(obj)
+                if len(batch) >= 2000:
+                    self.index(document, batch)
+                    batch = []
+            self.index(document, batch)
+
+
+class PostgresBackend(IContainsBackend):
+    name = "postgres-tsvector"
+
+    # unaccent() is only STABLE (its dictionary could change), which an index
+    # expression may not be; this wrapper pins the dictionary
+    UNACCENT = (
+        "CREATE OR REPLACE FUNCTION wedding_unaccent(text) RETURNS text "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+        "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$"
+    )
+    # The exact expressions the GIN indexes are built on. Accents are stripped
+    # and punctuation in emails becomes spaces so their parts are words, as in
+    # the SQLite tokenizer.
+    VECTORS = {
+        "wedding_guest": (
+            "to_tsvector('simple'::regconfig, wedding_unaccent(coalesce(name, '') || ' ' || "
+            "regexp_replace(coalesce(email, ''), '[^[:alnum:]]+', ' ', 'g')))"
+        ),
+        "wedding_wish": "to_tsvector('simple'::regconfig, wedding_unaccent(coalesce(message, '')))",
+    }
+
+    def candidates(self, document, terms, limit):
+        vector = self.VECTORS[document.table]
+        query = " & ".join(terms) + ":*"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id FROM {document.table} "
+                f"WHERE {vector} @@ to_tsquery('simple'::regconfig, %s) "
+                f"ORDER BY ts_rank({vector}, to_tsquery('simple'::regconfig, %s)) DESC LIMIT %s",
+                [query, query, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+_backends = {}
+
+
+def get_backend():
+    key = (connection.vendor, str(connection.settings_dict["NAME"]))
+    backend = _backends.get(key)
+    if backend is None:
+        backend = _backends[key] = _detect_backend()
+    return backend
+
+
+def _detect_backend():
+    if connection.vendor == "postgresql":
+        return PostgresBackend()
+    if connection.vendor == "sqlite":
+        tables = connection.introspection.table_names()
+        if all(SqliteFTSBackend.fts_table(document) in tables for document in DOCUMENTS.values()):
+            return SqliteFTSBackend()
+    return IContainsBackend()
+
+
+# ---------------------- Queries ----------------------
+
+def _ranked(kind, query, backend, limit):
+    document = DOCUMENTS[kind]
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+    if not terms:
+        return document, []
+    backend = backend or get_backend()
+    ids = backend.candidates(document, terms, limit)
+    # Rank on plain values of just the fields scoring reads; callers load the winners
+    rows = document.get_model().objects.filter(pk__in=ids).values("pk", *document.fields, *document.order_fields)
+    scored = [(score(document, row, terms), row) for row in rows]
+    scored = [(points, row) for points, row in scored if points is not None]
+    scored.sort(key=lambda pair: (-pair[0], document.order(pair[1])))
+    return document, [row["pk"] for _, row in scored]
+
+
+def search(kind, query, limit=20, backend=None):
+    """
+    The best ``limit`` guests or wishes (``kind``) for ``query``, best first.
+    """
+    document, pks = _ranked(kind, query, backend, settings.SEARCH_CANDIDATE_LIMIT)
+    pks = pks[:limit]
+    if not pks:
+        return []
+    objs = document.get_model().objects.filter(pk__in=pks)
+    if document.select_related:
+        objs = objs.select_related(*document.select_related)
+    by_pk = {obj.pk: obj for obj in objs}
+    return [by_pk[pk] for pk in pks]
+
+
+def matching_ids(kind, query):
+    """
+    Primary keys of every row that matches ``query``, for admin filters. Not
+    capped by ``SEARCH_CANDIDATE_LIMIT``: the admin pages through them all.
+    """
+    return _ranked(kind, query, None, None)[1]
+
+
+# ---------------------- Index maintenance ----------------------
+
+def index(kind, objs):
+    get_backend().index(DOCUMENTS[kind], objs)
+
+
+def remove(kind, pks):
+    get_backend().remove(DOCUMENTS[kind], pks)
+
+
+def rebuild(apps=django_apps):
+    """
+    Refill the index from the source tables, after bulk writes or to repair drift.
+    """
+    get_backend().rebuild(apps)
+
+
+def install(apps, schema_editor):
+    """
+    Create the index for the migration's database (see module docstring).
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for document in DOCUMENTS.values():
+            columns = ", ".join(document.fields)
+            try:
+                schema_editor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SqliteFTSBackend.fts_table(document)} "
+                    f"USING fts5(object_id UNINDEXED, {columns}, "
+                    # Prefix indexes: every query term is a prefix
+                    "tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3 4')"
+                )
+            except OperationalError:
+                # SQLite without FTS5: search falls back to icontains
+                return
+        _backends.clear()
+        SqliteFTSBackend().rebuild(apps)
+    elif vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+        schema_editor.execute(PostgresBackend.UNACCENT)
+        for document in DOCUMENTS.values():
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {document.table}_search_idx "
+                f"ON {document.table} USING gin ({PostgresBackend.VECTORS[document.table]})"
+            )
+
+
+def uninstall(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for document in DOCUMENTS.values():
+        if vendor == "sqlite":
+            schema_editor.execute(f"DROP TABLE IF EXISTS {SqliteFTSBackend.fts_table(document)}")
+        elif vendor == "postgresql":
+            schema_editor.execute(f"DROP INDEX IF EXISTS {document.table}_search_idx")
+    if vendor == "postgresql":
+        schema_editor.execute("DROP FUNCTION IF EXISTS wedding_unaccent(text)")
+    _backends.clear()
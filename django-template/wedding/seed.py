@@ -0,0 +1,75 @@
+"""
+Deterministic fixture data for benchmarks and local load tests.
+
+``seed`` fills the tables with ``guests`` guests, ``gifts`` gifts (a share of
+them reserved), ``wishes`` wishes and ``photos`` uploaded gallery items, all
+derived from ``rng_seed`` so two runs on an empty database produce the same
+shape of data. Rows go in with ``bulk_create``, then the dashboard counters
+and the search index are rebuilt.
+"""
+import hashlib
+import random
+from . import search, stats
+from .models import Guest, Gift, Wish, GalleryItem, UploadStatus
+
+EMAIL_DOMAIN = "bench.example.com"
+GIFT_NAMES = ["Toaster", "Blender", "Kettle", "Dinner set", "Sofa", "Microwave", "Duvet", "Cookware", "Rice cooker"]
+BATCH_SIZE = 1000
+
+
+def seed(guests=200, gifts=50, wishes=300, photos=200, reserved_share=0.3, rng_seed=0):
+    """
+    Insert the fixture rows and return their counts by table.
+    """
+    rng = random.Random(rng_seed)
+
+    guest_rows = Guest.objects.bulk_create([
+        Guest(
+            name=f"Guest {n}",
+            email=f"guest{n}@{EMAIL_DOMAIN}",
+            phone=f"07{rng.randrange(10 ** 8):08d}",
+            rsvp_status=rng.random() < 0.6,
+        )
+        for n in range(guests)
+    ], batch_size=BATCH_SIZE)
+
+    def some_guest():
+        return rng.choice(guest_rows) if guest_rows else None
+
+    gift_rows = []
+    for n in range(gifts):
+        holder = some_guest() if rng.random() < reserved_share else None
+        gift_rows.append(Gift(
+            title=f"{rng.choice(GIFT_NAMES)} {n}",
+            link=f"https://shop.example.com/item/{n}",
+            reserved=holder is not None,
+            reserved_by=holder,
+        ))
+    Gift.objects.bulk_create(gift_rows, batch_size=BATCH_SIZE)
+
+    if guest_rows:
+        Wish.objects.bulk_create([
+            Wish(guest=some_guest(), message=f"Hongera! Wishing you both a lifetime of joy ({n})")
+            for n in range(wishes)
+        ], batch_size=BATCH_SIZE)
+    else:
+        wishes = 0
+
+    photo_rows = []
+    for n in range(photos):
+        key = f"seed-{rng_seed}-{n}"
+        photo_rows.append(GalleryItem(
+            guest=some_guest() if rng.random() < 0.5 else None,
+            title=f"IMG_{n:04d}.jpg",
+            image=f"https://drive.google.com/file/d/{key}/view",
+            status=UploadStatus.DONE,
+            storage_backend="drive",
+            storage_key=key,
+            sha256=hashlib.sha256(key.encode()).hexdigest(),
+            phash=f"{rng.getrandbits(64):016x}",
+        ))
+    GalleryItem.objects.bulk_create(photo_rows, batch_size=BATCH_SIZE)
+
+    stats.rebuild()
+    search.rebuild()
+    return {"guests": guests, "gifts": gifts, "wishes": wishes, "photos": photos}
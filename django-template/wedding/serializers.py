@@ -1,45 +1,188 @@
+import time
+from django.core.exceptions import FieldDoesNotExist
 from rest_framework import serializers
+from . import metrics
 from .models import Guest, Gift, Wish, GalleryItem
 
-class GuestSerializer(serializers.ModelSerializer):
+
+class TimedSerializerMixin:
+    """
+    Report the time spent producing ``.data`` to the request metrics.
+    """
+
+    @property
+    def data(self):
+        if hasattr(self, '_data'):
+            return super().data
+        started = time.perf_counter()
+        data = super().data
+        metrics.observe_serializer(self.metric_name(), time.perf_counter() - started)
+        return data
+
+    def metric_name(self):
+        return type(self).__name__
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+
+    def metric_name(self):
+        return f"{type(self.child).__name__}[]"
+
+
+def parse_fieldset(value):
+    """
+    A ``?fields=``/``?expand=`` value as a tree of names, dotted names
+    nesting: ``"id,guest.name"`` is ``{"id": {}, "guest": {"name": {}}}``.
+    None when the parameter is absent or blank.
+    """
+    if value is None:
+        return None
+    tree = {}
+    for path in value.split(","):
+        node = tree
+        for name in filter(None, (part.strip() for part in path.split("."))):
+            node = node.setdefault(name, {})
+    return tree or None
+
+
+class SparseFieldsetMixin:
+    """
+    Sparse fieldsets for a model serializer, from ``?fields=`` and
+    ``?expand=`` (see ``parse_fieldset``):
+
+    * ``fields`` names the fields to return. Naming a relation from
+      ``Meta.expandable_fields`` (field name: serializer) nests it, and
+      dotted names pick its fields (``guest.name``).
+    * ``expand`` nests relations on top of the default fields.
+    * Without ``fields``, public requests get ``Meta.default_fields`` and
+      staff get every field with every relation expanded.
+    * ``Meta.staff_fields`` (guest contact details, who reserved a gift) are
+      never shown to the public; asking for them is an error, as is asking
+      for a field that does not exist.
+
+    The selection only shapes output: every writable field is still
+    validated and saved. ``only()`` names the columns and relations the
+    chosen fields read, so views can load nothing else.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, staff=False, **kwargs):
+        self.requested_fields = fields
+        self.requested_expand = expand
+        self.staff = staff
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        meta = self.Meta
+        expandable = getattr(meta, "expandable_fields", {})
+        hidden = set() if self.staff else set(getattr(meta, "staff_fields", ()))
+        expand = dict(self.requested_expand or {})
+
+        if self.requested_fields is not None:
+            requested = self.requested_fields
+        elif self.staff:
+            requested = {name: {} for name in [*fields, *expandable]}
+        else:
+            requested = {name: {} for name in getattr(meta, "default_fields", fields)}
+        unknown = [name for name in [*requested, *expand] if name not in fields and name not in expandable]
+        private = [name for name in [*requested, *expand] if name in hidden]
+        if unknown or private:
+            raise serializers.ValidationError({"fields": [f"Unknown field {name!r}" for name in unknown + private]})
+
+        self.selected_fields = {name for name in fields if name in requested and name not in hidden}
+        for name, serializer_class in expandable.items():
+            if name in requested or name in expand:
+                fields[name] = serializer_class(
+                    read_only=True, staff=self.staff,
+                    fields=requested.get(name) or None, expand=expand.get(name) or None,
+                )
+                self.selected_fields.add(name)
+        return fields
+
+    @property
+    def _readable_fields(self):
+        for name, field in self.fields.items():
+            if name in self.selected_fields and not field.write_only:
+                yield field
+
+    def only(self):
+        """
+        ``(columns, relations)`` for ``QuerySet.only()`` and ``select_related()``.
+        """
+        model = self.Meta.model
+        columns, relations = [model._meta.pk.name], []
+        for field in self._readable_fields:
+            if isinstance(field, SparseFieldsetMixin):
+                nested_columns, nested_relations = field.only()
+                columns += [field.source] + [f"{field.source}__{column}" for column in nested_columns]
+                relations += [field.source] + [f"{field.source}__{relation}" for relation in nested_relations]
+                continue
+            try:
+                model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                continue
+            columns.append(field.source)
+        return columns, relations
+
+
+class GuestSerializer(SparseFieldsetMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Guest
         fields = ['id', 'name', 'email', 'phone', 'rsvp_status', 'created_at']
         read_only_fields = ['id', 'created_at']
+        list_serializer_class = TimedListSerializer
+        default_fields = ['id', 'name', 'rsvp_status']
+        staff_fields = ['email', 'phone']
 
-class GiftSerializer(serializers.ModelSerializer):
-    reserved_by = GuestSerializer(read_only=True)
+class GuestUpsertSerializer(serializers.ModelSerializer):
+    # Plain field: uniqueness is handled by the upsert, not a query per row
+    email = serializers.EmailField(max_length=254)
 
+    class Meta:
+        model = Guest
+        fields = ['name', 'email', 'phone', 'rsvp_status']
+
+class CheckinArrivalSerializer(serializers.Serializer):
+    guest_id = serializers.UUIDField()
+    # When the door device marked the arrival, which may be well before it synced
+    checked_in_at = serializers.DateTimeField()
+
+class GiftSerializer(SparseFieldsetMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Gift
-        fields = ['id', 'title', 'image', 'link', 'reserved', 'reserved_by', 'created_at']
+        fields = ['id', 'title', 'image', 'link', 'reserved', 'created_at']
         read_only_fields = ['id', 'created_at']
+        list_serializer_class = TimedListSerializer
+        expandable_fields = {'reserved_by': GuestSerializer}
+        staff_fields = ['reserved_by']
 
 class GiftReserveSerializer(serializers.Serializer):
     guest_id = serializers.UUIDField()
 
-class WishSerializer(serializers.ModelSerializer):
-    guest = GuestSerializer(read_only=True)
+class WishSerializer(SparseFieldsetMixin, TimedSerializerMixin, serializers.ModelSerializer):
     guest_id = serializers.UUIDField(write_only=True, required=True)
 
     class Meta:
         model = Wish
-        fields = ['id', 'guest', 'guest_id', 'message', 'created_at']
-        read_only_fields = ['id', 'guest', 'created_at']
+        fields = ['id', 'guest_id', 'message', 'created_at']
+        read_only_fields = ['id', 'created_at']
+        list_serializer_class = TimedListSerializer
+        expandable_fields = {'guest': GuestSerializer}
 
     def create(self, validated_data):
         guest_id = validated_data.pop('guest_id')
         guest = Guest.objects.get(id=guest_id)
         return Wish.objects.create(guest=guest, **validated_data)
 
-class GallerySerializer(serializers.ModelSerializer):
-    guest = GuestSerializer(read_only=True)
+class GallerySerializer(SparseFieldsetMixin, TimedSerializerMixin, serializers.ModelSerializer):
     guest_id = serializers.UUIDField(write_only=True, required=False, allow_null=True)
 
     class Meta:
         model = GalleryItem
-        fields = ['id', 'guest', 'guest_id', 'image', 'caption', 'uploaded_at']
-        read_only_fields = ['id', 'guest', 'uploaded_at']
+        fields = ['id', 'guest_id', 'title', 'image', 'variants', 'caption', 'status', 'uploaded_at']
+        read_only_fields = ['id', 'variants', 'status', 'uploaded_at']
+        list_serializer_class = TimedListSerializer
+        expandable_fields = {'guest': GuestSerializer}
 
     def create(self, validated_data):
         guest_id = validated_data.pop('guest_id', None)
@@ -0,0 +1,150 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from . import live, search, stats
+from .models import Guest, Gift, Wish, GalleryItem, UploadStatus
+from .response_cache import bump_version
+
+
+@receiver([post_save, post_delete], sender=Gift)
+def invalidate_gift_responses(sender, **kwargs):
+    bump_version("gift")
+
+
+@receiver([post_save, post_delete], sender=GalleryItem)
+def invalidate_gallery_responses(sender, **kwargs):
+    bump_version("gallery")
+
+
+@receiver([post_save, post_delete], sender=Guest)
+def invalidate_nested_guest_responses(sender, **kwargs):
+    # Gifts and photos embed their guest; the check-in snapshot lists them all
+    bump_version("gift", "gallery", "checkin")
+
+
+# ---------------------- Dashboard counters ----------------------
+
+# Flag field whose transitions move a second counter, per model
+_TRACKED_FLAGS = {
+    Guest: ("rsvp_status", stats.GUESTS, stats.GUESTS_CONFIRMED),
+    Gift: ("reserved", stats.GIFTS, stats.GIFTS_RESERVED),
+}
+
+
+@receiver(post_init, sender=Guest)
+@receiver(post_init, sender=Gift)
+def remember_tracked_flag(sender, instance, **kwargs):
+    # Read __dict__ directly so a deferred field is not loaded here
+    flag = _TRACKED_FLAGS[sender][0]
+    instance._stats_flag = instance.__dict__.get(flag)
+
+
+@receiver(post_save, sender=Guest)
+@receiver(post_save, sender=Gift)
+def count_saved_flag_model(sender, instance, created, **kwargs):
+    flag, total_key, flag_key = _TRACKED_FLAGS[sender]
+    current = instance.__dict__.get(flag)
+    if created:
+        stats.bump(total_key)
+        if current:
+            stats.bump(flag_key)
+    elif current is not None and instance._stats_flag is not None and current != instance._stats_flag:
+        stats.bump(flag_key, 1 if current else -1)
+    instance._stats_flag = current
+
+
+@receiver(post_delete, sender=Guest)
+@receiver(post_delete, sender=Gift)
+def count_deleted_flag_model(sender, instance, **kwargs):
+    flag, total_key, flag_key = _TRACKED_FLAGS[sender]
+    stats.bump(total_key, -1)
+    if instance._stats_flag:
+        stats.bump(flag_key, -1)
+
+
+@receiver(post_save, sender=Wish)
+def count_new_wish(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(stats.WISHES)
+        stats.bump_hour("wish", instance.created_at)
+
+
+@receiver(post_delete, sender=Wish)
+def count_deleted_wish(sender, instance, **kwargs):
+    stats.bump(stats.WISHES, -1)
+    stats.bump_hour("wish", instance.created_at, -1)
+
+
+@receiver(post_save, sender=GalleryItem)
+def count_new_photo(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(stats.PHOTOS)
+        stats.bump_hour("photo", instance.uploaded_at)
+
+
+@receiver(post_delete, sender=GalleryItem)
+def count_deleted_photo(sender, instance, **kwargs):
+    stats.bump(stats.PHOTOS, -1)
+    stats.bump_hour("photo", instance.uploaded_at, -1)
+
+
+# ---------------------- Live updates ----------------------
+
+@receiver(post_save, sender=Wish)
+def push_new_wish(sender, instance, created, **kwargs):
+    if created:
+        live.publish_on_commit("wishes", "wish", live.wish_delta(instance))
+
+
+@receiver(post_delete, sender=Wish)
+def push_removed_wish(sender, instance, **kwargs):
+    live.publish_on_commit("wishes", "wish.removed", {"id": str(instance.pk)})
+
+
+@receiver(post_save, sender=GalleryItem)
+def push_finished_photo(sender, instance, **kwargs):
+    # Pending uploads appear once the worker saves them as done
+    if instance.status == UploadStatus.DONE:
+        live.publish_on_commit("gallery", "photo", live.photo_delta(instance))
+
+
+@receiver(post_delete, sender=GalleryItem)
+def push_removed_photo(sender, instance, **kwargs):
+    live.publish_on_commit("gallery", "photo.removed", {"id": str(instance.pk)})
+
+
+@receiver(post_save, sender=Gift)
+def push_gift(sender, instance, **kwargs):
+    live.publish_on_commit("gifts", "gift", live.gift_delta(instance))
+
+
+@receiver(post_delete, sender=Gift)
+def push_removed_gift(sender, instance, **kwargs):
+    live.publish_on_commit("gifts", "gift.removed", {"id": str(instance.pk)})
+
+
+# ---------------------- Search index ----------------------
+
+def _text_changed(document, update_fields):
+    return update_fields is None or bool(set(update_fields) & set(search.DOCUMENTS[document].fields))
+
+
+@receiver(post_save, sender=Guest)
+def index_guest(sender, instance, update_fields=None, **kwargs):
+    if _text_changed("guest", update_fields):
+        search.index("guest", [instance])
+
+
+@receiver(post_save, sender=Wish)
+def index_wish(sender, instance, update_fields=None, **kwargs):
+    if _text_changed("wish", update_fields):
+        search.index("wish", [instance])
+
+
+@receiver(post_delete, sender=Guest)
+def unindex_guest(sender, instance, **kwargs):
+    search.remove("guest", [instance.pk])
+
+
+@receiver(post_delete, sender=Wish)
+def unindex_wish(sender, instance, **kwargs):
+    search.remove("wish", [instance.pk])
@@ -0,0 +1,138 @@
+"""
+Incrementally maintained dashboard statistics.
+
+Signal handlers adjust ``StatCounter`` rows and per-hour ``HourlyActivity``
+buckets with atomic ``F()`` updates as guests, gifts, wishes and photos are
+written, so the stats endpoint reads a handful of rows instead of
+aggregating the tables. Writes that bypass signals (queryset ``update`` and
+``bulk_create``) call the helpers here directly; ``rebuild`` recomputes
+everything from scratch after bulk imports or to repair drift.
+"""
+import datetime
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest, TruncHour
+from django.utils import timezone
+
+GUESTS = "guests.total"
+GUESTS_CONFIRMED = "guests.rsvp_confirmed"
+GIFTS = "gifts.total"
+GIFTS_RESERVED = "gifts.reserved"
+WISHES = "wishes.total"
+PHOTOS = "photos.total"
+
+
+def _models(apps):
+    return {name: apps.get_model("wedding", name) for name in
+            ("Guest", "Gift", "Wish", "GalleryItem", "StatCounter", "HourlyActivity")}
+
+
+def truncate_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def bump(key, delta=1):
+    StatCounter = django_apps.get_model("wedding", "StatCounter")
+    if not StatCounter.objects.filter(key=key).update(value=F("value") + delta):
+        _, created = StatCounter.objects.get_or_create(key=key, defaults={"value": delta})
+        if not created:
+            StatCounter.objects.filter(key=key).update(value=F("value") + delta)
+
+
+def bump_hour(kind, moment, delta=1):
+    HourlyActivity = django_apps.get_model("wedding", "HourlyActivity")
+    hour = truncate_hour(moment)
+    # Never below zero: the column is unsigned, and an hour can lose rows it never counted
+    count = Greatest(F("count") + delta, 0)
+    if not HourlyActivity.objects.filter(kind=kind, hour=hour).update(count=count):
+        _, created = HourlyActivity.objects.get_or_create(kind=kind, hour=hour, defaults={"count": max(delta, 0)})
+        if not created:
+            HourlyActivity.objects.filter(kind=kind, hour=hour).update(count=count)
+
+
+def _store(StatCounter, totals):
+    StatCounter.objects.bulk_create(
+        [StatCounter(key=key, value=value) for key, value in totals.items()],
+        update_conflicts=True,
+        unique_fields=["key"],
+        update_fields=["value"],
+    )
+
+
+def recount_guests():
+    """
+    Refresh the guest counters after a bulk import, which sends no signals.
+    """
+    Guest = django_apps.get_model("wedding", "Guest")
+    guests = Guest.objects.aggregate(total=Count("pk"), confirmed=Count("pk", filter=Q(rsvp_status=True)))
+    _store(django_apps.get_model("wedding", "StatCounter"), {
+        GUESTS: guests["total"],
+        GUESTS_CONFIRMED: guests["confirmed"],
+    })
+
+
+def record_photos(items):
+    """
+    Count photos written with ``bulk_create``.
+    """
+    if not items:
+        return
+    bump(PHOTOS, len(items))
+    per_hour = {}
+    for item in items:
+        hour = truncate_hour(item.uploaded_at)
+        per_hour[hour] = per_hour.get(hour, 0) + 1
+    for hour, count in per_hour.items():
+        bump_hour("photo", hour, count)
+
+
+@transaction.atomic
+def rebuild(apps=django_apps):
+    """
+    Recompute every counter and hourly bucket from the source tables.
+    """
+    m = _models(apps)
+    guests = m["Guest"].objects.aggregate(total=Count("pk"), confirmed=Count("pk", filter=Q(rsvp_status=True)))
+    gifts = m["Gift"].objects.aggregate(total=Count("pk"), reserved=Count("pk", filter=Q(reserved=True)))
+    totals = {
+        GUESTS: guests["total"],
+        GUESTS_CONFIRMED: guests["confirmed"],
+        GIFTS: gifts["total"],
+        GIFTS_RESERVED: gifts["reserved"],
+        WISHES: m["Wish"].objects.count(),
+        PHOTOS: m["GalleryItem"].objects.count(),
+    }
+    _store(m["StatCounter"], totals)
+
+    m["HourlyActivity"].objects.all().delete()
+    buckets = []
+    for kind, model, field in (("wish", m["Wish"], "created_at"), ("photo", m["GalleryItem"], "uploaded_at")):
+        rows = model.objects.annotate(hour=TruncHour(field)).values("hour").annotate(count=Count("pk"))
+        buckets += [m["HourlyActivity"](kind=kind, hour=row["hour"], count=row["count"]) for row in rows]
+    m["HourlyActivity"].objects.bulk_create(buckets)
+
+
+def snapshot(hours=24):
+    """
+    Dashboard payload: counter rows plus the last ``hours`` hourly buckets.
+    """
+    m = _models(django_apps)
+    counters = dict(m["StatCounter"].objects.values_list("key", "value"))
+    since = truncate_hour(timezone.now()) - datetime.timedelta(hours=hours - 1)
+    per_hour = {"wish": [], "photo": []}
+    for kind, hour, count in (
+        m["HourlyActivity"].objects.filter(hour__gte=since).order_by("hour").values_list("kind", "hour", "count")
+    ):
+        per_hour.setdefault(kind, []).append({"hour": hour, "count": count})
+
+    guests = counters.get(GUESTS, 0)
+    confirmed = counters.get(GUESTS_CONFIRMED, 0)
+    gifts = counters.get(GIFTS, 0)
+    reserved = counters.get(GIFTS_RESERVED, 0)
+    return {
+        "guests": {"total": guests, "rsvp_confirmed": confirmed, "rsvp_pending": guests - confirmed},
+        "gifts": {"total": gifts, "reserved": reserved, "unreserved": gifts - reserved},
+        "wishes": {"total": counters.get(WISHES, 0), "per_hour": per_hour["wish"]},
+        "photos": {"total": counters.get(PHOTOS, 0), "per_hour": per_hour["photo"]},
+    }
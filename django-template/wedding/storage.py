@@ -0,0 +1,200 @@
+"""
+Storage backends for gallery media.
+
+Every backend offers the same small interface, so the upload pipeline does
+not care where bytes end up:
+
+* ``put(fileobj, name, mime_type=None)`` stores a file and returns a
+  ``StoredObject`` (backend key, public URL, size);
+* ``put_many(files)`` stores several ``(fileobj, name, mime_type)`` at once and
+  returns a ``StoredObject`` or the raised exception per file, in order;
+* ``get(key)`` returns the stored bytes, ``url(key)`` the public URL and
+  ``delete(key)`` removes the object.
+
+Backends are looked up by name in ``GALLERY_STORAGE_BACKENDS``; new uploads go
+to ``GALLERY_STORAGE``. Rows record the backend name next to the key, so
+switching the default later does not strand existing objects.
+"""
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.module_loading import import_string
+from .drive_client import _file_size, get_drive_client
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class StoredObject:
+    backend: str
+    key: str
+    url: str
+    size: int
+
+
+def get_backend(name=None):
+    """
+    Backend registered under ``name`` (default: ``GALLERY_STORAGE``).
+    """
+    name = name or settings.GALLERY_STORAGE
+    try:
+        path = settings.GALLERY_STORAGE_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown gallery storage backend {name!r}") from None
+    return import_string(path)()
+
+
+def _chunks(fileobj):
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _content_key(digest, name):
+    # Fan out over two directory levels so no directory grows huge
+    extension = os.path.splitext(name)[1].lower()
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+class StorageBackend:
+    name = None
+
+    def put(self, fileobj, name, mime_type=None):
+        raise NotImplementedError
+
+    def put_many(self, files):
+        return [self._put_or_error(file) for file in files]
+
+    def _put_or_error(self, file):
+        try:
+            return self.put(*file)
+        except Exception as exc:
+            return exc
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def url(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class DriveStorage(StorageBackend):
+    """
+    Google Drive through the client named by ``GALLERY_DRIVE_CLIENT``. Keys are
+    Drive file ids.
+    """
+    name = "drive"
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_drive_client()
+
+    def put(self, fileobj, name, mime_type=None):
+        result = self.client.upload(fileobj, name, mime_type)
+        url = result.get("webViewLink") or self.url(result["id"])
+        return StoredObject(self.name, result["id"], url, _file_size(fileobj))
+
+    def put_many(self, files):
+        # Each upload waits on the network, so send them side by side
+        files = list(files)
+        if len(files) < 2:
+            return super().put_many(files)
+        with ThreadPoolExecutor(max_workers=min(len(files), settings.GALLERY_BATCH_WORKERS)) as pool:
+            return list(pool.map(self._put_or_error, files))
+
+    def get(self, key):
+        return self.client.download(key)
+
+    def url(self, key):
+        return f"https://drive.google.com/file/d/{key}/view"
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files on local disk under content-hashed paths (``ab/cd/abcd...ef.jpg``),
+    written to a temporary file while hashing and then renamed into place, so
+    identical uploads share one file. Rooted at ``GALLERY_LOCAL_STORAGE_ROOT``
+    (default ``MEDIA_ROOT/gallery/objects``) and served from ``MEDIA_URL``, by
+    the front web server (Django serves it only with ``DEBUG``).
+    """
+    name = "local"
+    prefix = "gallery/objects"
+
+    def __init__(self, location=None, base_url=None):
+        location = location or settings.GALLERY_LOCAL_STORAGE_ROOT or os.path.join(settings.MEDIA_ROOT, self.prefix)
+        base_url = base_url or f"{settings.MEDIA_URL}{self.prefix}/"
+        self.files = FileSystemStorage(location=location, base_url=base_url)
+
+    def put(self, fileobj, name, mime_type=None):
+        os.makedirs(self.files.location, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.files.location, prefix=".upload-", delete=False) as tmp:
+            try:
+                for chunk in _chunks(fileobj):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+
+        key = _content_key(digest.hexdigest(), name)
+        path = self.files.path(key)
+        if os.path.exists(path):
+            os.unlink(tmp.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp.name, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+            os.replace(tmp.name, path)
+        return StoredObject(self.name, key, self.url(key), size)
+
+    def get(self, key):
+        with self.files.open(key, "rb") as fh:
+            return fh.read()
+
+    def url(self, key):
+        return self.files.url(key)
+
+    def delete(self, key):
+        self.files.delete(key)
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Process-local dict of bytes keyed like ``LocalStorage``; for tests and
+    benchmarks. Contents are shared through ``MemoryStorage.objects``.
+    """
+    name = "memory"
+    objects = {}
+
+    def put(self, fileobj, name, mime_type=None):
+        data = b"".join(_chunks(fileobj))
+        key = _content_key(hashlib.sha256(data).hexdigest(), name)
+        self.objects[key] = {"name": name, "mime_type": mime_type, "data": data}
+        return StoredObject(self.name, key, self.url(key), len(data))
+
+    def get(self, key):
+        return self.objects[key]["data"]
+
+    def url(self, key):
+        return f"memory://{key}"
+
+    def delete(self, key):
+        self.objects.pop(key, None)
@@ -0,0 +1,140 @@
+"""
+Background tasks (``jobs.task``) for the calls to Google that used to be made
+inside requests: the OAuth token exchange, uploads to a signed-in user's
+Drive, and the calls that finish an upload (the permission grant that shares
+it by link, its metadata), which go to Drive in batches.
+
+Google answering 5xx or 429, or not answering at all, is retried with
+backoff. Any other refusal (a used authorization code, an expired token) is
+permanent.
+"""
+from collections import defaultdict
+from django.conf import settings
+from django.core.files.storage import default_storage
+from . import drive_batch, jobs
+from .drive_client import get_http_session, resumable_upload
+from .drive_utils import queue_follow_ups
+from .models import UploadedFile
+from .storage import DriveStorage
+
+RETRYABLE_STATUSES = {408, 429}
+
+
+class UpstreamError(Exception):
+    """
+    Google failed in a way that may pass; the job is retried.
+    """
+
+
+def _error(status, what, body=None):
+    """
+    The exception a job gets for Google answering ``status``, or None for success.
+    """
+    if status >= 500 or status in RETRYABLE_STATUSES:
+        return UpstreamError(f"{what} failed with {status}")
+    if status >= 400:
+        return jobs.PermanentError(f"{what} refused with {status}: {body}")
+    return None
+
+
+def _json(response, what):
+    """
+    Decoded body of a successful Google response; raise for the job otherwise.
+    """
+    try:
+        body = response.json()
+    except ValueError:
+        body = {"body": response.text[:200]}
+    error = _error(response.status_code, what, body)
+    if error:
+        raise error
+    return body
+
+
+def _batch(payloads, call, what):
+    """
+    Send ``call(payload)`` for every payload in Drive batch requests, one
+    per access token, and return each payload's outcome.
+    """
+    outcomes = [None] * len(payloads)
+    by_token = defaultdict(list)
+    for position, payload in enumerate(payloads):
+        by_token[payload["access_token"]].append(position)
+    for access_token, positions in by_token.items():
+        try:
+            replies = drive_batch.execute(access_token, [call(payloads[position]) for position in positions])
+        except drive_batch.BatchError as exc:
+            # The whole request was refused (revoked token) or failed; so is every call in it
+            error = _error(exc.status, what, str(exc)) or UpstreamError(str(exc))
+            replies = [error] * len(positions)
+        except Exception as exc:
+            replies = [exc] * len(positions)
+        for position, reply in zip(positions, replies):
+            if isinstance(reply, drive_batch.Reply):
+                reply = _error(reply.status, what, reply.body) or reply.body
+            outcomes[position] = reply
+    return outcomes
+
+
+@jobs.task("google.exchange_code", max_attempts=3, secret_fields=("code", "access_token"))
+def exchange_code(code):
+    """
+    Trade an OAuth authorization code for tokens. The access token is kept
+    in the result, where the Drive upload view looks for it.
+    """
+    response = get_http_session().post(settings.GOOGLE_OAUTH_TOKEN_URL, data={
+        "code": code,
+        "client_id": settings.GOOGLE_CLIENT_ID,
+        "client_secret": settings.GOOGLE_CLIENT_SECRET,
+        "redirect_uri": settings.GOOGLE_REDIRECT_URI,
+        "grant_type": "authorization_code",
+    }, timeout=settings.GOOGLE_HTTP_TIMEOUT)
+    tokens = _json(response, "Token exchange")
+    if "access_token" not in tokens:
+        raise jobs.PermanentError("Token exchange returned no access token")
+    return {"access_token": tokens["access_token"], "expires_in": tokens.get("expires_in")}
+
+
+def discard_spool(path, **payload):
+    default_storage.delete(path)
+
+
+# Large videos over a slow uplink: hold the lease long enough not to upload twice
+@jobs.task("drive.upload", timeout=3600, secret_fields=("access_token",), on_dead=discard_spool)
+def upload_to_drive(access_token, path, name, content_type=None, description=None):
+    """
+    Stream a spooled upload to the user's Drive, record it and queue the
+    calls that share it and set its description.
+    """
+    with default_storage.open(path, "rb") as fh:
+        response = resumable_upload(access_token, fh, name, content_type)
+    details = _json(response, "Drive upload")
+    UploadedFile.objects.get_or_create(
+        storage_backend=DriveStorage.name,
+        storage_key=details["id"],
+        defaults={"filename": name, "drive_link": DriveStorage().url(details["id"])},
+    )
+    queue_follow_ups(access_token, details["id"], description)
+    default_storage.delete(path)
+    return details
+
+
+def _batch_size():
+    return settings.DRIVE_BATCH_SIZE
+
+
+def _batch_wait():
+    return settings.DRIVE_BATCH_INTERVAL
+
+
+@jobs.task("drive.grant_permission", secret_fields=("access_token",), batch_size=_batch_size, batch_wait=_batch_wait)
+def grant_permissions(payloads):
+    return _batch(payloads, lambda payload: drive_batch.grant_public_read(payload["file_id"]), "Drive permission grant")
+
+
+@jobs.task("drive.update_metadata", secret_fields=("access_token",), batch_size=_batch_size, batch_wait=_batch_wait)
+def update_metadata(payloads):
+    return _batch(
+        payloads, lambda payload: drive_batch.update_metadata(payload["file_id"], payload["metadata"]),
+        "Drive metadata update",
+    )
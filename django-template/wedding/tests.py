@@ -1,32 +1,2260 @@
-from django.test import TestCase, Client
+import asyncio
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, Client, override_settings
 from django.utils import timezone
-from .models import LogMessage
+from google.oauth2.credentials import Credentials
+from PIL import Image
+from rest_framework.test import APIClient
+from . import (
+    checkin, drive_batch, drive_client, drive_utils, google_stub, guest_io, imaging, jobs, live, metrics,
+    search, serializers, stats, throttling, upload_queue,
+)
+from .drive_client import InMemoryDriveClient
+from .storage import DriveStorage, LocalStorage, MemoryStorage
+from .google_stub import GoogleStubServer
+from .models import Guest, Gift, Wish, GalleryItem, Job, JobStatus, LiveEvent, UploadedFile, UploadStatus
 
-class TestLogMessageModel(TestCase):
+
+class TestViews(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+
+    def test_not_found_url(self):
+        response = self.client.get('/a-url-that-does-not-exist')
+
+        self.assertEquals(response.status_code, 404)
+
+
+def make_jpeg(width, height, orientation=None, pattern=False):
+    image = Image.new("RGB", (width, height), "white")
+    if pattern:
+        # Something for a perceptual hash to see: dark blocks on a diagonal
+        for n in range(4):
+            box = (n * width // 4, n * height // 4, (n + 1) * width // 4, (n + 1) * height // 4)
+            image.paste((40 * n, 20, 90), box)
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+class TestCursorPagination(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def walk(self, url):
+        seen = []
+        pages = 0
+        while url:
+            body = self.client.get(url).json()
+            seen.extend(body["results"])
+            url = body["next"]
+            pages += 1
+        return seen, pages
+
+    def test_gift_pages_cover_every_row_once_in_title_order(self):
+        Gift.objects.bulk_create([Gift(title=title) for title in ["Toaster", "Blender", "Toaster", "Kettle", "Toaster", "Mixer", "Blender"]])
+
+        gifts, pages = self.walk('/api/gifts/?page_size=2')
+
+        self.assertEqual(pages, 4)
+        self.assertEqual(len({g["id"] for g in gifts}), 7)
+        self.assertEqual([g["title"] for g in gifts], sorted(g["title"] for g in gifts))
+
+    def test_gallery_is_paginated_newest_first(self):
+        for i in range(5):
+            GalleryItem.objects.create(title=f"photo-{i}.jpg")
+
+        body = self.client.get('/api/gallery/?page_size=3').json()
+
+        self.assertEqual([g["title"] for g in body["results"]], ["photo-4.jpg", "photo-3.jpg", "photo-2.jpg"])
+        self.assertIsNotNone(body["next"])
+
+
+class TestGiftReservation(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.gift = Gift.objects.create(title="Toaster")
+        self.guest = Guest.objects.create(name="Achieng", email="achieng@example.com")
+
+    def reserve(self, guest_id):
+        return self.client.patch(
+            f'/api/gifts/{self.gift.pk}/reserve/', {"guest_id": str(guest_id)}, content_type="application/json"
+        )
+
+    def test_reserve_is_one_update_one_counter_bump_and_one_read(self):
+        with self.assertNumQueries(3):
+            response = self.reserve(self.guest.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["reserved"])
+        # Who reserved a gift is not public
+        self.assertNotIn("reserved_by", response.json())
+        self.gift.refresh_from_db()
+        self.assertEqual(self.gift.reserved_by, self.guest)
+
+    def test_second_reservation_conflicts(self):
+        self.reserve(self.guest.pk)
+        other = Guest.objects.create(name="Otieno", email="otieno@example.com")
+
+        response = self.reserve(other.pk)
+
+        self.assertEqual(response.status_code, 409)
+        self.gift.refresh_from_db()
+        self.assertEqual(self.gift.reserved_by, self.guest)
+
+    def test_unknown_guest_leaves_gift_unreserved(self):
+        response = self.reserve(uuid.uuid4())
+
+        self.assertEqual(response.status_code, 404)
+        self.gift.refresh_from_db()
+        self.assertFalse(self.gift.reserved)
+
+    def test_unknown_gift(self):
+        response = self.client.patch(
+            f'/api/gifts/{uuid.uuid4()}/reserve/', {"guest_id": str(self.guest.pk)}, content_type="application/json"
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+
+class TestRsvpUpsert(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.gift = Gift.objects.create(title="Toaster")
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type="application/json")
+
+    def test_repeat_rsvp_returns_existing_guest(self):
+        first = self.post('/api/guests/rsvp/', {"name": "Achieng", "email": "achieng@example.com", "phone": "0711"})
+        again = self.post('/api/guests/rsvp/', {"name": "Achieng O.", "email": "achieng@example.com", "rsvp_status": True})
+
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+        self.assertEqual(again.json()["id"], first.json()["id"])
+        guest = Guest.objects.get()
+        self.assertEqual((guest.name, guest.phone, guest.rsvp_status), ("Achieng O.", "0711", True))
+
+    def test_form_rsvp_without_status_keeps_it(self):
+        self.post('/api/guests/rsvp/', {"name": "Achieng", "email": "achieng@example.com", "rsvp_status": True})
+        response = self.client.post('/api/guests/rsvp/', {"name": "Achieng O.", "email": "achieng@example.com"})
+
+        self.assertEqual(response.status_code, 200)
+        guest = Guest.objects.get()
+        self.assertEqual((guest.name, guest.rsvp_status), ("Achieng O.", True))
+
+    def test_rsvp_rejects_bad_email(self):
+        response = self.post('/api/guests/rsvp/', {"name": "Achieng", "email": "nope"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Guest.objects.exists())
+
+    def test_rsvp_and_reserve_in_one_request(self):
+        response = self.post(f'/api/gifts/{self.gift.pk}/rsvp-and-reserve/', {"name": "Achieng", "email": "achieng@example.com"})
+
+        self.assertEqual(response.status_code, 200)
+        guest = Guest.objects.get()
+        self.assertTrue(response.json()["reserved"])
+        self.gift.refresh_from_db()
+        self.assertEqual(self.gift.reserved_by, guest)
+
+        # A retry by the same guest is not a conflict
+        retry = self.post(f'/api/gifts/{self.gift.pk}/rsvp-and-reserve/', {"name": "Achieng", "email": "achieng@example.com"})
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(Guest.objects.count(), 1)
+
+    def test_rsvp_and_reserve_taken_gift_keeps_the_rsvp(self):
+        self.post(f'/api/gifts/{self.gift.pk}/rsvp-and-reserve/', {"name": "Achieng", "email": "achieng@example.com"})
+
+        response = self.post(f'/api/gifts/{self.gift.pk}/rsvp-and-reserve/', {"name": "Otieno", "email": "otieno@example.com"})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(Guest.objects.filter(email="otieno@example.com").exists())
+
+
+class TestGiftReservationConcurrency(TransactionTestCase):
+
+    def test_exactly_one_of_many_concurrent_reservations_wins(self):
+        gift = Gift.objects.create(title="Sofa")
+        guests = Guest.objects.bulk_create([Guest(name=f"Guest {n}", email=f"rush{n}@example.com") for n in range(16)])
+        start = threading.Barrier(len(guests))
+
+        def reserve(guest):
+            start.wait()
+            try:
+                return Client().patch(
+                    f'/api/gifts/{gift.pk}/reserve/', {"guest_id": str(guest.pk)}, content_type="application/json"
+                ).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(guests)) as pool:
+            codes = list(pool.map(reserve, guests))
+
+        self.assertEqual(codes.count(200), 1, codes)
+        self.assertEqual(codes.count(409), len(guests) - 1)
+        gift.refresh_from_db()
+        winner = guests[codes.index(200)]
+        self.assertEqual(gift.reserved_by_id, winner.pk)
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.gift = Gift.objects.create(title="Kettle")
+
+    def test_repeated_list_is_served_from_cache(self):
+        first = self.client.get('/api/gifts/')
+
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/gifts/')
+
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_unchanged_list_returns_304(self):
+        etag = self.client.get('/api/gallery/')["ETag"]
+
+        response = self.client.get('/api/gallery/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_save_and_delete_invalidate(self):
+        etag = self.client.get(f'/api/gifts/{self.gift.pk}/')["ETag"]
+
+        self.gift.title = "Electric kettle"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gift.save()
+        response = self.client.get(f'/api/gifts/{self.gift.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], "Electric kettle")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gift.delete()
+        self.assertEqual(self.client.get('/api/gifts/').json()["results"], [])
+
+    def test_tokens_change_when_the_write_commits(self):
+        self.client.get('/api/gifts/')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.gift.title = "Electric kettle"
+            self.gift.save()
+            # Until the commit the old token, and the list cached under it, still stand
+            [gift] = self.client.get('/api/gifts/').json()["results"]
+            self.assertEqual(gift["title"], "Kettle")
+        for callback in callbacks:
+            callback()
+
+        [gift] = self.client.get('/api/gifts/').json()["results"]
+        self.assertEqual(gift["title"], "Electric kettle")
+
+    def test_reserve_invalidates_gift_list(self):
+        guest = Guest.objects.create(name="Wanjiru", email="wanjiru@example.com")
+        self.client.get('/api/gifts/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/gifts/{self.gift.pk}/reserve/', {"guest_id": str(guest.pk)}, content_type="application/json")
+
+        [gift] = self.client.get('/api/gifts/').json()["results"]
+        self.assertTrue(gift["reserved"])
+
+    def test_not_found_is_not_cached(self):
+        missing = f'/api/gifts/{uuid.uuid4()}/'
+        self.assertEqual(self.client.get(missing).status_code, 404)
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+
+class TestGuestImportExport(TestCase):
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+        Guest.objects.create(name="Old Name", email="known@example.com", phone="0700000000")
+
+    def test_import_upserts_on_email_and_reports_bad_rows(self):
+        rows = [
+            {"name": "New Guest", "email": "new@example.com"},
+            {"name": "Known Guest", "email": "known@example.com", "rsvp_status": "true"},
+            {"name": "No Email"},
+            {"name": "Bad", "email": "not-an-email"},
+        ]
+
+        # Existence check, one upsert per column set and search index, then one aggregate and one upsert for the counters
+        with self.assertNumQueries(6):
+            result = guest_io.import_guests(rows, batch_size=100)
+
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual([e["row"] for e in result.errors], [3, 4])
+        self.assertIn("email", result.errors[0]["errors"])
+        known = Guest.objects.get(email="known@example.com")
+        self.assertEqual((known.name, known.rsvp_status, known.phone), ("Known Guest", True, "0700000000"))
+
+    def test_import_keeps_columns_a_row_leaves_out(self):
+        Guest.objects.filter(email="known@example.com").update(rsvp_status=True)
+        rows = [
+            {"name": "Known Guest", "email": "known@example.com"},
+            {"name": "New Guest", "email": "new@example.com", "phone": "0711", "rsvp_status": "true"},
+        ]
+
+        result = guest_io.import_guests(rows, batch_size=100)
+
+        self.assertEqual((result.created, result.updated), (1, 1))
+        known = Guest.objects.get(email="known@example.com")
+        self.assertEqual((known.name, known.phone, known.rsvp_status), ("Known Guest", "0700000000", True))
+        new = Guest.objects.get(email="new@example.com")
+        self.assertEqual((new.phone, new.rsvp_status), ("0711", True))
+
+    def test_import_batches_and_dedupes_repeated_emails(self):
+        rows = [{"name": f"Guest {n}", "email": f"g{n % 7}@example.com"} for n in range(20)]
+
+        result = guest_io.import_guests(rows, batch_size=3)
+
+        self.assertEqual(result.created, 7)
+        self.assertEqual(Guest.objects.filter(email__startswith="g").count(), 7)
+        self.assertEqual(Guest.objects.get(email="g6@example.com").name, "Guest 13")
+
+    def test_import_endpoint_accepts_csv_upload(self):
+        csv_file = SimpleUploadedFile("guests.csv", b"name,email,phone\nAmina,amina@example.com,0711\n,broken@example.com,\n")
+
+        response = self.api.post('/api/guests/import/', {"file": csv_file}, format="multipart")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 1)
+        self.assertEqual(response.json()["errors"][0]["row"], 2)
+
+    def test_export_streams_csv_and_ndjson(self):
+        response = self.api.get('/api/guests/export/')
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,name,email,phone,rsvp_status,created_at")
+        self.assertIn("known@example.com", lines[1])
+
+        response = self.api.get('/api/guests/export/?output=ndjson')
+        [record] = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(record["email"], "known@example.com")
+
+    def test_import_and_export_are_admin_only(self):
+        self.assertIn(Client().get('/api/guests/export/').status_code, (401, 403))
+
+    def test_commands_round_trip(self):
+        out = io.StringIO()
+        call_command("export_guests", format="ndjson", stdout=out)
+        Guest.objects.all().delete()
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as fh:
+            fh.write(out.getvalue())
+        self.addCleanup(os.remove, fh.name)
+
+        call_command("import_guests", fh.name, stdout=io.StringIO())
+
+        self.assertEqual(Guest.objects.get().email, "known@example.com")
+
+
+class TestDashboardStats(TestCase):
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+
+    def snapshot(self):
+        response = self.api.get('/api/stats/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counters_follow_writes(self):
+        guest = Guest.objects.create(name="Achieng", email="achieng@example.com")
+        Guest.objects.create(name="Otieno", email="otieno@example.com", rsvp_status=True)
+        gift = Gift.objects.create(title="Toaster")
+        Gift.objects.create(title="Kettle")
+        Wish.objects.create(guest=guest, message="Congratulations")
+        GalleryItem.objects.create(title="First dance")
+
+        guest.rsvp_status = True
+        guest.save()
+        self.client.patch(f'/api/gifts/{gift.pk}/reserve/', {"guest_id": str(guest.pk)}, content_type="application/json")
+        Gift.objects.get(title="Kettle").delete()
+
+        data = self.snapshot()
+        self.assertEqual(data["guests"], {"total": 2, "rsvp_confirmed": 2, "rsvp_pending": 0})
+        self.assertEqual(data["gifts"], {"total": 1, "reserved": 1, "unreserved": 0})
+        self.assertEqual(data["wishes"]["total"], 1)
+        self.assertEqual(sum(bucket["count"] for bucket in data["wishes"]["per_hour"]), 1)
+        self.assertEqual(data["photos"]["total"], 1)
+
+        guest.delete()
+        data = self.snapshot()
+        self.assertEqual(data["guests"]["total"], 1)
+        self.assertEqual(data["wishes"]["total"], 0)
+
+    def test_bulk_writes_are_counted(self):
+        guest_io.import_guests([{"name": "A", "email": "a@example.com", "rsvp_status": "true"}, {"name": "B", "email": "b@example.com"}])
+        with self.captureOnCommitCallbacks(execute=False):
+            upload_queue.store_batch([SimpleUploadedFile(f"p{i}.jpg", f"jpeg {i}".encode()) for i in range(3)])
+
+        data = self.snapshot()
+        self.assertEqual((data["guests"]["total"], data["guests"]["rsvp_confirmed"]), (2, 1))
+        self.assertEqual(data["photos"]["total"], 3)
+        self.assertEqual(data["photos"]["per_hour"][-1]["count"], 3)
+
+    def test_hourly_counts_never_go_negative(self):
+        photo = GalleryItem.objects.create(title="First dance")
+        stats.bump_hour("photo", photo.uploaded_at, -1)
+
+        photo.delete()
+
+        self.assertEqual(self.snapshot()["photos"]["per_hour"][-1]["count"], 0)
+
+    def test_read_cost_does_not_grow_with_rows(self):
+        with self.assertNumQueries(2):
+            self.api.get('/api/stats/')
+        guest = Guest.objects.create(name="Achieng", email="achieng@example.com")
+        Wish.objects.bulk_create([Wish(guest=guest, message=str(n)) for n in range(50)])
+        with self.assertNumQueries(2):
+            self.api.get('/api/stats/')
+
+    def test_rebuild_matches_incremental_counters(self):
+        guest = Guest.objects.create(name="Achieng", email="achieng@example.com", rsvp_status=True)
+        Wish.objects.create(guest=guest, message="Hongera")
+        Gift.objects.create(title="Toaster", reserved=True, reserved_by=guest)
+        before = self.snapshot()
+
+        call_command("rebuild_stats", stdout=io.StringIO())
+
+        self.assertEqual(self.snapshot(), before)
+
+    def test_requires_admin(self):
+        self.assertIn(APIClient().get('/api/stats/').status_code, (401, 403))
+
+
+class TestListQueryCounts(TestCase):
+    """
+    Each list endpoint must run the same number of queries whatever the row
+    count, so a nested serializer that starts querying per row fails here.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+        self.seeded = 0
+
+    def seed(self, count):
+        # Committed, so cached lists are invalidated
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(count):
+                n = self.seeded = self.seeded + 1
+                guest = Guest.objects.create(name=f"Guest {n}", email=f"guest{n}@example.com")
+                Gift.objects.create(title=f"Gift {n}", reserved=True, reserved_by=guest)
+                Wish.objects.create(guest=guest, message="Congratulations!")
+                GalleryItem.objects.create(guest=guest, title=f"photo-{n}.jpg")
+
+    def count_queries(self, client, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertQueryCountIndependentOfRows(self, url, client=None):
+        client = client or self.api
+        self.seed(2)
+        few = self.count_queries(client, url)
+        self.seed(20)
+        many = self.count_queries(client, url)
+        self.assertEqual(few, many, f"{url} ran {few} queries for 2 rows but {many} for 22")
+
+    def test_guest_list(self):
+        self.assertQueryCountIndependentOfRows('/api/guests/')
+
+    def test_gift_list(self):
+        self.assertQueryCountIndependentOfRows('/api/gifts/')
+
+    def test_wish_list(self):
+        self.assertQueryCountIndependentOfRows('/api/wishes/')
+
+    def test_gallery_list(self):
+        self.assertQueryCountIndependentOfRows('/api/gallery/')
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_admin_changelists(self):
+        client = Client()
+        client.force_login(self.admin)
+        for model in ("guest", "gift", "wish", "galleryitem"):
+            with self.subTest(model=model):
+                self.assertQueryCountIndependentOfRows(f'/admin/wedding/{model}/', client=client)
+
+    def test_public_expanded_lists(self):
+        self.assertQueryCountIndependentOfRows('/api/gallery/?expand=guest', client=Client())
+
+
+class TestSparseFieldsets(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.guest = Guest.objects.create(name="Achieng", email="achieng@example.com", phone="0711")
+        self.gift = Gift.objects.create(title="Toaster", link="https://example.com", reserved=True, reserved_by=self.guest)
+        self.photo = GalleryItem.objects.create(guest=self.guest, title="cake.jpg", caption="Cake")
+        self.staff = APIClient()
+        self.staff.force_authenticate(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+
+    def get(self, url, client=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = (client or self.client).get(url)
+        self.sql = " ".join(query["sql"] for query in ctx.captured_queries)
+        return response
+
+    def test_parse_fieldset(self):
+        self.assertEqual(
+            serializers.parse_fieldset(" id, guest.name ,guest.email,,"),
+            {"id": {}, "guest": {"name": {}, "email": {}}},
+        )
+        self.assertIsNone(serializers.parse_fieldset(""))
+        self.assertIsNone(serializers.parse_fieldset(None))
+
+    def test_public_gift_list_leaves_out_who_reserved(self):
+        [gift] = self.get('/api/gifts/').json()["results"]
+
+        self.assertEqual(set(gift), {"id", "title", "image", "link", "reserved", "created_at"})
+        self.assertNotIn("wedding_guest", self.sql)
+        for url in ('/api/gifts/?expand=reserved_by', '/api/gifts/?fields=id,reserved_by.name'):
+            self.assertEqual(self.get(url).status_code, 400)
+
+    def test_fields_trim_the_columns_and_the_output(self):
+        response = self.get('/api/gifts/?fields=id,title')
+
+        self.assertEqual(response.json()["results"], [{"id": str(self.gift.pk), "title": "Toaster"}])
+        self.assertNotIn('"wedding_gift"."link"', self.sql)
+        self.assertNotIn('"wedding_gift"."image"', self.sql)
+        # Retrieve, too
+        self.assertEqual(self.get(f'/api/gifts/{self.gift.pk}/?fields=link').json(), {"link": "https://example.com"})
+
+    def test_unknown_field_is_an_error(self):
+        response = self.get('/api/gallery/?fields=id,nope')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("nope", str(response.json()))
+
+    def test_staff_get_the_full_shape_by_default(self):
+        Wish.objects.create(guest=self.guest, message="Hongera")
+
+        [gift] = self.get('/api/gifts/', client=self.staff).json()["results"]
+        [wish] = self.get('/api/wishes/', client=self.staff).json()["results"]
+
+        self.assertEqual(gift["reserved_by"]["email"], "achieng@example.com")
+        self.assertEqual(wish["guest"]["phone"], "0711")
+
+    def test_staff_select_nested_fields(self):
+        response = self.get('/api/gifts/?fields=title,reserved_by.email', client=self.staff)
+
+        self.assertEqual(response.json()["results"], [{"title": "Toaster", "reserved_by": {"email": "achieng@example.com"}}])
+        self.assertIn("wedding_guest", self.sql)
+        self.assertNotIn('"wedding_guest"."phone"', self.sql)
+
+    def test_public_expansion_shows_no_contact_details(self):
+        [photo] = self.get('/api/gallery/?expand=guest').json()["results"]
+
+        self.assertEqual(photo["guest"], {"id": str(self.guest.pk), "name": "Achieng", "rsvp_status": False})
+        self.assertEqual(self.get('/api/gallery/?fields=caption,guest.name').json()["results"],
+                         [{"caption": "Cake", "guest": {"name": "Achieng"}}])
+        self.assertEqual(self.get('/api/gallery/?fields=guest.email').status_code, 400)
+        [photo] = self.get('/api/gallery/').json()["results"]
+        self.assertNotIn("guest", photo)
+        self.assertNotIn("wedding_guest", self.sql)
+
+    def test_public_writes_answer_with_lean_objects(self):
+        rsvp = self.client.post(
+            '/api/guests/rsvp/', {"name": "Achieng", "email": "achieng@example.com"}, content_type="application/json",
+        )
+        wish = self.client.post(
+            '/api/wishes/', {"guest_id": str(self.guest.pk), "message": "Hongera"}, content_type="application/json",
+        )
+
+        # Knowing an email must not reveal the phone number on file
+        self.assertEqual(set(rsvp.json()), {"id", "name", "rsvp_status"})
+        self.assertEqual(set(wish.json()), {"id", "message", "created_at"})
+
+    def test_public_create_saves_every_field(self):
+        for n in range(2):
+            response = self.client.post(
+                '/api/guests/', {"name": f"Otieno {n}", "email": f"otieno{n}@example.com", "phone": f"072{n}"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(set(response.json()), {"id", "name", "rsvp_status"})
+
+        guest = Guest.objects.get(name="Otieno 1")
+        self.assertEqual((guest.email, guest.phone), ("otieno1@example.com", "0721"))
+
+    def test_fields_do_not_trim_what_is_written(self):
+        response = self.client.post(
+            '/api/wishes/?fields=id', {"guest_id": str(self.guest.pk), "message": "Hongera"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(set(response.json()), {"id"})
+        self.assertEqual(Wish.objects.get().message, "Hongera")
+
+    def test_staff_and_public_responses_are_cached_apart(self):
+        self.get('/api/gifts/', client=self.staff)
+
+        [gift] = self.get('/api/gifts/').json()["results"]
+
+        self.assertNotIn("reserved_by", gift)
+
+
+class TestIndexUsage(TestCase):
+    """
+    EXPLAIN the hot list queries on seeded data and check they hit an index
+    instead of sorting the whole table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        guests = Guest.objects.bulk_create([Guest(name=f"Guest {n}", email=f"g{n}@example.com") for n in range(200)])
+        Gift.objects.bulk_create([Gift(title=f"Gift {n:03}", reserved=n % 20 == 0) for n in range(300)])
+        Wish.objects.bulk_create([Wish(guest=guests[n % 200], message="Hongera!") for n in range(400)])
+        GalleryItem.objects.bulk_create([
+            GalleryItem(guest=guests[n % 200], title=f"{n}.jpg", status=UploadStatus.PENDING if n % 50 == 0 else UploadStatus.DONE)
+            for n in range(400)
+        ])
+
+    def explain(self, queryset):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                # Seeded tables are tiny; make the planner show what it would do at scale
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.explain(queryset)
+        self.assertIn(index_name, plan)
+        self.assertNotIn("TEMP B-TREE FOR ORDER BY", plan)
+
+    def test_unreserved_gifts_use_partial_index(self):
+        self.assertUsesIndex(Gift.objects.filter(reserved=False).order_by("title"), "gift_unreserved_title_idx")
+
+    def test_reserved_gifts_use_partial_index(self):
+        self.assertUsesIndex(Gift.objects.filter(reserved=True).order_by("title"), "gift_reserved_title_idx")
+
+    def test_gift_list_ordering_uses_index(self):
+        self.assertUsesIndex(Gift.objects.order_by("title", "id")[:50], "gift_title_idx")
+
+    def test_newest_first_lists_use_index(self):
+        self.assertUsesIndex(Guest.objects.order_by("-created_at", "-id")[:50], "guest_created_idx")
+        self.assertUsesIndex(Wish.objects.order_by("-created_at", "-id")[:50], "wish_created_idx")
+        self.assertUsesIndex(GalleryItem.objects.order_by("-uploaded_at", "-id")[:50], "gallery_uploaded_idx")
+
+    def test_per_guest_wishes_use_composite_index(self):
+        guest = Guest.objects.first()
+        self.assertUsesIndex(Wish.objects.filter(guest=guest).order_by("-created_at"), "wish_guest_created_idx")
+
+    def test_upload_queue_scan_uses_partial_index(self):
+        queryset = GalleryItem.objects.filter(status=UploadStatus.PENDING).order_by("uploaded_at")
+        self.assertUsesIndex(queryset, "gallery_upload_queue_idx")
+
+
+class FailingDriveClient:
+
+    def upload(self, fileobj, name, mime_type=None):
+        raise ConnectionError("Drive unavailable")
+
+
+class PickyDriveClient(InMemoryDriveClient):
+
+    def upload(self, fileobj, name, mime_type=None):
+        if name.startswith("broken"):
+            raise ConnectionError("Drive rejected the file")
+        return super().upload(fileobj, name, mime_type)
+
+
+class TestGalleryUploadPipeline(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            GALLERY_DRIVE_CLIENT="wedding.drive_client.InMemoryDriveClient",
+        )
+        self.settings_override.enable()
+        InMemoryDriveClient.files.clear()
+        self.client = Client()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self, name="photo.jpg", content=b"jpeg-bytes"):
+        return self.client.post('/api/gallery/upload/', {"file": SimpleUploadedFile(name, content)})
+
+    def test_upload_returns_pending_item(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.upload()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], UploadStatus.PENDING)
+        item = GalleryItem.objects.get()
+        self.assertIsNone(item.image)
+        self.assertTrue(item.file.name.startswith("gallery/spool/"))
+
+    @override_settings(GALLERY_UPLOAD_EAGER=True)
+    def test_worker_pushes_file_and_fills_in_link(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(content=b"wedding")
+
+        item = GalleryItem.objects.get()
+        self.assertEqual(item.status, UploadStatus.DONE)
+        self.assertTrue(item.image.startswith("https://drive.google.com/file/d/"))
+        self.assertFalse(item.file)
+        [stored] = InMemoryDriveClient.files.values()
+        self.assertEqual(stored["data"], b"wedding")
+        self.assertEqual(stored["mime_type"], "image/jpeg")
+
+    def test_same_name_uploads_do_not_overwrite_each_other(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.upload(content=b"first")
+            self.upload(content=b"second")
+
+        names = set(GalleryItem.objects.values_list("file", flat=True))
+        self.assertEqual(len(names), 2)
+
+    @override_settings(GALLERY_UPLOAD_EAGER=True)
+    def test_worker_stores_resized_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(name="portrait.jpg", content=make_jpeg(3000, 1500, orientation=6))
+
+        item = GalleryItem.objects.get()
+        self.assertEqual(set(item.variants), {"thumbnail", "medium", "full"})
+        thumbnail = item.variants["thumbnail"]
+        # Orientation 6 means the camera was rotated, so the stored image is upright
+        self.assertEqual((thumbnail["width"], thumbnail["height"]), (160, 320))
+        self.assertEqual(item.variants["full"]["height"], 2048)
+        self.assertEqual(len(InMemoryDriveClient.files), 4)
+        response = self.client.get(f'/api/gallery/{item.pk}/')
+        self.assertEqual(response.json()["variants"]["thumbnail"]["url"], thumbnail["url"])
+
+    @override_settings(GALLERY_UPLOAD_MODE="stream")
+    def test_stream_mode_uploads_inline_without_spooling(self):
+        response = self.upload(content=b"streamed")
+
+        self.assertEqual(response.status_code, 201)
+        item = GalleryItem.objects.get()
+        self.assertEqual(item.status, UploadStatus.DONE)
+        self.assertFalse(item.file)
+        [stored] = InMemoryDriveClient.files.values()
+        self.assertEqual(stored["data"], b"streamed")
+
+    @override_settings(GALLERY_UPLOAD_MODE="stream", GALLERY_DRIVE_CLIENT="wedding.tests.FailingDriveClient")
+    def test_stream_mode_storage_failure_is_a_bad_gateway(self):
+        with self.assertLogs("wedding.views", "WARNING"):
+            response = self.upload(content=b"streamed")
+
+        self.assertEqual((response.status_code, response.json()), (502, {"error": "Drive unavailable"}))
+        self.assertFalse(GalleryItem.objects.exists())
+
+    @override_settings(GALLERY_UPLOAD_MODE="stream", GALLERY_DRIVE_CLIENT="wedding.tests.FailingDriveClient")
+    def test_stream_mode_failed_retry_of_a_failed_item_is_a_bad_gateway(self):
+        item = GalleryItem.objects.create(
+            title="photo.jpg", sha256=hashlib.sha256(b"streamed").hexdigest(), status=UploadStatus.FAILED,
+        )
+
+        with self.assertLogs("wedding.views", "WARNING"):
+            response = self.upload(content=b"streamed")
+
+        self.assertEqual(response.status_code, 502)
+        item.refresh_from_db()
+        self.assertEqual(item.status, UploadStatus.FAILED)
+
+    def upload_batch(self, names):
+        files = [SimpleUploadedFile(name, name.encode()) for name in names]
+        return self.client.post('/api/gallery/upload-batch/', {"files": files})
+
+    def test_batch_upload_spools_all_files_with_one_insert(self):
+        files = [SimpleUploadedFile(f"photo-{i}.jpg", f"jpeg {i}".encode()) for i in range(5)]
+        with self.captureOnCommitCallbacks(execute=False):
+            with CaptureQueriesContext(connection) as ctx:
+                outcomes = upload_queue.store_batch(files)
+
+        # One lookup of the batch's digests, then one insert
+        gallery_queries = [q["sql"] for q in ctx.captured_queries if "wedding_galleryitem" in q["sql"]]
+        self.assertEqual(len(gallery_queries), 2)
+        self.assertTrue(gallery_queries[0].startswith("SELECT"))
+        self.assertTrue(gallery_queries[1].startswith("INSERT"))
+
+        self.assertEqual([f.name for f, _, _, _ in outcomes], [f.name for f in files])
+        self.assertEqual(GalleryItem.objects.filter(status=UploadStatus.PENDING).count(), 5)
+
+    def test_batch_upload_endpoint_returns_per_file_results(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.upload_batch(["a.jpg", "b.jpg"])
+
+        self.assertEqual(response.status_code, 202)
+        results = response.json()["results"]
+        self.assertEqual([r["file"] for r in results], ["a.jpg", "b.jpg"])
+        self.assertTrue(all(r["item"]["status"] == UploadStatus.PENDING for r in results))
+
+    @override_settings(GALLERY_UPLOAD_MODE="stream", GALLERY_DRIVE_CLIENT="wedding.tests.PickyDriveClient")
+    def test_batch_stream_mode_reports_failures_per_file(self):
+        response = self.upload_batch(["a.jpg", "broken.jpg", "c.jpg"])
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertEqual(results[1], {"file": "broken.jpg", "error": "Drive rejected the file"})
+        self.assertEqual(results[0]["item"]["status"], UploadStatus.DONE)
+        self.assertEqual(GalleryItem.objects.count(), 2)
+
+    def test_batch_upload_rejects_too_many_files(self):
+        with override_settings(GALLERY_BATCH_MAX_FILES=2):
+            response = self.upload_batch(["a.jpg", "b.jpg", "c.jpg"])
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_upload_is_retried_by_process_pending(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.upload()
+        item = GalleryItem.objects.get()
+
+        upload_queue.process_item(item.pk, backend=DriveStorage(FailingDriveClient()))
+        item.refresh_from_db()
+        self.assertEqual(item.status, UploadStatus.FAILED)
+        self.assertIn("Drive unavailable", item.error)
+
+        processed = upload_queue.process_pending(backend=DriveStorage(InMemoryDriveClient()), retry_failed=True)
+        self.assertEqual([i.pk for i in processed], [item.pk])
+        item.refresh_from_db()
+        self.assertEqual(item.status, UploadStatus.DONE)
+        self.assertEqual(item.attempts, 2)
+
+    def test_reupload_of_a_failed_item_replaces_its_spool(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.upload()
+        item = GalleryItem.objects.get()
+        upload_queue.process_item(item.pk, backend=DriveStorage(FailingDriveClient()))
+        spool = os.path.join(self.media_root, "gallery", "spool")
+
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.upload()
+
+        self.assertEqual(response.status_code, 202)
+        item.refresh_from_db()
+        self.assertEqual(item.status, UploadStatus.PENDING)
+        self.assertEqual(os.listdir(spool), [os.path.basename(item.file.name)])
+
+    @override_settings(GALLERY_UPLOAD_CLAIM_TIMEOUT=60, GALLERY_UPLOAD_MAX_ATTEMPTS=3)
+    def test_uploads_abandoned_mid_transfer_are_requeued(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            for name in ("crashed.jpg", "busy.jpg", "exhausted.jpg"):
+                self.upload(name=name, content=name.encode())
+        stale = timezone.now() - datetime.timedelta(seconds=61)
+        GalleryItem.objects.filter(title="crashed.jpg").update(status=UploadStatus.UPLOADING, attempts=1, claimed_at=stale)
+        GalleryItem.objects.filter(title="busy.jpg").update(status=UploadStatus.UPLOADING, attempts=1, claimed_at=timezone.now())
+        GalleryItem.objects.filter(title="exhausted.jpg").update(
+            status=UploadStatus.UPLOADING, attempts=3, claimed_at=stale,
+        )
+
+        processed = upload_queue.process_pending(backend=DriveStorage(InMemoryDriveClient()))
+
+        self.assertEqual([item.title for item in processed], ["crashed.jpg"])
+        self.assertEqual(
+            dict(GalleryItem.objects.values_list("title", "status")),
+            {"crashed.jpg": UploadStatus.DONE, "busy.jpg": UploadStatus.UPLOADING, "exhausted.jpg": UploadStatus.FAILED},
+        )
+
+    def test_claimed_item_is_not_processed_twice(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.upload()
+        item = GalleryItem.objects.get()
+
+        self.assertIsNotNone(upload_queue.process_item(item.pk, backend=DriveStorage(InMemoryDriveClient())))
+        self.assertIsNone(upload_queue.process_item(item.pk, backend=DriveStorage(InMemoryDriveClient())))
+        self.assertEqual(len(InMemoryDriveClient.files), 1)
+
+    def test_duplicate_upload_returns_existing_item_without_storing_bytes(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            first = self.upload(name="IMG_1.jpg", content=b"same photo")
+            again = self.upload(name="IMG_1 (1).jpg", content=b"same photo")
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()["id"], first.json()["id"])
+        self.assertEqual(GalleryItem.objects.count(), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, "gallery", "spool"))), 1)
+
+    def test_hash_is_computed_while_the_upload_streams_in(self):
+        content = os.urandom(200 * 1024)
+        # Large enough to go through the temporary-file handler
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=64 * 1024):
+            with self.captureOnCommitCallbacks(execute=False):
+                self.upload(content=content)
+
+        self.assertEqual(GalleryItem.objects.get().sha256, hashlib.sha256(content).hexdigest())
+
+    def test_batch_skips_known_and_repeated_content(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.upload(name="old.jpg", content=b"old.jpg")
+            response = self.upload_batch(["old.jpg", "new.jpg", "new.jpg"])
+
+        results = response.json()["results"]
+        self.assertEqual([r.get("duplicate", False) for r in results], [True, False, True])
+        self.assertEqual(results[1]["item"]["id"], results[2]["item"]["id"])
+        self.assertEqual(GalleryItem.objects.count(), 2)
+        self.assertEqual(stats.snapshot()["photos"]["total"], 2)
+
+    def test_failed_duplicate_is_uploaded_again(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.upload()
+        item = GalleryItem.objects.get()
+        upload_queue.process_item(item.pk, backend=DriveStorage(FailingDriveClient()))
+
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.upload()
+
+        self.assertEqual(response.status_code, 202)
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.error), (UploadStatus.PENDING, ""))
+        self.assertEqual(GalleryItem.objects.count(), 1)
+
+    def test_check_hashes_lists_known_content(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            item_id = self.upload(content=b"known").json()["id"]
+        known = hashlib.sha256(b"known").hexdigest()
+        unknown = hashlib.sha256(b"unknown").hexdigest()
+
+        response = self.client.post(
+            '/api/gallery/check-hashes/', {"sha256": [known, unknown]}, content_type="application/json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()["known"]), [known])
+        self.assertEqual(response.json()["known"][known]["id"], item_id)
+        bad = self.client.post('/api/gallery/check-hashes/', {"sha256": "nope"}, content_type="application/json")
+        self.assertEqual(bad.status_code, 400)
+
+    @override_settings(GALLERY_UPLOAD_MODE="stream")
+    def test_similar_finds_resized_copies(self):
+        original = make_jpeg(800, 600, pattern=True)
+        copy = io.BytesIO()
+        Image.open(io.BytesIO(original)).resize((400, 300)).save(copy, "JPEG", quality=60)
+        for name, content in [("a.jpg", original), ("b.jpg", copy.getvalue()), ("c.jpg", make_jpeg(800, 600))]:
+            self.upload(name=name, content=content)
+        first = GalleryItem.objects.get(title="a.jpg")
+
+        response = self.client.get(f'/api/gallery/{first.pk}/similar/')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+        response = self.client.get(f'/api/gallery/{first.pk}/similar/')
+        self.assertEqual([r["item"]["title"] for r in response.json()["results"]], ["b.jpg"])
+
+
+class TestStorageBackends(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, GALLERY_STORAGE="local")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        MemoryStorage.objects.clear()
+
+    def test_local_paths_are_content_hashed_and_shared(self):
+        backend = LocalStorage()
+
+        first = backend.put(io.BytesIO(b"same bytes"), "IMG_1.JPG")
+        second = backend.put(io.BytesIO(b"same bytes"), "IMG_1 (copy).jpg")
+
+        self.assertEqual(first.key, second.key)
+        self.assertRegex(first.key, r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+        self.assertEqual(first.url, f"/media/gallery/objects/{first.key}")
+        self.assertEqual(backend.get(first.key), b"same bytes")
+        # Only the stored object is left behind, no temporary files
+        root = os.path.join(self.media_root, "gallery", "objects")
+        self.assertEqual([name for name in os.listdir(root) if name.startswith(".")], [])
+
+        backend.delete(first.key)
+        self.assertFalse(os.path.exists(os.path.join(root, first.key)))
+
+    def test_put_many_reports_each_file(self):
+        class Unreadable(io.BytesIO):
+            def read(self, *args):
+                raise OSError("disk full")
+
+        results = MemoryStorage().put_many([
+            (io.BytesIO(b"a"), "a.jpg", "image/jpeg"),
+            (Unreadable(), "b.jpg", "image/jpeg"),
+        ])
+
+        self.assertEqual(MemoryStorage().get(results[0].key), b"a")
+        self.assertIsInstance(results[1], OSError)
+
+    @override_settings(GALLERY_UPLOAD_MODE="stream")
+    def test_gallery_upload_records_the_backend(self):
+        response = Client().post(
+            '/api/gallery/upload/', {"file": SimpleUploadedFile("kiosk.jpg", make_jpeg(400, 300))}
+        )
+
+        self.assertEqual(response.status_code, 201)
+        item = GalleryItem.objects.get()
+        self.assertEqual(item.storage_backend, "local")
+        self.assertEqual(LocalStorage().get(item.storage_key)[:2], b"\xff\xd8")
+        self.assertTrue(item.image.startswith("/media/gallery/objects/"))
+        self.assertEqual(set(item.variants), {"thumbnail", "medium", "full"})
+
+    @override_settings(GALLERY_UPLOAD_EAGER=True)
+    def test_queued_item_uses_the_backend_it_was_created_with(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            Client().post('/api/gallery/upload/', {"file": SimpleUploadedFile("a.txt", b"queued")})
+        item = GalleryItem.objects.get()
+
+        with override_settings(GALLERY_STORAGE="memory"):
+            upload_queue.process_item(item.pk)
+
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.storage_backend), (UploadStatus.DONE, "local"))
+        self.assertEqual(MemoryStorage.objects, {})
+        self.assertEqual(LocalStorage().get(item.storage_key), b"queued")
+
+
+class TestDriveClientCache(SimpleTestCase):
+
+    def setUp(self):
+        drive_client.reset()
+        self.addCleanup(drive_client.reset)
+
+    def make_credentials(self, expires_in):
+        expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(seconds=expires_in)
+        return Credentials(token="token", expiry=expiry)
+
+    def fake_refresh(self, creds, request):
+        with self.refresh_lock:
+            self.refresh_calls += 1
+        creds.token = f"token-{self.refresh_calls}"
+        creds.expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=1)
+
+    def patch_credentials(self, creds):
+        self.refresh_calls = 0
+        self.refresh_lock = threading.Lock()
+        loader = mock.patch.object(Credentials, "from_authorized_user_file", return_value=creds)
+        refresher = mock.patch.object(Credentials, "refresh", autospec=True, side_effect=self.fake_refresh)
+        self.loader = loader.start()
+        refresher.start()
+        self.addCleanup(loader.stop)
+        self.addCleanup(refresher.stop)
+
+    def test_http_session_is_shared(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            sessions = set(map(id, pool.map(lambda _: drive_client.get_http_session(), range(8))))
+        self.assertEqual(len(sessions), 1)
+
+    def test_credentials_loaded_once_and_refreshed_ahead_of_expiry(self):
+        self.patch_credentials(self.make_credentials(expires_in=60))
+
+        with override_settings(GOOGLE_TOKEN_REFRESH_MARGIN=300):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                tokens = set(pool.map(lambda _: drive_client.get_credentials().token, range(32)))
+
+        self.assertEqual(tokens, {"token-1"})
+        self.assertEqual(self.refresh_calls, 1)
+        self.assertEqual(self.loader.call_count, 1)
+
+    def test_fresh_credentials_are_not_refreshed(self):
+        self.patch_credentials(self.make_credentials(expires_in=3600))
+
+        drive_client.get_credentials()
+        drive_client.get_credentials()
+
+        self.assertEqual(self.refresh_calls, 0)
+
+    def test_service_is_built_once_per_thread_from_cached_discovery(self):
+        self.patch_credentials(self.make_credentials(expires_in=3600))
+
+        with mock.patch.object(drive_client, "get_static_doc", wraps=drive_client.get_static_doc) as get_doc:
+            first = drive_client.get_service()
+            self.assertIs(drive_client.get_service(), first)
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                other = pool.submit(drive_client.get_service).result()
+
+        self.assertIsNot(other, first)
+        self.assertEqual(get_doc.call_count, 1)
+
+
+class FakeResumableSession:
+    """
+    Minimal stand-in for Drive's resumable upload protocol.
+    """
+
+    def __init__(self):
+        self.received = b""
+        self.chunk_sizes = []
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.metadata = json
+        return mock.Mock(status_code=200, headers={"Location": "https://upload.example/session"})
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        self.chunk_sizes.append(len(data))
+        self.received += data
+        total = int(headers["Content-Range"].rsplit("/", 1)[1])
+        if len(self.received) < total:
+            return mock.Mock(status_code=308, headers={"Range": f"bytes=0-{len(self.received) - 1}"})
+        return mock.Mock(status_code=200, headers={}, json=lambda: {"id": "file-1"})
+
+
+class TestStreamingUpload(SimpleTestCase):
+
+    def test_resumable_upload_streams_in_bounded_chunks(self):
+        session = FakeResumableSession()
+        payload = bytes(range(256)) * 4096  # 1 MiB
+        uploaded = TemporaryUploadedFile("video.mp4", "video/mp4", len(payload), None)
+        uploaded.write(payload)
+        self.addCleanup(uploaded.close)
+
+        with mock.patch.object(drive_client, "get_http_session", return_value=session):
+            response = drive_client.resumable_upload("token", uploaded, "video.mp4", chunk_size=256 * 1024)
+
+        self.assertEqual(response.json(), {"id": "file-1"})
+        self.assertEqual(session.received, payload)
+        self.assertEqual(session.chunk_sizes, [256 * 1024] * 4)
+        self.assertEqual(session.metadata, {"name": "video.mp4"})
+
+    def test_resumable_upload_gives_up_when_drive_stops_advancing(self):
+        session = FakeResumableSession()
+        # Drive keeps the first chunk, then answers 308 without storing anything more
+        session.put = mock.Mock(return_value=mock.Mock(status_code=308, headers={"Range": "bytes=0-1023"}))
+        uploaded = SimpleUploadedFile("video.mp4", b"x" * 4096, content_type="video/mp4")
+
+        with mock.patch.object(drive_client, "get_http_session", return_value=session):
+            with self.assertRaises(drive_client.UploadStalled):
+                drive_client.resumable_upload("token", uploaded, "video.mp4", chunk_size=1024)
+
+        self.assertEqual(session.put.call_count, drive_client.MAX_STALLED_CHUNKS + 1)
+
+    def test_media_adapter_reads_uploaded_file_in_place(self):
+        uploaded = SimpleUploadedFile("photo.jpg", b"x" * 1000, content_type="image/jpeg")
+
+        media = drive_client.UploadedFileMedia(uploaded, chunksize=256)
+
+        self.assertEqual(media.size(), 1000)
+        self.assertEqual(media.mimetype(), "image/jpeg")
+        self.assertEqual(media.getbytes(768, 256), b"x" * 232)
+
+
+CALLS = []
+
+
+@jobs.task("test.echo", secret_fields=("token",))
+def echo_task(value, token=None, fail=0, sleep=0):
+    CALLS.append(value)
+    time.sleep(sleep)
+    if CALLS.count(value) <= fail:
+        raise RuntimeError(f"failure {CALLS.count(value)}")
+    return {"value": value, "token": token}
+
+
+@jobs.task("test.refuse", max_attempts=3, on_dead=lambda value: CALLS.append(("dead", value)))
+def refuse_task(value):
+    raise jobs.PermanentError("refused")
+
+
+@jobs.task("test.batch", batch_size=3, batch_wait=60)
+def batch_task(payloads):
+    CALLS.append([payload["value"] for payload in payloads])
+    outcomes = {"retry": RuntimeError("try again"), "refuse": jobs.PermanentError("refused")}
+    return [outcomes.get(payload["value"], payload["value"]) for payload in payloads]
+
+
+@override_settings(JOB_RETRY_BASE_SECONDS=10, JOB_RETRY_MAX_SECONDS=30, JOB_VISIBILITY_TIMEOUT=60)
+class TestJobs(TestCase):
+
+    def setUp(self):
+        CALLS.clear()
+
+    def drain(self):
+        return [jobs.run(job_id, lease) for job_id, lease in jobs.claim(100)]
+
+    def make_due(self):
+        Job.objects.update(run_at=timezone.now())
+
+    def test_runs_a_task_with_its_payload(self):
+        job = jobs.enqueue("test.echo", {"value": 1})
+
+        [done] = self.drain()
+
+        self.assertEqual((done.pk, done.status, done.attempts), (job.pk, JobStatus.DONE, 1))
+        self.assertEqual(done.result, {"value": 1, "token": None})
+        self.assertIsNotNone(done.finished_at)
+        self.assertEqual(self.drain(), [])
+
+    def test_idempotency_key_returns_the_existing_job(self):
+        first = jobs.enqueue("test.echo", {"value": 1}, idempotency_key="once")
+        second = jobs.enqueue("test.echo", {"value": 2}, idempotency_key="once")
+
+        self.assertEqual(first.pk, second.pk)
+        self.drain()
+        self.assertEqual(CALLS, [1])
+        # Keyless jobs are never merged
+        self.assertNotEqual(jobs.enqueue("test.echo", {"value": 3}).pk, jobs.enqueue("test.echo", {"value": 3}).pk)
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("test.missing", {})
+
+    def test_failures_back_off_exponentially_then_die(self):
+        jobs.enqueue("test.echo", {"value": 1, "fail": 99})
+        delays = []
+        with self.assertLogs("wedding.jobs", "WARNING"):
+            for _ in range(4):
+                [job] = self.drain()
+                self.assertEqual(job.status, JobStatus.QUEUED)
+                delays.append((job.run_at - timezone.now()).total_seconds())
+                # Not due again until the backoff passes
+                self.assertEqual(jobs.claim(10), [])
+                self.make_due()
+        self.assertTrue(5 - 1 < delays[0] <= 10)
+        self.assertTrue(10 - 1 < delays[1] <= 20)
+        self.assertTrue(15 - 1 < delays[2] <= 30)
+        self.assertTrue(15 - 1 < delays[3] <= 30)
+
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            [job] = self.drain()
+        self.assertEqual((job.status, job.attempts, job.error), (JobStatus.DEAD, 5, "failure 5"))
+
+    def test_retry_succeeds_after_a_transient_failure(self):
+        jobs.enqueue("test.echo", {"value": 1, "fail": 1})
+
+        with self.assertLogs("wedding.jobs", "WARNING"):
+            self.drain()
+        self.make_due()
+        [job] = self.drain()
+
+        self.assertEqual((job.status, job.attempts, job.error), (JobStatus.DONE, 2, ""))
+
+    def test_permanent_error_dies_at_once_and_cleans_up(self):
+        jobs.enqueue("test.refuse", {"value": 7})
+
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            [job] = self.drain()
+
+        self.assertEqual((job.status, job.attempts, job.max_attempts), (JobStatus.DEAD, 1, 3))
+        self.assertEqual(CALLS, [("dead", 7)])
+
+    def test_expired_lease_is_taken_over(self):
+        job = jobs.enqueue("test.echo", {"value": 1})
+        [(_, stale_lease)] = jobs.claim(10)
+        self.assertEqual(jobs.claim(10), [])
+
+        # The first worker hangs past its visibility timeout
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        [(_, lease)] = jobs.claim(10)
+        self.assertNotEqual(lease, stale_lease)
+
+        with self.assertLogs("wedding.jobs", "WARNING") as logs:
+            stale = jobs.run(job.pk, stale_lease)
+        self.assertIn("lost its lease", logs.output[0])
+        self.assertEqual((stale.status, stale.result), (JobStatus.RUNNING, None))
+        done = jobs.run(job.pk, lease)
+        self.assertEqual((done.status, done.attempts), (JobStatus.DONE, 2))
+
+    def test_secret_fields_are_dropped_and_hidden(self):
+        jobs.enqueue("test.echo", {"value": 1, "token": "s3cret"})
+
+        [job] = self.drain()
+
+        self.assertEqual(job.payload, {"value": 1})
+        self.assertEqual(job.result["token"], "s3cret")
+        self.assertEqual(jobs.public_result(job), {"value": 1})
+        self.assertEqual(jobs.collect_result(job)["token"], "s3cret")
+        job.refresh_from_db()
+        self.assertEqual(job.result, {"value": 1})
+
+    def test_requeue_revives_dead_jobs_only(self):
+        jobs.enqueue("test.refuse", {"value": 1})
+        jobs.enqueue("test.echo", {"value": 2})
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            self.drain()
+
+        self.assertEqual(jobs.requeue(Job.objects.all()), 1)
+
+        job = Job.objects.get(task="test.refuse")
+        self.assertEqual((job.status, job.attempts, job.error), (JobStatus.QUEUED, 0, ""))
+
+    def test_purge_keeps_recent_and_dead_jobs(self):
+        jobs.enqueue("test.echo", {"value": 1})
+        jobs.enqueue("test.echo", {"value": 2})
+        jobs.enqueue("test.refuse", {"value": 3})
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            self.drain()
+        old = timezone.now() - datetime.timedelta(days=30)
+        Job.objects.filter(payload__value__in=[1, 3]).update(finished_at=old)
+
+        self.assertEqual(jobs.purge(), 1)
+        self.assertEqual(sorted(Job.objects.values_list("payload__value", flat=True)), [2, 3])
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_mode_runs_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue("test.echo", {"value": 1})
+            self.assertEqual(job.status, JobStatus.QUEUED)
+
+        self.assertEqual((job.status, job.result["value"]), (JobStatus.DONE, 1))
+
+    def test_admin_requeue_action(self):
+        get_user_model().objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        job = jobs.enqueue("test.refuse", {"value": 1})
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            self.drain()
+
+        self.client.post("/admin/wedding/job/", {"action": "requeue", "_selected_action": [job.pk]})
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.QUEUED)
+        # Staff can follow any job
+        self.assertEqual(self.client.get(f"/api/jobs/{job.pk}/").json()["status"], "queued")
+
+
+    def test_batch_task_waits_for_a_full_batch(self):
+        jobs.enqueue("test.batch", {"value": 1})
+        jobs.enqueue("test.batch", {"value": 2})
+
+        # Batch tasks are not claimed one by one
+        self.assertEqual(jobs.claim(10), [])
+        self.assertEqual(jobs.claim_batch("test.batch"), [])
+        jobs.enqueue("test.batch", {"value": 3})
+        jobs.enqueue("test.batch", {"value": 4})
+        batch = jobs.claim_batch("test.batch")
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual([job.result for job in jobs.run_batch(batch)], [1, 2, 3])
+        self.assertEqual(CALLS, [[1, 2, 3]])
+
+    def test_batch_task_sends_a_partial_batch_after_its_wait(self):
+        job = jobs.enqueue("test.batch", {"value": 1})
+        self.assertEqual(jobs.claim_batch("test.batch"), [])
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now() - datetime.timedelta(seconds=61))
+
+        self.assertEqual([job_id for job_id, _ in jobs.claim_batch("test.batch")], [job.pk])
+
+    def test_batch_outcomes_are_settled_per_job(self):
+        for value in ("ok", "retry", "refuse"):
+            jobs.enqueue("test.batch", {"value": value})
+
+        with self.assertLogs("wedding.jobs", "WARNING"):
+            done, retried, dead = jobs.run_batch(jobs.claim_batch("test.batch", force=True))
+
+        self.assertEqual((done.status, done.result), (JobStatus.DONE, "ok"))
+        self.assertEqual((retried.status, retried.error), (JobStatus.QUEUED, "try again"))
+        self.assertGreater(retried.run_at, timezone.now())
+        self.assertEqual((dead.status, dead.error), (JobStatus.DEAD, "refused"))
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_mode_runs_a_batch_task_alone(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue("test.batch", {"value": 1})
+
+        self.assertEqual((job.status, job.result), (JobStatus.DONE, 1))
+        self.assertEqual(CALLS, [[1]])
+
+
+class TestDriveBatch(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = GoogleStubServer().start()
+        cls.addClassCleanup(cls.stub.stop)
 
     def setUp(self):
-        self.log_message = LogMessage.objects.create(
-            message='Test Message',
-            log_date=timezone.now()
+        self.stub.batches.clear()
+        self.stub.files["photo"] = {"name": "photo.jpg", "mime_type": "image/jpeg", "data": b""}
+        overrides = override_settings(DRIVE_BATCH_SIZE=50, DRIVE_BATCH_INTERVAL=60, **self.stub.settings_overrides())
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_calls_are_packed_into_batches_with_a_reply_each(self):
+        calls = [drive_batch.grant_public_read(f"file{n}") for n in range(150)]
+        calls[7] = drive_batch.update_metadata("photo", {"description": "Cake"})
+        calls[8] = drive_batch.update_metadata("missing", {"description": "Cake"})
+
+        replies = drive_batch.execute(google_stub.ACCESS_TOKEN, calls)
+
+        self.assertEqual(self.stub.batches, [100, 50])
+        self.assertEqual(len(replies), 150)
+        self.assertEqual((replies[0].status, replies[0].body["type"]), (200, "anyone"))
+        self.assertEqual((replies[7].status, replies[7].body["description"]), (200, "Cake"))
+        self.assertEqual(replies[8].status, 404)
+        self.assertEqual(self.stub.files["photo"]["description"], "Cake")
+        self.assertIn(("file149", {"role": "reader", "type": "anyone"}), self.stub.permissions)
+
+    def test_replies_are_matched_by_content_id(self):
+        boundary = "b"
+        body = (
+            b"--b\r\nContent-Type: application/http\r\nContent-ID: <response-item-1>\r\n\r\n"
+            b"HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n\r\n{\"error\": 1}\r\n"
+            b"--b\r\nContent-Type: application/http\r\nContent-ID: <response-item-0>\r\n\r\n"
+            b"HTTP/1.1 204 No Content\r\n\r\n\r\n"
+            b"--b--\r\n"
         )
 
-    def test_log_message_creation(self):
-        self.assertTrue(isinstance(self.log_message, LogMessage))
-        self.assertEqual(self.log_message.message, 'Test Message')
+        replies = drive_batch.parse(f"multipart/mixed; boundary={boundary}", body)
 
-    def test_log_message_str(self):
-        expected_object_name = f"'{self.log_message.message}' logged on {timezone.localtime(self.log_message.log_date).strftime('%A, %d %B, %Y at %X')}"
-        self.assertEqual(str(self.log_message), expected_object_name)
+        self.assertEqual(replies, {0: drive_batch.Reply(204, {}), 1: drive_batch.Reply(404, {"error": 1})})
 
+    def test_follow_ups_of_many_uploads_share_one_batch(self):
+        file_ids = [f"upload{n}" for n in range(20)]
+        for file_id in file_ids:
+            drive_utils.queue_follow_ups(google_stub.ACCESS_TOKEN, file_id)
+        drive_utils.queue_follow_ups(google_stub.ACCESS_TOKEN, "photo", description="Cake")
+        drive_utils.queue_follow_ups(google_stub.ACCESS_TOKEN, "gone", description="Cake")
 
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            finished = jobs.run_due()
 
-class TestViews(TestCase):
+        # 22 grants in one request, 2 metadata updates in another
+        self.assertEqual(sorted(self.stub.batches), [2, 22])
+        self.assertEqual(len(finished), 24)
+        self.assertEqual(self.stub.files["photo"]["description"], "Cake")
+        dead = Job.objects.get(status=JobStatus.DEAD)
+        self.assertEqual((dead.task, dead.payload["file_id"]), ("drive.update_metadata", "gone"))
+        self.assertIn("404", dead.error)
+        self.assertNotIn("access_token", dead.payload)
+        self.assertEqual(Job.objects.filter(status=JobStatus.DONE).count(), 23)
+
+    def test_a_batch_waits_for_size_or_interval(self):
+        with override_settings(DRIVE_BATCH_SIZE=3):
+            for n in range(2):
+                drive_utils.queue_follow_ups(google_stub.ACCESS_TOKEN, f"upload{n}")
+            self.assertEqual(jobs.claim_batch("drive.grant_permission"), [])
+            drive_utils.queue_follow_ups(google_stub.ACCESS_TOKEN, "upload2")
+            self.assertEqual(len(jobs.claim_batch("drive.grant_permission")), 3)
+
+        drive_utils.queue_follow_ups(google_stub.ACCESS_TOKEN, "upload3")
+        self.assertEqual(jobs.claim_batch("drive.grant_permission"), [])
+        with override_settings(DRIVE_BATCH_INTERVAL=0):
+            self.assertEqual(len(jobs.claim_batch("drive.grant_permission")), 1)
+
+    def test_tokens_get_separate_batches(self):
+        drive_utils.queue_follow_ups(google_stub.ACCESS_TOKEN, "upload0")
+        drive_utils.queue_follow_ups("revoked", "upload1")
+
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            jobs.run_due()
+
+        self.assertEqual(self.stub.batches, [1])
+        statuses = dict(Job.objects.values_list("payload__file_id", "status"))
+        self.assertEqual(statuses, {"upload0": JobStatus.DONE, "upload1": JobStatus.DEAD})
+
+    def test_failed_batch_request_is_retried(self):
+        drive_utils.queue_follow_ups(google_stub.ACCESS_TOKEN, "upload0")
+
+        with override_settings(GOOGLE_API_ROOT="http://127.0.0.1:9"), self.assertLogs("wedding.jobs", "WARNING"):
+            [job] = jobs.run_due()
+
+        self.assertEqual((job.status, job.attempts), (JobStatus.QUEUED, 1))
+        Job.objects.update(run_at=timezone.now())
+        [job] = jobs.run_due()
+        self.assertEqual(job.status, JobStatus.DONE)
+
+
+class TestJobWorkers(TransactionTestCase):
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_pool_runs_jobs_side_by_side(self):
+        for value in range(8):
+            jobs.enqueue("test.echo", {"value": value, "sleep": 0.2})
+
+        started = time.perf_counter()
+        ran = jobs.work(threads=8, once=True, poll_interval=0.01)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(ran, 8)
+        self.assertEqual(sorted(CALLS), list(range(8)))
+        self.assertEqual(Job.objects.filter(status=JobStatus.DONE).count(), 8)
+        self.assertLess(elapsed, 1.0)
+
+    def test_run_jobs_command_filters_by_task(self):
+        jobs.enqueue("test.echo", {"value": 1})
+        jobs.enqueue("test.refuse", {"value": 2})
+
+        call_command("run_jobs", "--once", "--threads", "2", "--task", "test.echo")
+
+        self.assertEqual(CALLS, [1])
+        self.assertEqual(Job.objects.get(task="test.refuse").status, JobStatus.QUEUED)
+
+
+class TestGoogleViews(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = GoogleStubServer().start()
+        cls.addClassCleanup(cls.stub.stop)
+
+    def setUp(self):
+        self.stub.latency = 0
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.spool = os.path.join(media_root, "drive", "spool")
+        overrides = override_settings(
+            GOOGLE_DRIVE_CHUNK_SIZE=256 * 1024, MEDIA_ROOT=media_root, **self.stub.settings_overrides(),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def drain(self):
+        # What a run_jobs worker would do, on this thread so it sees the test transaction
+        return jobs.run_due()
+
+    def sign_in(self, code="ok"):
+        response = self.client.get('/api/auth/callback/', {"code": code})
+        self.drain()
+        return response
+
+    def upload(self, name="a.jpg", data=b"x", content_type="image/jpeg", **fields):
+        return self.client.post(
+            '/api/drive/upload/', {"file": SimpleUploadedFile(name, data, content_type=content_type), **fields},
+        )
+
+    def test_callback_queues_the_token_exchange(self):
+        metrics.reset()
+        response = self.client.get('/api/auth/callback/', {"code": "ok"})
+
+        self.assertEqual((response.status_code, response.json()["status"]), (202, "queued"))
+        self.assertNotIn("oauth.token", metrics.render())
+        [job] = self.drain()
+        self.assertEqual(job.status, JobStatus.DONE)
+        self.assertEqual(job.result["access_token"], google_stub.ACCESS_TOKEN)
+        # The one-time code is dropped and the token never shown
+        self.assertNotIn("code", job.payload)
+        status = self.client.get(f'/api/jobs/{job.pk}/').json()
+        self.assertEqual(status["status"], "done")
+        self.assertNotIn("access_token", status["result"])
+        # A replayed callback reuses the job
+        self.assertEqual(self.client.get('/api/auth/callback/', {"code": "ok"}).json()["job"], job.pk)
+
+    def test_token_leaves_the_jobs_table_once_the_session_has_it(self):
+        self.sign_in()
+
+        self.assertEqual(self.upload().status_code, 202)
+
+        job = Job.objects.get(task="google.exchange_code")
+        self.assertEqual(job.result, {"expires_in": 3599})
+        self.assertEqual(self.client.session["google_access_token"], google_stub.ACCESS_TOKEN)
+        # A second upload uses the session's copy
+        self.assertEqual(self.upload().status_code, 202)
+
+    def test_refused_code_dies_without_retrying(self):
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            self.sign_in("bad")
+
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (JobStatus.DEAD, 1))
+        self.assertIn("400", job.error)
+        self.assertEqual(self.upload().status_code, 401)
+        self.assertEqual(self.client.get('/api/auth/callback/').status_code, 400)
+
+    def test_upload_is_queued_then_streamed_to_drive_in_chunks(self):
+        payload = os.urandom(600 * 1024)
+        self.sign_in()
+        metrics.reset()
+
+        response = self.upload("video.mp4", payload, "video/mp4", description="First dance")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn("drive.upload", metrics.render())
+        self.assertEqual(len(os.listdir(self.spool)), 1)
+        self.drain()
+        job = Job.objects.get(task="drive.upload")
+        file_id = job.result["id"]
+        self.assertEqual(self.stub.files[file_id]["data"], payload)
+        self.assertEqual(self.stub.files[file_id]["name"], "video.mp4")
+        # Shared and described through Drive batch requests
+        self.assertIn((file_id, {"role": "reader", "type": "anyone"}), self.stub.permissions)
+        self.assertEqual(self.stub.files[file_id]["description"], "First dance")
+        self.assertEqual(
+            set(Job.objects.filter(task__startswith="drive.").exclude(task="drive.upload").values_list("task", "status")),
+            {("drive.grant_permission", JobStatus.DONE), ("drive.update_metadata", JobStatus.DONE)},
+        )
+        record = UploadedFile.objects.get(storage_key=file_id)
+        self.assertEqual((record.filename, record.storage_backend), ("video.mp4", "drive"))
+        self.assertEqual(os.listdir(self.spool), [])
+        self.assertNotIn("access_token", job.payload)
+
+    def test_upload_waits_for_sign_in_to_finish(self):
+        self.client.get('/api/auth/callback/', {"code": "ok"})
+
+        self.assertEqual(self.upload().status_code, 409)
+        self.drain()
+        self.assertEqual(self.upload().status_code, 202)
+
+    def test_upload_requires_google_sign_in(self):
+        self.assertEqual(self.upload().status_code, 401)
+
+    def test_dead_upload_discards_its_spool(self):
+        self.sign_in()
+        session = self.client.session
+        session["google_access_token"] = "revoked"
+        session.save()
+
+        self.upload()
+        with self.assertLogs("wedding.jobs", "ERROR"):
+            [job] = self.drain()
+
+        self.assertEqual(job.status, JobStatus.DEAD)
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_google_latency_is_recorded(self):
+        metrics.reset()
+        self.sign_in()
+        result = drive_utils.upload_to_drive(google_stub.ACCESS_TOKEN, io.BytesIO(b"x" * 1024), "a.jpg")
+        # The permission grant is a job too
+        self.assertNotIn((result["id"], {"role": "reader", "type": "anyone"}), self.stub.permissions)
+        self.drain()
+
+        self.assertIn((result["id"], {"role": "reader", "type": "anyone"}), self.stub.permissions)
+        exported = metrics.render()
+        for endpoint in ("oauth.token", "drive.upload.start", "drive.upload.chunk", "drive.batch"):
+            self.assertIn(f'wedding_google_request_duration_seconds_count{{endpoint="{endpoint}",status="200"}} 1', exported)
+
+    def test_job_status_is_private_to_its_session(self):
+        job_id = self.client.get('/api/auth/callback/', {"code": "ok"}).json()["job"]
+
+        self.assertEqual(Client().get(f'/api/jobs/{job_id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/jobs/{job_id + 1}/').status_code, 404)
+
+
+class TestImageVariants(SimpleTestCase):
+
+    def test_variants_are_never_upscaled(self):
+        variants = imaging.render_variants(io.BytesIO(make_jpeg(500, 400)))
+
+        sizes = {name: (info["width"], info["height"]) for name, _, info in variants}
+        self.assertEqual(sizes, {"full": (500, 400), "medium": (500, 400), "thumbnail": (320, 256)})
+
+    def test_variants_are_encoded_in_configured_format(self):
+        with override_settings(GALLERY_IMAGE_FORMAT="JPEG"):
+            [(_, buffer, info)] = [v for v in imaging.render_variants(io.BytesIO(make_jpeg(800, 600))) if v[0] == "thumbnail"]
+
+        self.assertEqual(info["mime_type"], "image/jpeg")
+        self.assertEqual(Image.open(buffer).format, "JPEG")
+
+    def test_non_images_have_no_variants(self):
+        self.assertEqual(imaging.render_variants(io.BytesIO(b"not an image")), [])
+
+    def test_hash_comes_from_the_same_decode_as_the_variants(self):
+        photo = io.BytesIO(make_jpeg(1600, 1200, pattern=True))
+
+        with mock.patch.object(Image, "open", wraps=Image.open) as opened:
+            variants, phash = imaging.render(photo, with_hash=True)
+
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(variants), 3)
+        self.assertLessEqual(imaging.hamming_distance(phash, imaging.perceptual_hash(photo)), 4)
+
+    def test_decompression_bombs_have_no_variants(self):
+        bomb = io.BytesIO(make_jpeg(500, 400))
+        # Pillow refuses images over twice this many pixels
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000), self.assertLogs("wedding.imaging", "WARNING"):
+            self.assertEqual(imaging.render_variants(bomb), [])
+            self.assertEqual(imaging.perceptual_hash(bomb), "")
+
+
+class TestBenchmarkSuite(TransactionTestCase):
+
+    def test_every_route_is_benchmarked_within_its_query_budget(self):
+        output = os.path.join(tempfile.mkdtemp(), "bench.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(output), ignore_errors=True)
+
+        call_command(
+            "bench_api", "--in-place", "--check", "--guests", "20", "--gifts", "5", "--wishes", "10",
+            "--photos", "10", "--iterations", "1", "--warmup", "0", "--peak-requests", "6",
+            "--concurrency", "2", "--output", output, stdout=io.StringIO(), stderr=io.StringIO(),
+        )
+
+        with open(output) as fh:
+            results = json.load(fh)
+        routes = {row["route"] for row in results["endpoints"]}
+        self.assertTrue({"guest-rsvp", "gift-reserve", "gallery-upload-to-drive", "api-root"} <= routes)
+        self.assertEqual(results["query_budget_violations"], [])
+        self.assertTrue(all(code < "400" for row in results["endpoints"] for code in row["statuses"]))
+        self.assertEqual(results["peak"]["requests"], 6)
+        self.assertEqual(results["meta"]["seed"]["guests"], 20)
+
+
+@override_settings(METRICS_TOKEN="scrape-me")
+class TestRequestMetrics(TestCase):
 
     def setUp(self):
+        cache.clear()
+        metrics.reset()
         self.client = Client()
 
-    def test_not_found_url(self):
-        response = self.client.get('/a-url-that-does-not-exist')
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION="Bearer scrape-me")
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
 
-        self.assertEquals(response.status_code, 404)
- 
\ No newline at end of file
+    def test_requests_are_recorded_per_route(self):
+        Gift.objects.create(title="Kettle")
+        self.client.get('/api/gifts/')
+        self.client.get('/api/gifts/')
+
+        exported = self.scrape()
+        self.assertIn('wedding_http_request_duration_seconds_count{view="gift-list",method="GET",status="200"} 2', exported)
+        self.assertIn('wedding_http_request_duration_seconds_bucket{view="gift-list",method="GET",status="200",le="+Inf"} 2', exported)
+        # The second request came from the response cache
+        self.assertIn('wedding_http_request_db_queries_sum{view="gift-list"} 1.0', exported)
+        self.assertIn('wedding_serializer_duration_seconds_count{serializer="GiftSerializer[]"} 1', exported)
+
+    def test_metrics_need_the_token_or_staff(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0, METRICS_SQL_SAMPLE_SIZE=2)
+    def test_slow_requests_are_logged_with_their_slowest_sql(self):
+        guest = Guest.objects.create(name="Amina", email="amina@example.com")
+        gift = Gift.objects.create(title="Sofa")
+
+        with self.assertLogs("wedding.slow_requests", "WARNING") as logs:
+            self.client.patch(
+                f'/api/gifts/{gift.pk}/reserve/', {"guest_id": str(guest.pk)}, content_type="application/json"
+            )
+
+        [message] = logs.output
+        self.assertIn("PATCH /api/gifts/", message)
+        self.assertIn("(gift-reserve) -> 200", message)
+        self.assertIn("3 queries", message)
+        self.assertEqual(message.count(" ms  "), 2)
+        self.assertIn('wedding_slow_requests_total{view="gift-reserve"} 1', self.scrape())
+
+
+class TestLiveUpdates(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.guest = Guest.objects.create(name="Amina", email="amina@example.com", phone="0700000000")
+
+    def events(self, **filters):
+        return list(LiveEvent.objects.filter(**filters).order_by("id"))
+
+    def test_new_wish_is_published_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            wish = Wish.objects.create(guest=self.guest, message="Hongera!")
+        self.assertEqual(self.events(), [])
+
+        for callback in callbacks:
+            callback()
+        [event] = self.events()
+        self.assertEqual((event.topic, event.kind), ("wishes", "wish"))
+        self.assertEqual(event.data["id"], str(wish.pk))
+        self.assertEqual(event.data["guest_name"], "Amina")
+        self.assertNotIn("amina@example.com", json.dumps(event.data))
+
+    def test_reserving_a_gift_pushes_a_delta(self):
+        gift = Gift.objects.create(title="Sofa")
+        LiveEvent.objects.all().delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/gifts/{gift.pk}/reserve/', {"guest_id": str(self.guest.pk)}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        [event] = self.events()
+        self.assertEqual(event.data, {"id": str(gift.pk), "title": "Sofa", "reserved": True})
+
+    def test_photo_is_published_when_its_upload_finishes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = GalleryItem.objects.create(title="a.jpg", status=UploadStatus.PENDING)
+        self.assertEqual(self.events(), [])
+
+        item.status = UploadStatus.DONE
+        item.image = "https://example.com/a.jpg"
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        [event] = self.events()
+        self.assertEqual((event.topic, event.kind, event.data["image"]), ("gallery", "photo", "https://example.com/a.jpg"))
+
+    def test_replay_resumes_after_the_cursor_for_the_requested_topics(self):
+        first = live.publish("wishes", "wish", {"id": "1"})
+        live.publish("gifts", "gift", {"id": "2"})
+        third = live.publish("wishes", "wish", {"id": "3"})
+
+        self.assertEqual([e.id for e in live.replay(first.id, ["wishes"])], [third.id])
+        self.assertEqual(live.replay(third.id, live.TOPICS), [])
+
+    def test_cursor_older_than_the_log_asks_for_a_reset(self):
+        first = live.publish("wishes", "wish", {"id": "1"})
+        live.publish("wishes", "wish", {"id": "2"})
+        last = live.publish("wishes", "wish", {"id": "3"})
+        LiveEvent.objects.filter(id__lt=last.id).delete()
+
+        self.assertIsNone(live.replay(first.id, ["wishes"]))
+        frames, cursor = live.opening(first.id, ["wishes"])
+        self.assertEqual(cursor, last.id)
+        self.assertIn(b"event: reset", frames[0])
+
+    def test_wsgi_response_carries_the_missed_events_and_closes(self):
+        first = live.publish("wishes", "wish", {"id": "1"})
+        live.publish("gifts", "gift", {"id": "2"})
+        third = live.publish("wishes", "wish", {"id": "3"})
+
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+        response = self.client.get('/api/live/?topics=wishes', HTTP_LAST_EVENT_ID=str(first.id))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = response.content.decode()
+        self.assertIn(f"id: {third.id}\ndata: ", body)
+        self.assertNotIn('"gift"', body)
+        self.assertTrue(body.endswith(f"id: {third.id}\nevent: hello\ndata: {{\"cursor\": {third.id}}}\n\n"))
+
+    def test_wishes_are_for_staff_only(self):
+        live.publish("wishes", "wish", {"id": "1", "message": "Hongera!", "guest_name": "Amina"})
+
+        response = self.client.get('/api/live/?topics=wishes&cursor=0')
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn(b"Hongera", response.content)
+        # Without topics an anonymous client follows the public ones
+        response = self.client.get('/api/live/?cursor=0')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b"Hongera", response.content)
+
+    def test_unknown_topics_are_rejected(self):
+        self.assertEqual(self.client.get('/api/live/?topics=guests').status_code, 400)
+
+    async def test_stream_pushes_new_events_for_its_topics(self):
+        stream = live.stream(["wishes"], None)
+        self.assertTrue((await anext(stream)).startswith(b"retry: "))
+        self.assertIn(b"event: hello", await anext(stream))
+
+        await sync_to_async(live.publish)("gifts", "gift", {"id": "1"})
+        wish = await sync_to_async(live.publish)("wishes", "wish", {"id": "2"})
+
+        self.assertEqual(await asyncio.wait_for(anext(stream), 1), wish.frame)
+        await stream.aclose()
+        self.assertEqual(len(live.hub), 0)
+
+    async def test_asgi_request_is_streamed(self):
+        response = await self.async_client.get('/api/live/', {"topics": "gifts"})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        content = aiter(response.streaming_content)
+        await anext(content)
+        self.assertIn(b"event: hello", await anext(content))
+        await content.aclose()
+
+    @override_settings(LIVE_HEARTBEAT_SECONDS=0.01)
+    async def test_idle_stream_sends_heartbeats(self):
+        stream = live.stream(["wishes"], None)
+        await anext(stream)
+        await anext(stream)
+
+        self.assertEqual(await anext(stream), live.HEARTBEAT_FRAME)
+        await stream.aclose()
+
+    @override_settings(LIVE_SUBSCRIBER_BUFFER=2)
+    async def test_subscriber_that_falls_behind_is_disconnected(self):
+        stream = live.stream(["wishes"], None)
+        await anext(stream)
+        await anext(stream)
+
+        for n in range(3):
+            live.hub.dispatch(live.Event(10 ** 6 + n, "wishes", "wish", {}))
+        self.assertIn(b"event: reset", await asyncio.wait_for(anext(stream), 1))
+        with self.assertRaises(StopAsyncIteration):
+            await asyncio.wait_for(anext(stream), 1)
+        self.assertEqual(len(live.hub), 0)
+
+    async def test_database_broker_relays_rows_written_elsewhere(self):
+        broker = live.DatabaseBroker()
+        subscription = live.hub.subscribe(["gallery"])
+        self.addCleanup(live.hub.unsubscribe, subscription)
+        await sync_to_async(broker.poll)()
+
+        row = await LiveEvent.objects.acreate(topic="gallery", kind="photo", data={"id": "1"})
+        await sync_to_async(broker.poll)()
+
+        event = await subscription.get(1)
+        self.assertEqual((event.id, event.frame), (row.pk, live.Event.from_row(row).frame))
+
+    async def test_database_broker_relays_rows_that_commit_out_of_order(self):
+        broker = live.DatabaseBroker()
+        subscription = live.hub.subscribe(["gallery"])
+        self.addCleanup(live.hub.unsubscribe, subscription)
+        await sync_to_async(broker.poll)()
+        first = await LiveEvent.objects.acreate(topic="gallery", kind="photo", data={"id": "1"})
+        # The id in between was taken by a transaction that has not committed yet
+        third = await LiveEvent.objects.acreate(id=first.pk + 2, topic="gallery", kind="photo", data={"id": "3"})
+        await sync_to_async(broker.poll)()
+
+        second = await LiveEvent.objects.acreate(id=first.pk + 1, topic="gallery", kind="photo", data={"id": "2"})
+        await sync_to_async(broker.poll)()
+        await sync_to_async(broker.poll)()
+
+        received = [(await subscription.get(1)).id for _ in range(3)]
+        self.assertEqual(received, [first.pk, third.pk, second.pk])
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_stream_delivers_late_events_once(self):
+        stream = live.stream(["wishes"], None)
+        await anext(stream)
+        await anext(stream)
+
+        late = live.Event(10 ** 6, "wishes", "wish", {"id": "late"})
+        newest = live.Event(10 ** 6 + 1, "wishes", "wish", {"id": "newest"})
+        for event in (newest, late, newest, late):
+            live.hub.dispatch(event)
+
+        self.assertEqual(await asyncio.wait_for(anext(stream), 1), newest.frame)
+        self.assertEqual(await asyncio.wait_for(anext(stream), 1), late.frame)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(anext(stream), 0.1)
+        await stream.aclose()
+
+
+@override_settings(RATE_LIMITS={"reserve": "3/min", "reserve.guest": "2/min", "upload": "100/min"})
+class TestRateLimits(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.gifts = [Gift.objects.create(title=f"Gift {n}") for n in range(4)]
+        self.guests = [Guest.objects.create(name=f"Guest {n}", email=f"g{n}@example.com") for n in range(3)]
+
+    def reserve(self, gift, guest, ip="10.0.0.1"):
+        return self.client.patch(
+            f'/api/gifts/{gift.pk}/reserve/', {"guest_id": str(guest.pk)},
+            content_type="application/json", REMOTE_ADDR=ip,
+        )
+
+    def test_guest_is_limited_across_addresses(self):
+        self.assertEqual(self.reserve(self.gifts[0], self.guests[0], "10.0.0.1").status_code, 200)
+        self.assertEqual(self.reserve(self.gifts[1], self.guests[0], "10.0.0.2").status_code, 200)
+
+        response = self.reserve(self.gifts[2], self.guests[0], "10.0.0.3")
+
+        self.assertEqual(response.status_code, 429)
+        # One token back every 30 seconds
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertFalse(Gift.objects.get(pk=self.gifts[2].pk).reserved)
+
+    def test_address_is_limited_across_guests(self):
+        codes = [self.reserve(gift, guest).status_code for gift, guest in zip(self.gifts, self.guests)]
+        codes.append(self.reserve(self.gifts[3], self.guests[2], "10.0.0.9").status_code)
+
+        self.assertEqual(codes, [200, 200, 200, 200])
+        self.assertEqual(self.reserve(self.gifts[3], self.guests[1]).status_code, 429)
+
+    def test_bucket_refills_over_time(self):
+        with mock.patch("wedding.throttling.time.time", return_value=1000.0):
+            self.reserve(self.gifts[0], self.guests[0])
+            self.reserve(self.gifts[1], self.guests[0])
+            self.assertEqual(self.reserve(self.gifts[2], self.guests[0]).status_code, 429)
+        with mock.patch("wedding.throttling.time.time", return_value=1030.0):
+            self.assertEqual(self.reserve(self.gifts[2], self.guests[0]).status_code, 200)
+
+    def test_admin_and_read_endpoints_are_not_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get('/api/gifts/').status_code, 200)
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_limits_can_be_switched_off(self):
+        for gift in self.gifts:
+            self.assertNotEqual(self.reserve(gift, self.guests[0]).status_code, 429)
+
+
+class TestUploadAdmission(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        overrides = override_settings(
+            MEDIA_ROOT=self.media_root, GALLERY_DRIVE_CLIENT="wedding.drive_client.InMemoryDriveClient",
+            GALLERY_UPLOAD_MAX_IN_FLIGHT=2, GALLERY_UPLOAD_MAX_SPOOL_BYTES=10_000, RATE_LIMIT_ENABLED=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.client = Client()
+
+    def upload(self):
+        return self.client.post('/api/gallery/upload/', {"file": SimpleUploadedFile("a.jpg", os.urandom(2000))})
+
+    def test_upload_is_refused_while_too_many_are_in_flight(self):
+        self.assertTrue(throttling.upload_admission.try_admit(0))
+        self.assertTrue(throttling.upload_admission.try_admit(0))
+        try:
+            response = self.upload()
+        finally:
+            throttling.upload_admission.release(0)
+            throttling.upload_admission.release(0)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertFalse(GalleryItem.objects.exists())
+        self.assertEqual(self.upload().status_code, 202)
+        self.assertEqual(throttling.upload_admission.in_flight, 0)
+
+    def test_upload_is_refused_while_too_many_bytes_are_spooled(self):
+        self.assertTrue(throttling.upload_admission.try_admit(9_000))
+        try:
+            response = self.upload()
+        finally:
+            throttling.upload_admission.release(9_000)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(throttling.upload_admission.bytes, 0)
+
+    def test_queued_spool_counts_against_the_byte_cap(self):
+        with mock.patch.object(upload_queue, "backlog_bytes", return_value=9_500):
+            self.assertFalse(throttling.upload_admission.try_admit(1_000))
+            self.assertTrue(throttling.upload_admission.try_admit(100))
+        throttling.upload_admission.release(100)
+
+    def test_lone_oversized_upload_is_admitted(self):
+        self.assertTrue(throttling.upload_admission.try_admit(50_000))
+        throttling.upload_admission.release(50_000)
+
+
+class TestSearch(TestCase):
+
+    def setUp(self):
+        self.amina = Guest.objects.create(name="Amina Kerubo", email="amina.k@example.com")
+        self.jose = Guest.objects.create(name="José Otieno", email="jose@example.com")
+        self.kerry = Guest.objects.create(name="Kerry Wanjiru", email="kerry@amina-family.com")
+
+    def names(self, query, **kwargs):
+        return [guest.name for guest in search.search("guest", query, **kwargs)]
+
+    def test_index_backend_matches_the_database(self):
+        self.assertEqual(search.get_backend().name, "sqlite-fts5")
+
+    def test_words_must_all_match_and_the_last_one_is_a_prefix(self):
+        self.assertEqual(self.names("amina keru"), ["Amina Kerubo"])
+        # "amina" is in Kerry's email domain and "ker" prefixes both names
+        self.assertEqual(self.names("amina ker"), ["Amina Kerubo", "Kerry Wanjiru"])
+        self.assertEqual(self.names("ami keru"), [])
+        self.assertEqual(self.names("wanj"), ["Kerry Wanjiru"])
+
+    def test_accents_and_email_parts_match(self):
+        self.assertEqual(self.names("jose otieno"), ["José Otieno"])
+        self.assertEqual(self.names("family"), ["Kerry Wanjiru"])
+
+    def test_name_matches_outrank_email_matches_and_words_outrank_prefixes(self):
+        self.assertEqual(self.names("amina"), ["Amina Kerubo", "Kerry Wanjiru"])
+        self.assertEqual(self.names("ker"), ["Amina Kerubo", "Kerry Wanjiru"])
+        self.assertEqual(self.names("kerry"), ["Kerry Wanjiru"])
+
+    def test_ranking_is_the_same_without_the_index(self):
+        for query in ("amina", "ker", "example", "jose otieno"):
+            self.assertEqual(
+                search.search("guest", query),
+                search.search("guest", query, backend=search.IContainsBackend()),
+                query,
+            )
+
+    @override_settings(SEARCH_CANDIDATE_LIMIT=1)
+    def test_admin_filter_is_not_capped(self):
+        self.assertEqual(len(search.search("guest", "amina")), 1)
+        self.assertEqual(set(search.matching_ids("guest", "amina")), {self.amina.pk, self.kerry.pk})
+
+    def test_index_follows_updates_deletes_and_imports(self):
+        self.amina.name = "Amina Chebet"
+        self.amina.save()
+        self.jose.delete()
+        guest_io.import_guests([{"name": "Chebet Njeri", "email": "chebet@example.com"}])
+
+        self.assertEqual(self.names("chebet"), ["Amina Chebet", "Chebet Njeri"])
+        self.assertEqual(self.names("kerubo"), [])
+        self.assertEqual(self.names("jose"), [])
+
+    def test_rebuild_repairs_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM wedding_guest_fts")
+        self.assertEqual(self.names("amina"), [])
+
+        call_command("rebuild_search_index", stdout=io.StringIO())
+
+        self.assertEqual(self.names("amina"), ["Amina Kerubo", "Kerry Wanjiru"])
+
+    def test_search_endpoints(self):
+        Wish.objects.create(guest=self.amina, message="Hongera sana, maisha marefu!")
+        Wish.objects.create(guest=self.jose, message="Congratulations to you both")
+        client = APIClient()
+
+        self.assertEqual(client.get('/api/wishes/search/', {"q": "hongera"}).status_code, 403)
+        client.force_authenticate(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+        with self.assertNumQueries(3):
+            response = client.get('/api/wishes/search/', {"q": "maisha mare"})
+
+        [wish] = response.json()["results"]
+        self.assertEqual((wish["message"], wish["guest"]["name"]), ("Hongera sana, maisha marefu!", "Amina Kerubo"))
+        self.assertEqual(client.get('/api/guests/search/', {"q": "  "}).status_code, 400)
+        self.assertEqual(
+            [g["name"] for g in client.get('/api/guests/search/', {"q": "ker", "limit": 1}).json()["results"]],
+            ["Amina Kerubo"],
+        )
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_admin_search_uses_the_index(self):
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+
+        response = self.client.get('/admin/wedding/guest/', {"q": "wanj"})
+
+        self.assertContains(response, "Kerry Wanjiru")
+        self.assertNotContains(response, "Amina Kerubo")
+
+
+class TestCheckin(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.amina = Guest.objects.create(name="Amina Kerubo", email="amina.k@example.com", phone="+254 712 345 678")
+        self.jose = Guest.objects.create(name="José Otieno", email="jose@example.com", phone="0733 111 222")
+        self.api = APIClient()
+        self.api.force_authenticate(get_user_model().objects.create_superuser("door", "door@example.com", "pw"))
+
+    def arrive(self, *arrivals):
+        return self.api.post('/api/checkin/sync/', {"arrivals": [
+            {"guest_id": str(guest_id), "checked_in_at": at.isoformat()} for guest_id, at in arrivals
+        ]}, format="json")
+
+    def test_snapshot_is_gzipped_versioned_and_revalidated(self):
+        response = self.api.get('/api/checkin/', HTTP_ACCEPT_ENCODING="gzip, br")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        snapshot = json.loads(gzip.decompress(response.content))
+        self.assertEqual(snapshot["fields"], ["id", "name", "email", "phone", "rsvp_status", "checked_in_at"])
+        self.assertEqual([row[1] for row in snapshot["guests"]], ["Amina Kerubo", "José Otieno"])
+        self.assertEqual(response["ETag"], f'"{snapshot["version"]}"')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.api.get('/api/checkin/', HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        plain = self.api.get('/api/checkin/')
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertEqual(plain.json(), snapshot)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.arrive((self.amina.pk, timezone.now()))
+        self.assertEqual(self.api.get('/api/checkin/', HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_snapshot_follows_guest_edits(self):
+        version = self.api.get('/api/checkin/').json()["version"]
+        self.jose.name = "José Otieno Jr"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jose.save()
+
+        snapshot = self.api.get('/api/checkin/').json()
+
+        self.assertNotEqual(snapshot["version"], version)
+        self.assertIn("José Otieno Jr", [row[1] for row in snapshot["guests"]])
+
+    def test_lookup_by_name_email_fragment_and_phone(self):
+        def names(query):
+            return [guest["name"] for guest in checkin.lookup(query)]
+
+        self.assertEqual(names("am"), ["Amina Kerubo"])
+        self.assertEqual(names("jose ot"), ["José Otieno"])
+        self.assertEqual(names("mina.k"), ["Amina Kerubo"])
+        self.assertEqual(names("345 678"), ["Amina Kerubo"])
+        self.assertEqual(names("example"), ["Amina Kerubo", "José Otieno"])
+        # Short terms only match the start of a word
+        self.assertEqual(names("in"), [])
+
+    def test_lookup_ranks_word_starts_first(self):
+        Guest.objects.create(name="Zawadi Mina", email="zawadi@example.com")
+
+        self.assertEqual([guest["name"] for guest in checkin.lookup("mina")], ["Zawadi Mina", "Amina Kerubo"])
+
+    def test_lookup_reports_current_arrivals_without_a_rebuild(self):
+        checkin.lookup("amina")
+        index = checkin.get_index()
+        self.arrive((self.amina.pk, timezone.now() - datetime.timedelta(minutes=5)))
+
+        with self.assertNumQueries(1):
+            [result] = self.api.get('/api/checkin/lookup/', {"q": "amina"}).json()["results"]
+
+        self.assertIs(checkin.get_index(), index)
+        self.assertIsNotNone(result["checked_in_at"])
+        self.assertEqual(self.api.get('/api/checkin/lookup/').status_code, 400)
+
+    def test_sync_applies_a_batch_in_one_transaction(self):
+        guests = Guest.objects.bulk_create([Guest(name=f"Door {n}", email=f"door{n}@example.com") for n in range(50)])
+        at = timezone.now() - datetime.timedelta(minutes=30)
+
+        with self.assertNumQueries(4):
+            response = self.arrive(*[(guest.pk, at) for guest in guests])
+
+        self.assertEqual({r["status"] for r in response.json()["results"]}, {"checked_in"})
+        self.assertEqual(Guest.objects.filter(checked_in_at=at).count(), 50)
+
+    def test_sync_keeps_the_earliest_arrival(self):
+        early = timezone.now() - datetime.timedelta(minutes=10)
+        late = timezone.now() - datetime.timedelta(minutes=2)
+        self.arrive((self.amina.pk, late))
+
+        response = self.arrive((self.amina.pk, early), (self.jose.pk, late), (self.jose.pk, early))
+        replay = self.arrive((self.amina.pk, late))
+
+        self.assertEqual([r["status"] for r in response.json()["results"]], ["checked_in", "checked_in"])
+        [result] = replay.json()["results"]
+        self.assertEqual(result["status"], "already_checked_in")
+        self.assertEqual(datetime.datetime.fromisoformat(result["checked_in_at"].replace("Z", "+00:00")), early)
+        self.assertEqual(Guest.objects.get(pk=self.jose.pk).checked_in_at, early)
+
+    def test_sync_clamps_future_times_and_reports_bad_arrivals(self):
+        response = self.api.post('/api/checkin/sync/', {"arrivals": [
+            {"guest_id": str(self.amina.pk), "checked_in_at": (timezone.now() + datetime.timedelta(hours=1)).isoformat()},
+            {"guest_id": str(uuid.uuid4()), "checked_in_at": timezone.now().isoformat()},
+            {"guest_id": "not-a-uuid", "checked_in_at": timezone.now().isoformat()},
+        ]}, format="json")
+
+        self.assertEqual([r["status"] for r in response.json()["results"]], ["checked_in", "not_found"])
+        self.assertEqual(response.json()["errors"][0]["arrival"], 3)
+        self.assertLessEqual(Guest.objects.get(pk=self.amina.pk).checked_in_at, timezone.now())
+
+    def test_sync_limits_and_permissions(self):
+        with override_settings(CHECKIN_SYNC_MAX_ARRIVALS=1):
+            self.assertEqual(self.arrive((self.amina.pk, timezone.now()), (self.jose.pk, timezone.now())).status_code, 400)
+        self.assertEqual(self.api.post('/api/checkin/sync/', {"arrivals": "all"}, format="json").status_code, 400)
+        anonymous = APIClient()
+        self.assertIn(anonymous.get('/api/checkin/').status_code, (401, 403))
+        self.assertIn(anonymous.post('/api/checkin/sync/', {"arrivals": []}, format="json").status_code, (401, 403))
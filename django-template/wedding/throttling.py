@@ -0,0 +1,127 @@
+"""
+Rate limits and upload admission control for the public write endpoints.
+
+Each throttled action names a scope in its viewset's ``throttle_scopes``.
+``RATE_LIMITS`` gives the rate per scope for a client IP (``"rsvp"``) and for
+a guest, identified by the guest id or email in the request (``"rsvp.guest"``).
+A rate of ``"10/min"`` is a token bucket holding 10 tokens that refills at 10
+per minute: a burst of 10, then one request every 6 seconds. Buckets live in
+the Django cache, so with a shared backend (Redis, files) the limits hold
+across workers; read-modify-write is not atomic, so a burst racing on one
+bucket can get a request or two past the limit.
+
+``upload_admission`` bounds the uploads one process accepts at a time: at
+most ``GALLERY_UPLOAD_MAX_IN_FLIGHT`` requests, and no more than
+``GALLERY_UPLOAD_MAX_SPOOL_BYTES`` of request bodies plus spooled files still
+waiting for the background pool. It is checked before the body is read, from
+``Content-Length``. Throttled and refused requests get 429 with Retry-After.
+"""
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+from . import upload_queue
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """
+    ``"10/min"`` -> ``(10, 60)``: bucket size and seconds to refill it.
+    """
+    count, period = rate.split("/")
+    return int(count), PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    suffix = ""
+
+    def get_bucket_ident(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if not settings.RATE_LIMIT_ENABLED:
+            return True
+        scope = getattr(view, "throttle_scopes", {}).get(getattr(view, "action", None))
+        rate = settings.RATE_LIMITS.get(f"{scope}{self.suffix}") if scope else None
+        if rate is None:
+            return True
+        ident = self.get_bucket_ident(request)
+        if ident is None:
+            return True
+
+        capacity, period = parse_rate(rate)
+        refill = capacity / period
+        key = f"wedding:throttle:{scope}{self.suffix}:{ident}"
+        now = time.time()
+        tokens, updated = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill)
+        if tokens < 1:
+            self.wait_seconds = (1 - tokens) / refill
+            return False
+        # An untouched bucket is full again after one period, so let it expire
+        cache.set(key, (tokens - 1, now), timeout=period)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ClientIPThrottle(TokenBucketThrottle):
+
+    def get_bucket_ident(self, request):
+        return self.get_ident(request)
+
+
+class GuestThrottle(TokenBucketThrottle):
+    """
+    Keyed on the guest a request acts for: ``guest_id``, or the RSVP email.
+    """
+    suffix = ".guest"
+
+    def get_bucket_ident(self, request):
+        data = request.data
+        if not hasattr(data, "get"):
+            return None
+        guest = data.get("guest_id") or str(data.get("email") or "").strip().lower()
+        if not guest:
+            return None
+        # Keep emails out of cache keys
+        return hashlib.sha256(str(guest).encode()).hexdigest()[:32]
+
+
+class UploadAdmission:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.bytes = 0
+
+    def try_admit(self, size):
+        with self._lock:
+            if self.in_flight >= settings.GALLERY_UPLOAD_MAX_IN_FLIGHT:
+                return False
+            spooled = self.bytes + upload_queue.backlog_bytes()
+            # With nothing else spooled, an upload bigger than the cap is still let in
+            if (self.in_flight or spooled) and spooled + size > settings.GALLERY_UPLOAD_MAX_SPOOL_BYTES:
+                return False
+            self.in_flight += 1
+            self.bytes += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.in_flight -= 1
+            self.bytes -= size
+
+
+upload_admission = UploadAdmission()
+
+
+def request_size(request):
+    try:
+        return max(int(request.META.get("CONTENT_LENGTH") or 0), 0)
+    except ValueError:
+        return 0
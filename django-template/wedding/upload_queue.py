@@ -0,0 +1,355 @@
+"""
+Background pipeline that pushes spooled gallery uploads to their storage
+backend (Google Drive by default, see ``storage.py``).
+
+The upload endpoint only stores the file and creates a pending ``GalleryItem``;
+the row itself is the queue entry. Workers claim a row by flipping its status
+with a conditional UPDATE, so a row is never uploaded twice even when the
+in-process pool and the ``process_gallery_uploads`` command run side by side.
+The claim is timestamped: a row still "uploading" after
+``GALLERY_UPLOAD_CLAIM_TIMEOUT`` belonged to a worker that died, and
+``process_pending`` puts it back in the queue (or fails it once its attempts
+are used up).
+"""
+import logging
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from . import imaging, live, stats, storage
+from .models import GalleryItem, UploadStatus
+from .response_cache import bump_version
+from .uploads import content_hash
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executor_lock = threading.Lock()
+# Bytes spooled to disk and waiting for this process's pool, for admission control
+_backlog = {"bytes": 0}
+_backlog_lock = threading.Lock()
+
+
+def _get_executor(name, max_workers):
+    with _executor_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix=f"gallery-{name}",
+            )
+        return executor
+
+
+def enqueue(item):
+    """
+    Schedule ``item`` for upload once the surrounding transaction commits.
+    """
+    item_id = item.pk
+    if settings.GALLERY_UPLOAD_EAGER:
+        transaction.on_commit(lambda: process_item(item_id))
+    else:
+        executor = _get_executor("upload", settings.GALLERY_UPLOAD_WORKERS)
+        size = item.file.size if item.file else 0
+        transaction.on_commit(lambda: _submit(executor, item_id, size))
+
+
+def _submit(executor, item_id, size):
+    with _backlog_lock:
+        _backlog["bytes"] += size
+    executor.submit(_run_in_worker, item_id, size)
+
+
+def backlog_bytes():
+    """
+    Size of the spooled uploads this process has queued but not yet pushed.
+    """
+    return _backlog["bytes"]
+
+
+def _run_in_worker(item_id, size):
+    close_old_connections()
+    try:
+        process_item(item_id)
+    except Exception:
+        logger.exception("Gallery upload %s crashed", item_id)
+    finally:
+        close_old_connections()
+        with _backlog_lock:
+            _backlog["bytes"] -= size
+
+
+def push_to_storage(backend, fileobj, name, mime_type=None):
+    """
+    Store the original plus its resized variants, the variants in one
+    ``put_many``. Returns ``(stored, variants, phash)``; the perceptual hash
+    comes from the same decode as the variants ("" when
+    ``GALLERY_PERCEPTUAL_HASH`` is off).
+    """
+    stored = backend.put(fileobj, name, mime_type)
+    stem = os.path.splitext(name)[0]
+    rendered, phash = imaging.render(fileobj, with_hash=settings.GALLERY_PERCEPTUAL_HASH)
+    results = backend.put_many(
+        (buffer, f"{stem}.{variant_name}.{info['format']}", info["mime_type"]) for variant_name, buffer, info in rendered
+    )
+    variants = {}
+    for (variant_name, _, info), result in zip(rendered, results):
+        if isinstance(result, Exception):
+            raise result
+        variants[variant_name] = {"url": result.url, "key": result.key, **info}
+    return stored, variants, phash or ""
+
+
+def _apply(item, stored, variants, phash):
+    item.storage_backend = stored.backend
+    item.storage_key = stored.key
+    item.image = stored.url
+    item.variants = variants
+    item.phash = phash
+    item.status = UploadStatus.DONE
+
+
+def process_item(item_id, backend=None):
+    """
+    Upload one pending item to ``backend`` (default: the backend recorded on
+    the item). Returns the item, or None if another worker owns it.
+    """
+    claimed = GalleryItem.objects.filter(pk=item_id, status=UploadStatus.PENDING).update(
+        status=UploadStatus.UPLOADING, attempts=F("attempts") + 1, claimed_at=timezone.now()
+    )
+    if not claimed:
+        return None
+
+    item = GalleryItem.objects.get(pk=item_id)
+    backend = backend or storage.get_backend(item.storage_backend)
+    mime_type = mimetypes.guess_type(item.title)[0]
+
+    try:
+        with item.file.open("rb") as fh:
+            _apply(item, *push_to_storage(backend, fh, item.title, mime_type))
+    except Exception as exc:
+        logger.warning("Gallery upload %s failed (attempt %s): %s", item_id, item.attempts, exc)
+        item.status = UploadStatus.FAILED
+        item.error = str(exc)
+        item.save(update_fields=["status", "error"])
+        return item
+
+    spool_name = item.file.name
+    item.error = ""
+    item.file = None
+    item.save(update_fields=["storage_backend", "storage_key", "image", "variants", "phash", "status", "error", "file"])
+    GalleryItem.file.field.storage.delete(spool_name)
+    return item
+
+
+def _fill(item, uploaded_file, stream):
+    backend = storage.get_backend()
+    item.storage_backend = backend.name
+    item.sha256 = content_hash(uploaded_file)
+    if stream:
+        _apply(item, *push_to_storage(backend, uploaded_file, uploaded_file.name, uploaded_file.content_type))
+    else:
+        item.status = UploadStatus.PENDING
+        item.file.save(uploaded_file.name, uploaded_file, save=False)
+    return item
+
+
+def build_item(uploaded_file, stream=False):
+    """
+    Unsaved ``GalleryItem`` for an upload: either spooled and pending, or, when
+    ``stream`` is set, already stored with its variants. Either way it is bound
+    to the ``GALLERY_STORAGE`` backend and carries the upload's SHA-256.
+    """
+    return _fill(GalleryItem(title=uploaded_file.name), uploaded_file, stream)
+
+
+def _refill(item, uploaded_file, stream):
+    """
+    ``_fill`` an item whose earlier transfer failed with the re-uploaded bytes,
+    then drop the spool copy that failed. It is kept until then so that a
+    failed re-fill still leaves something to retry.
+    """
+    spool_name = item.file.name if item.file else None
+    _fill(item, uploaded_file, stream)
+    if spool_name:
+        GalleryItem.file.field.storage.delete(spool_name)
+    return item
+
+
+def _retry_failed(item):
+    """
+    Save an item whose earlier transfer failed once ``_refill`` has given it
+    the re-uploaded bytes.
+    """
+    item.error = ""
+    item.save()
+    if item.status == UploadStatus.PENDING:
+        enqueue(item)
+    return item
+
+
+def _discard_spool(item):
+    if item.file:
+        item.file.delete(save=False)
+
+
+def _insert(items):
+    """
+    ``bulk_create`` new items. If a concurrent request stored some of the same
+    content first, fall back to one insert per item. Returns ``(created,
+    existing)``, where ``existing`` maps the SHA-256 of each losing item to the
+    row that won.
+    """
+    try:
+        with transaction.atomic():
+            return GalleryItem.objects.bulk_create(items), {}
+    except IntegrityError:
+        pass
+    created, existing = [], {}
+    for item in items:
+        try:
+            with transaction.atomic():
+                created += GalleryItem.objects.bulk_create([item])
+        except IntegrityError:
+            _discard_spool(item)
+            existing[item.sha256] = GalleryItem.objects.get(sha256=item.sha256)
+    return created, existing
+
+
+def _after_insert(created):
+    # bulk_create sends no post_save, so do the signal handlers' work here
+    bump_version("gallery")
+    stats.record_photos(created)
+    for item in created:
+        if item.status == UploadStatus.PENDING:
+            enqueue(item)
+        elif item.status == UploadStatus.DONE:
+            live.publish_on_commit("gallery", "photo", live.photo_delta(item))
+
+
+def store_upload(uploaded_file, stream=False):
+    """
+    Store one upload unless its content is already in the gallery. Returns
+    ``(item, duplicate)``; a duplicate is the existing item, and no bytes are
+    spooled or sent to storage for it.
+    """
+    existing = GalleryItem.objects.filter(sha256=content_hash(uploaded_file)).first()
+    if existing is not None:
+        if existing.status != UploadStatus.FAILED:
+            return existing, True
+        return _retry_failed(_refill(existing, uploaded_file, stream)), False
+
+    item = build_item(uploaded_file, stream)
+    try:
+        with transaction.atomic():
+            item.save()
+    except IntegrityError:
+        # A concurrent request stored the same content first
+        _discard_spool(item)
+        return GalleryItem.objects.get(sha256=item.sha256), True
+    if item.status == UploadStatus.PENDING:
+        enqueue(item)
+    return item, False
+
+
+def store_batch(uploaded_files, stream=False):
+    """
+    Store many uploads at once: content already in the gallery (or repeated in
+    the batch) is skipped with one lookup, the remaining files are transferred
+    concurrently on a bounded pool (spooled, or streamed to the storage backend
+    when ``stream`` is set) and every new row is written with a single
+    ``bulk_create``.
+
+    Returns ``(uploaded_file, item, error, duplicate)`` tuples in request order;
+    ``item`` is None when that file failed.
+    """
+    digests = [content_hash(uploaded_file) for uploaded_file in uploaded_files]
+    known = {item.sha256: item for item in GalleryItem.objects.filter(sha256__in=set(digests))}
+
+    # Index of the file that will carry each new digest
+    carriers = {}
+    for index, digest in enumerate(digests):
+        if digest not in carriers and (digest not in known or known[digest].status == UploadStatus.FAILED):
+            carriers[digest] = index
+
+    executor = _get_executor("batch", settings.GALLERY_BATCH_WORKERS)
+    futures = {}
+    for digest, index in carriers.items():
+        if digest in known:
+            futures[index] = executor.submit(_refill, known[digest], uploaded_files[index], stream)
+        else:
+            futures[index] = executor.submit(build_item, uploaded_files[index], stream)
+
+    built, errors = {}, {}
+    for index, future in futures.items():
+        try:
+            built[index] = future.result()
+        except Exception as exc:
+            logger.warning("Batch upload of %s failed: %s", uploaded_files[index].name, exc)
+            errors[index] = str(exc)
+
+    for index, item in built.items():
+        if digests[index] in known:
+            _retry_failed(item)
+    created, existing = _insert([item for index, item in built.items() if digests[index] not in known])
+    for item in built.values():
+        known[item.sha256] = existing.get(item.sha256, item)
+    _after_insert(created)
+
+    outcomes = []
+    for index, (uploaded_file, digest) in enumerate(zip(uploaded_files, digests)):
+        carrier = carriers.get(digest)
+        if carrier in errors:
+            outcomes.append((uploaded_file, None, errors[carrier], False))
+        else:
+            duplicate = index != carrier or digest in existing
+            outcomes.append((uploaded_file, known[digest], None, duplicate))
+    return outcomes
+
+
+def requeue_abandoned():
+    """
+    Put uploads whose worker stopped mid-transfer back in the queue, or fail
+    them if they have no attempts left. Returns the number of rows touched.
+    """
+    abandoned = GalleryItem.objects.filter(
+        Q(claimed_at__lt=timezone.now() - timedelta(seconds=settings.GALLERY_UPLOAD_CLAIM_TIMEOUT))
+        | Q(claimed_at__isnull=True),
+        status=UploadStatus.UPLOADING,
+    )
+    touched = abandoned.filter(attempts__lt=settings.GALLERY_UPLOAD_MAX_ATTEMPTS).update(status=UploadStatus.PENDING)
+    touched += abandoned.update(status=UploadStatus.FAILED, error="Upload worker stopped before finishing")
+    if touched:
+        bump_version("gallery")
+    return touched
+
+
+def process_pending(backend=None, retry_failed=False, limit=None):
+    """
+    Drain pending rows synchronously, after requeueing abandoned ones. Used by
+    the management command to pick up work left behind by a restarted worker
+    process.
+    """
+    requeue_abandoned()
+    if retry_failed:
+        requeued = GalleryItem.objects.filter(
+            status=UploadStatus.FAILED, attempts__lt=settings.GALLERY_UPLOAD_MAX_ATTEMPTS
+        ).update(status=UploadStatus.PENDING)
+        if requeued:
+            bump_version("gallery")
+
+    ids = GalleryItem.objects.filter(status=UploadStatus.PENDING).order_by("uploaded_at").values_list("pk", flat=True)
+    if limit:
+        ids = ids[:limit]
+
+    processed = []
+    for item_id in list(ids):
+        item = process_item(item_id, backend=backend)
+        if item is not None:
+            processed.append(item)
+    return processed
@@ -0,0 +1,57 @@
+"""
+Upload handlers that SHA-256 each file while Django streams it in from the
+request, so content hashing costs no extra pass over the bytes. The digest is
+left on the resulting ``UploadedFile`` as ``sha256``.
+"""
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingMixin:
+
+    def new_file(self, *args, **kwargs):
+        # Before super(): the memory handler claims the file by raising StopFutureHandlers
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.hashing_active():
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self.hasher.hexdigest()
+        return uploaded_file
+
+    def hashing_active(self):
+        return True
+
+
+class HashingMemoryFileUploadHandler(HashingMixin, MemoryFileUploadHandler):
+
+    def hashing_active(self):
+        # Too-large uploads pass through to the temporary-file handler, which hashes them
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(HashingMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def content_hash(fileobj):
+    """
+    SHA-256 hex digest of an upload: the one computed while it streamed in,
+    or else read from the file (and remembered).
+    """
+    digest = getattr(fileobj, "sha256", None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+        hasher.update(chunk)
+    fileobj.seek(0)
+    digest = fileobj.sha256 = hasher.hexdigest()
+    return digest
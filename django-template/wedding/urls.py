@@ -5,9 +5,13 @@ from .views import (
     GiftViewSet,
     WishViewSet,
     GalleryViewSet,
+    CheckinViewSet,
+    DashboardStatsView,
     GoogleAuthInitView,
     GoogleAuthCallbackView,
     GoogleDriveUploadView,
+    LiveEventsView,
+    JobStatusView,
 )
 
 router = DefaultRouter()
@@ -15,13 +19,17 @@ router.register(r'guests', GuestViewSet, basename='guest')
 router.register(r'gifts', GiftViewSet, basename='gift')
 router.register(r'wishes', WishViewSet, basename='wish')
 router.register(r'gallery', GalleryViewSet, basename='gallery')
+router.register(r'checkin', CheckinViewSet, basename='checkin')
 
 #guest_rsvp = GuestViewSet.as_view({'POST': 'rsvp'})
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
+    path('live/', LiveEventsView.as_view(), name='live-events'),
     path('auth/init/', GoogleAuthInitView.as_view(), name='google-auth-init'),
     path('auth/callback/', GoogleAuthCallbackView.as_view(), name='google-auth-callback'),
     path('drive/upload/', GoogleDriveUploadView.as_view(), name='google-drive-upload'),
+    path('jobs/<int:pk>/', JobStatusView.as_view(), name='job-status'),
     #path('api/rsvp/', guest_rsvp, name='guest-rsvp'),
 ]
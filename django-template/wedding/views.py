@@ -1,25 +1,131 @@
+import gzip
+import hashlib
+import logging
 import os
-import requests
+import uuid
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Exists
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, get_object_or_404
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.decorators import action
-from rest_framework.parsers import MultiPartParser, FormParser
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from rest_framework.exceptions import Throttled
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from rest_framework import viewsets, status
-from .models import Guest, Gift, Wish, GalleryItem
-from .serializers import GuestSerializer, GiftSerializer, GiftReserveSerializer, WishSerializer, GallerySerializer
-
+from .models import Guest, Gift, Wish, GalleryItem, Job, JobStatus, UploadStatus
+from .serializers import (
+    CheckinArrivalSerializer, GuestSerializer, GiftSerializer, GiftReserveSerializer, WishSerializer, GallerySerializer,
+    SparseFieldsetMixin, parse_fieldset,
+)
+from .response_cache import CachedResponseMixin, bump_version, etag_matches
+from .pagination import GalleryPagination, GiftPagination, NewestFirstPagination
+from . import checkin, guest_io, jobs, imaging, live, metrics, search, stats, upload_queue
+from .throttling import ClientIPThrottle, GuestThrottle, request_size, upload_admission
+
+logger = logging.getLogger(__name__)
 
 # ---------------------- Existing Views ----------------------
 
-class GuestViewSet(viewsets.ModelViewSet):
+class RelatedQuerysetMixin:
+    """
+    Join the related rows a nested serializer needs, for the actions that
+    serialize them, so listing N objects costs one query instead of N+1.
+    """
+    select_related_fields = ()
+    related_actions = ('list', 'retrieve', 'update', 'partial_update')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.related_actions and self.select_related_fields:
+            queryset = queryset.select_related(*self.select_related_fields)
+        return queryset
+
+
+class SparseFieldsMixin:
+    """
+    Honour ``?fields=`` and ``?expand=`` in every response of the viewset
+    (see ``serializers.SparseFieldsetMixin``). For ``sparse_actions`` the
+    queryset loads only the columns, and joins only the relations, that the
+    chosen fields read.
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), SparseFieldsetMixin):
+            kwargs.setdefault('fields', parse_fieldset(self.request.query_params.get('fields')))
+            kwargs.setdefault('expand', parse_fieldset(self.request.query_params.get('expand')))
+            kwargs.setdefault('staff', self.request.user.is_staff)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in self.sparse_actions:
+            return queryset
+        columns, relations = self.get_serializer().only()
+        # Cursor pagination reads the ordering fields of the page's rows
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        columns += [name.lstrip('-') for name in ([ordering] if isinstance(ordering, str) else ordering)]
+        return queryset.select_related(None).select_related(*relations).only(*columns)
+
+
+class UploadAdmissionMixin:
+    """
+    Refuse uploads with 429 before their body is read while this process
+    already has too many in flight (``throttling.upload_admission``).
+    """
+    admission_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.admission_actions:
+            size = request_size(request)
+            if not upload_admission.try_admit(size):
+                raise Throttled(wait=settings.GALLERY_UPLOAD_RETRY_AFTER, detail="Too many uploads in progress.")
+            self.admitted_bytes = size
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        size = self.__dict__.pop("admitted_bytes", None)
+        if size is not None:
+            upload_admission.release(size)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class SearchMixin:
+    """
+    ``search/?q=`` over the viewset's ``search_document`` (see ``search.py``):
+    up to ``limit`` (default 20, at most 100) matches, best first.
+    """
+    search_document = None
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        matches = search.search(self.search_document, query, limit=limit)
+        return Response({"results": self.get_serializer(matches, many=True).data})
+
+
+class GuestViewSet(SparseFieldsMixin, SearchMixin, viewsets.ModelViewSet):
     queryset = Guest.objects.all().order_by('-created_at')
     serializer_class = GuestSerializer
+    pagination_class = NewestFirstPagination
+    throttle_classes = [ClientIPThrottle, GuestThrottle]
+    throttle_scopes = {'create': 'rsvp', 'rsvp': 'rsvp'}
+    search_document = 'guest'
 
     def get_permissions(self):
         if self.action in ['create', 'rsvp']:
@@ -28,45 +134,107 @@ class GuestViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['POST'], url_path='rsvp', permission_classes=[AllowAny])
     def rsvp(self, request):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        guest = serializer.save()
-        return Response(self.get_serializer(guest).data, status=status.HTTP_201_CREATED)
+        """
+        Idempotent on email: a returning guest gets their existing record
+        (updated with the submitted fields) and 200 instead of an error.
+        """
+        guest, created = guest_io.rsvp_guest(request.data)
+        return Response(
+            self.get_serializer(guest).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
 
+    @action(detail=False, methods=['POST'], url_path='import')
+    def import_guests(self, request):
+        """
+        Upsert guests from an uploaded CSV or NDJSON file ("file" field), keyed on email.
+        """
+        uploaded_file = request.FILES.get("file")
+        if not uploaded_file:
+            return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = "ndjson" if uploaded_file.name.endswith((".ndjson", ".jsonl")) else "csv"
+        rows = guest_io.read_rows(guest_io.text_stream(uploaded_file.file), fmt)
+        result = guest_io.import_guests(rows)
+        return Response(result.as_dict(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['GET'], url_path='export')
+    def export_guests(self, request):
+        """
+        Stream every guest as CSV (default) or NDJSON (?output=ndjson).
+        """
+        fmt = request.query_params.get("output", "csv")
+        if fmt not in ("csv", "ndjson"):
+            return Response({"error": "output must be csv or ndjson"}, status=status.HTTP_400_BAD_REQUEST)
+        content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        response = StreamingHttpResponse(guest_io.export_guests(fmt), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="guests.{fmt}"'
+        return response
 
-class GiftViewSet(viewsets.ModelViewSet):
+
+class GiftViewSet(CachedResponseMixin, SparseFieldsMixin, RelatedQuerysetMixin, viewsets.ModelViewSet):
     queryset = Gift.objects.all().order_by('title')
     serializer_class = GiftSerializer
+    pagination_class = GiftPagination
+    select_related_fields = ('reserved_by',)
+    cache_scope = 'gift'
+    throttle_classes = [ClientIPThrottle, GuestThrottle]
+    throttle_scopes = {'reserve': 'reserve', 'rsvp_and_reserve': 'reserve'}
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'reserve']:
+        if self.action in ['list', 'retrieve', 'reserve', 'rsvp_and_reserve']:
             return [AllowAny()]
         return [IsAdminUser()]
 
     @action(detail=True, methods=['patch'], url_path='reserve', permission_classes=[AllowAny])
     def reserve(self, request, pk=None):
-        gift = get_object_or_404(Gift, pk=pk)
-        if gift.reserved:
-            return Response({"detail": "Already reserved"}, status=status.HTTP_400_BAD_REQUEST)
-
         serializer = GiftReserveSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        guest_id = serializer.validated_data['guest_id']
+        return self._claim(pk, serializer.validated_data['guest_id'])
 
-        try:
-            guest = Guest.objects.get(id=guest_id)
-        except Guest.DoesNotExist:
+    @action(detail=True, methods=['post'], url_path='rsvp-and-reserve', permission_classes=[AllowAny])
+    def rsvp_and_reserve(self, request, pk=None):
+        """
+        RSVP (upsert on email) and reserve the gift in one request. The RSVP
+        stands even if the gift turns out to be taken.
+        """
+        guest, _ = guest_io.rsvp_guest(request.data)
+        return self._claim(pk, guest.pk)
+
+    def _claim(self, pk, guest_id):
+        """
+        Reserve a gift with one conditional UPDATE, so concurrent clicks cannot
+        both win: the UPDATE only matches while the gift is still unreserved and
+        the guest exists. The loser gets 409; a repeat by the guest who already
+        holds the gift gets the gift back.
+        """
+        claimed = Gift.objects.filter(
+            Exists(Guest.objects.filter(id=guest_id)), pk=pk, reserved=False,
+        ).update(reserved=True, reserved_by_id=guest_id)
+
+        if not claimed:
+            gift = get_object_or_404(Gift, pk=pk)
+            if gift.reserved and gift.reserved_by_id == guest_id:
+                return Response(self.get_serializer(gift).data, status=status.HTTP_200_OK)
+            if gift.reserved:
+                return Response({"detail": "Already reserved"}, status=status.HTTP_409_CONFLICT)
             return Response({"detail": "Guest not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        gift.reserved = True
-        gift.reserved_by = guest
-        gift.save()
-        return Response(GiftSerializer(gift).data, status=status.HTTP_200_OK)
+        # A queryset update sends no post_save, so invalidate, count and push here
+        bump_version('gift')
+        stats.bump(stats.GIFTS_RESERVED)
+        gift = Gift.objects.get(pk=pk)
+        live.publish_on_commit('gifts', 'gift', live.gift_delta(gift))
+        return Response(self.get_serializer(gift).data, status=status.HTTP_200_OK)
 
 
-class WishViewSet(viewsets.ModelViewSet):
+class WishViewSet(SparseFieldsMixin, SearchMixin, RelatedQuerysetMixin, viewsets.ModelViewSet):
     queryset = Wish.objects.all().order_by('-created_at')
     serializer_class = WishSerializer
+    pagination_class = NewestFirstPagination
+    select_related_fields = ('guest',)
+    throttle_classes = [ClientIPThrottle, GuestThrottle]
+    throttle_scopes = {'create': 'wish'}
+    search_document = 'wish'
 
     def get_permissions(self):
         if self.action in ['create']:
@@ -74,56 +242,271 @@ class WishViewSet(viewsets.ModelViewSet):
         return [IsAdminUser()]
 
 
-class GalleryViewSet(viewsets.ModelViewSet):
+class GalleryViewSet(
+    UploadAdmissionMixin, CachedResponseMixin, SparseFieldsMixin, RelatedQuerysetMixin, viewsets.ModelViewSet,
+):
     queryset = GalleryItem.objects.all().order_by('-uploaded_at')
     serializer_class = GallerySerializer
+    pagination_class = GalleryPagination
+    select_related_fields = ('guest',)
+    related_actions = RelatedQuerysetMixin.related_actions + ('check_hashes', 'similar')
+    cache_scope = 'gallery'
     parser_classes = [MultiPartParser, FormParser]
+    # Uploads are limited per IP only: the guest is not known before the body is read
+    throttle_classes = [ClientIPThrottle]
+    throttle_scopes = {'create': 'upload', 'upload_to_drive': 'upload', 'upload_batch': 'upload'}
+    admission_actions = ('create', 'upload_to_drive', 'upload_batch')
 
     def get_permissions(self):
-        if self.action in ['create', 'list', 'retrieve', 'upload_to_drive']:
+        if self.action in ['create', 'list', 'retrieve', 'upload_to_drive', 'upload_batch', 'check_hashes']:
             return [AllowAny()]
         return [IsAdminUser()]
     
     @action(detail=False, methods=['POST'], url_path='upload', permission_classes=[AllowAny])
     def upload_to_drive(self, request):
         """
-        Handle image uploads and save them to Google Drive.
+        Accept an image upload and queue it for transfer to the storage backend
+        (GALLERY_STORAGE, Google Drive by default). The item is returned straight
+        away in the "pending" state; a background worker fills in the link once
+        the transfer finishes. With GALLERY_UPLOAD_MODE="stream" the file is
+        stored inline instead, and a storage failure is answered with 502.
+        Content already in the gallery is not stored again: the existing item
+        is returned with 200.
         """
         uploaded_file = request.FILES.get("file")
         if not uploaded_file:
             return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Save the uploaded file temporarily
-        temp_path = f"/tmp/{uploaded_file.name}"
-        with open(temp_path, "wb+") as temp_file:
-            for chunk in uploaded_file.chunks():
-                temp_file.write(chunk)
-
-        # Load stored OAuth credentials
-        creds_path = os.path.join(settings.BASE_DIR, "credentials.json")
-        creds = Credentials.from_authorized_user_file(creds_path, ["https://www.googleapis.com/auth/drive.file"])
+        stream = settings.GALLERY_UPLOAD_MODE == "stream"
+        try:
+            # In stream mode the request's UploadedFile goes straight to storage, chunk by chunk
+            gallery_item, duplicate = upload_queue.store_upload(uploaded_file, stream=stream)
+        except Exception as exc:
+            if not stream:
+                raise
+            logger.warning("Streamed upload of %s failed: %s", uploaded_file.name, exc)
+            return Response({"error": str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
+        if duplicate:
+            return Response(self.get_serializer(gallery_item).data, status=status.HTTP_200_OK)
+        return Response(
+            self.get_serializer(gallery_item).data,
+            status=status.HTTP_201_CREATED if stream else status.HTTP_202_ACCEPTED,
+        )
 
-        # Connect to Google Drive
-        service = build("drive", "v3", credentials=creds)
+    @action(detail=False, methods=['POST'], url_path='upload-batch', permission_classes=[AllowAny])
+    def upload_batch(self, request):
+        """
+        Accept many images in one multipart request (repeated "files" fields).
+        Files are transferred in parallel and a result is returned per file;
+        files whose content is already in the gallery are marked "duplicate".
+        """
+        uploaded_files = request.FILES.getlist("files")
+        if not uploaded_files:
+            return Response({"error": "No files provided"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(uploaded_files) > settings.GALLERY_BATCH_MAX_FILES:
+            return Response(
+                {"error": f"At most {settings.GALLERY_BATCH_MAX_FILES} files per batch"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        stream = settings.GALLERY_UPLOAD_MODE == "stream"
+        results = []
+        for uploaded_file, item, error, duplicate in upload_queue.store_batch(uploaded_files, stream=stream):
+            if item is None:
+                results.append({"file": uploaded_file.name, "error": error})
+            elif duplicate:
+                results.append({"file": uploaded_file.name, "item": self.get_serializer(item).data, "duplicate": True})
+            else:
+                results.append({"file": uploaded_file.name, "item": self.get_serializer(item).data})
+
+        if not any("item" in result for result in results):
+            return Response({"results": results}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(
+            {"results": results},
+            status=status.HTTP_201_CREATED if stream else status.HTTP_202_ACCEPTED,
+        )
 
-        # Upload to Google Drive
-        file_metadata = {
-            "name": uploaded_file.name,
-            "parents": [settings.GOOGLE_DRIVE_FOLDER_ID]
-        }
-        media = MediaFileUpload(temp_path, resumable=True)
-        file = service.files().create(body=file_metadata, media_body=media, fields="id, webViewLink").execute()
-
-        # Save the uploaded file info in DB
-        gallery_item = GalleryItem.objects.create(
-            title=uploaded_file.name,
-            image=file["webViewLink"]  # Save the Drive link instead of a local image
+    @action(detail=False, methods=['POST'], url_path='check-hashes', permission_classes=[AllowAny],
+            parser_classes=[JSONParser])
+    def check_hashes(self, request):
+        """
+        Let a client skip uploading files the gallery already has: takes
+        {"sha256": [hex digests]} and returns the existing item per known digest.
+        """
+        digests = request.data.get("sha256") if isinstance(request.data, dict) else None
+        if not isinstance(digests, list) or not all(isinstance(digest, str) for digest in digests):
+            return Response({"error": "sha256 must be a list of hex digests"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(digests) > settings.GALLERY_HASH_CHECK_MAX:
+            return Response(
+                {"error": f"At most {settings.GALLERY_HASH_CHECK_MAX} digests per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        items = (
+            self.get_queryset()
+            .filter(sha256__in={digest.lower() for digest in digests})
+            .exclude(status=UploadStatus.FAILED)
         )
+        return Response({"known": {item.sha256: self.get_serializer(item).data for item in items}})
+
+    @action(detail=True, methods=['GET'])
+    def similar(self, request, pk=None):
+        """
+        Admin view of likely near-duplicates of a photo (resized, recompressed or
+        re-exported copies): items whose perceptual hash is within ?distance=
+        bits (default 6), closest first.
+        """
+        item = self.get_object()
+        if not item.phash:
+            return Response({"error": "No perceptual hash for this item"}, status=status.HTTP_409_CONFLICT)
+        try:
+            distance = min(max(int(request.query_params.get("distance", 6)), 0), 64)
+        except ValueError:
+            return Response({"error": "distance must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = []
+        candidates = GalleryItem.objects.exclude(pk=item.pk).exclude(phash="").values_list("pk", "phash")
+        for candidate_pk, phash in candidates.iterator():
+            bits = imaging.hamming_distance(item.phash, phash)
+            if bits <= distance:
+                matches.append((bits, candidate_pk))
+        matches.sort()
+        similar = self.get_queryset().in_bulk([candidate_pk for _, candidate_pk in matches])
+        return Response({"results": [
+            {"distance": bits, "item": self.get_serializer(similar[candidate_pk]).data}
+            for bits, candidate_pk in matches
+        ]})
+
+
+# ---------------------- Check-in ----------------------
+
+class CheckinViewSet(viewsets.ViewSet):
+    """
+    The door's guest list: a versioned snapshot, server-side lookup, and
+    batch sync of queued arrivals (see ``wedding/checkin.py``).
+    """
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        """
+        Every guest as rows of ``fields``, gzip-encoded for clients that accept it.
+        """
+        version, body = checkin.snapshot()
+        etag = f'"{version}"'
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        elif "gzip" in request.headers.get("Accept-Encoding", ""):
+            response = HttpResponse(body, content_type="application/json")
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(gzip.decompress(body), content_type="application/json")
+        response["ETag"] = etag
+        response["Vary"] = "Accept-Encoding"
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    @action(detail=False, methods=['get'], url_path='lookup')
+    def lookup(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": checkin.lookup(query, limit)})
+
+    @action(detail=False, methods=['post'], url_path='sync')
+    def sync(self, request):
+        """
+        Apply ``{"arrivals": [{"guest_id", "checked_in_at"}, ...]}`` in one
+        transaction. Invalid arrivals are skipped and reported by their
+        1-based position; the rest are applied.
+        """
+        arrivals = request.data.get("arrivals") if hasattr(request.data, "get") else None
+        if not isinstance(arrivals, list):
+            return Response({"error": "arrivals must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(arrivals) > settings.CHECKIN_SYNC_MAX_ARRIVALS:
+            return Response(
+                {"error": f"At most {settings.CHECKIN_SYNC_MAX_ARRIVALS} arrivals per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        valid, errors = [], []
+        for number, arrival in enumerate(arrivals, start=1):
+            serializer = CheckinArrivalSerializer(data=arrival)
+            if serializer.is_valid():
+                valid.append((serializer.validated_data["guest_id"], serializer.validated_data["checked_in_at"]))
+            else:
+                errors.append({"arrival": number, "errors": serializer.errors})
+        results = checkin.sync(valid) if valid else []
+        return Response({"version": checkin.current_version(), "results": results, "errors": errors})
+
+
+# ---------------------- Dashboard ----------------------
+
+class DashboardStatsView(APIView):
+    """
+    Guest, RSVP, gift, wish and photo counts from the precomputed counters.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            hours = min(max(int(request.query_params.get("hours", 24)), 1), 24 * 14)
+        except ValueError:
+            return Response({"error": "hours must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(stats.snapshot(hours=hours))
 
-        # Delete the temporary file
-        os.remove(temp_path)
 
-        return Response(GallerySerializer(gallery_item).data, status=status.HTTP_201_CREATED)
+class MetricsView(View):
+    """
+    Request metrics in the Prometheus text format, for scrapers presenting
+    METRICS_TOKEN as a bearer token, or for signed-in staff.
+    """
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        authorized = bool(token) and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+        if not (authorized or request.user.is_staff):
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class LiveEventsView(View):
+    """
+    Server-Sent Events stream of wish, photo and gift deltas (``wedding.live``).
+    ``?topics=`` picks from wishes, gallery and gifts (default all the client
+    may see: wishes, with messages and guest names, are for staff only); a
+    client resumes from ``?cursor=`` or the ``Last-Event-ID`` header
+    EventSource sends when it reconnects.
+
+    Under ASGI the stream stays open. Under WSGI it would pin a worker thread
+    per client, so the response carries only what the client missed and
+    closes; EventSource reconnects after ``retry`` and this degrades to polling.
+    """
+
+    async def get(self, request):
+        staff = (await request.auser()).is_staff
+        requested = request.GET.get("topics")
+        if requested:
+            topics = [t for t in requested.split(",") if t]
+        else:
+            topics = [t for t in live.TOPICS if staff or t not in live.STAFF_TOPICS]
+        unknown = set(topics) - set(live.TOPICS)
+        if unknown or not topics:
+            return JsonResponse({"error": f"topics must be among {', '.join(live.TOPICS)}"}, status=400)
+        if set(topics) & set(live.STAFF_TOPICS) and not staff:
+            return JsonResponse({"error": "Only staff may follow wishes"}, status=status.HTTP_403_FORBIDDEN)
+        cursor = live.parse_cursor(request.GET.get("cursor", request.headers.get("Last-Event-ID")))
+
+        if isinstance(request, ASGIRequest):
+            response = StreamingHttpResponse(live.stream(topics, cursor), content_type="text/event-stream")
+        else:
+            frames, _ = await sync_to_async(live.opening)(cursor, topics)
+            response = HttpResponse(b"".join([live.retry_frame(), *frames]), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # Stop nginx from buffering the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
 
 
 # ---------------------- Google OAuth & Drive ----------------------
@@ -143,61 +526,122 @@ class GoogleAuthInitView(APIView):
         return redirect(auth_url)
 
 
-class GoogleAuthCallbackView(APIView):
-    permission_classes = [AllowAny]
+def remember_job(session, job):
+    """
+    Let this session read ``job`` through the job status endpoint.
+    """
+    ids = [pk for pk in session.get("jobs", []) if pk != job.pk]
+    session["jobs"] = (ids + [job.pk])[-50:]
+
+
+def job_status(job):
+    return {
+        "job": job.pk,
+        "task": job.task,
+        "status": job.status,
+        "attempts": job.attempts,
+        "result": jobs.public_result(job),
+        "error": job.error,
+    }
+
+
+def google_access_token(session):
+    """
+    ``(token, pending)`` for the session's Google sign-in: the token once its
+    exchange job has finished, or ``pending`` while the job is still queued or
+    running. The token moves from the job into the session on first use, so
+    the jobs table does not keep it.
+    """
+    token = session.get("google_access_token")
+    if token:
+        return token, False
+    job_id = session.get("google_auth_job")
+    job = Job.objects.filter(pk=job_id).only("task", "status", "result").first() if job_id else None
+    if job is None or job.status == JobStatus.DEAD:
+        return None, False
+    if job.status != JobStatus.DONE:
+        return None, True
+    # None when another session (a replayed callback) collected the token first
+    token = jobs.collect_result(job).get("access_token")
+    if token:
+        session["google_access_token"] = token
+    return token, False
+
+
+class GoogleAuthCallbackView(View):
+    """
+    Queue the exchange of Google's authorization code for tokens (task
+    ``google.exchange_code``) and answer 202 with the job; the request makes
+    no call to Google. A replayed callback gets the same job back.
+    """
 
     def get(self, request):
         code = request.GET.get("code")
+        if not code:
+            return JsonResponse({"error": "Failed to authenticate with Google"}, status=400)
 
-        token_url = "https://oauth2.googleapis.com/token"
-        token_data = {
-            "code": code,
-            "client_id": settings.GOOGLE_CLIENT_ID,
-            "client_secret": settings.GOOGLE_CLIENT_SECRET,
-            "redirect_uri": settings.GOOGLE_REDIRECT_URI,
-            "grant_type": "authorization_code",
-        }
-
-        response = requests.post(token_url, data=token_data)
-        tokens = response.json()
+        digest = hashlib.sha256(code.encode()).hexdigest()
+        job = jobs.enqueue("google.exchange_code", {"code": code}, idempotency_key=f"google-code:{digest}")
+        request.session.pop("google_access_token", None)
+        request.session["google_auth_job"] = job.pk
+        remember_job(request.session, job)
+        return JsonResponse({"message": "Google authentication in progress", **job_status(job)}, status=202)
 
-        if "access_token" not in tokens:
-            return Response({"error": "Failed to authenticate with Google"}, status=400)
 
-        # Store access token in session for later uploads
-        request.session["google_access_token"] = tokens["access_token"]
-
-        return Response({"message": "Google authentication successful"})
-
-
-class GoogleDriveUploadView(APIView):
-    permission_classes = [AllowAny]
+@method_decorator(csrf_exempt, name="dispatch")
+class GoogleDriveUploadView(View):
+    """
+    Spool an upload and queue it for the signed-in user's Drive (task
+    ``drive.upload``); answers 202 with the job to poll at ``jobs/<id>/``.
+    An optional ``description`` field is set on the Drive file.
+    """
 
     def post(self, request):
-        access_token = request.session.get("google_access_token")
+        size = request_size(request)
+        if not upload_admission.try_admit(size):
+            return JsonResponse(
+                {"error": "Too many uploads in progress"}, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(settings.GALLERY_UPLOAD_RETRY_AFTER)},
+            )
+        try:
+            return self.upload(request)
+        finally:
+            upload_admission.release(size)
+
+    def upload(self, request):
+        access_token, pending = google_access_token(request.session)
+        if pending:
+            return JsonResponse(
+                {"error": "Google authentication is still in progress"}, status=status.HTTP_409_CONFLICT,
+                headers={"Retry-After": "1"},
+            )
         if not access_token:
-            return Response({"error": "Not authenticated with Google"}, status=401)
+            return JsonResponse({"error": "Not authenticated with Google"}, status=401)
 
         uploaded_file = request.FILES.get("file")
         if not uploaded_file:
-            return Response({"error": "No file uploaded"}, status=400)
-
-        headers = {"Authorization": f"Bearer {access_token}"}
-        files = {"file": uploaded_file}
-        metadata = {"name": uploaded_file.name}
+            return JsonResponse({"error": "No file uploaded"}, status=400)
 
-        drive_upload_url = "https://www.googleapis.com/upload/drive/v3/files?uploadType=multipart"
-
-        response = requests.post(
-            drive_upload_url,
-            headers=headers,
-            files={
-                "metadata": ("metadata", f'{{"name":"{uploaded_file.name}"}}', "application/json"),
-                "file": uploaded_file,
-            },
-        )
-
-        if response.status_code not in [200, 201]:
-            return Response({"error": "Upload failed", "details": response.json()}, status=400)
-
-        return Response({"message": "File uploaded successfully", "drive_response": response.json()})
+        extension = os.path.splitext(uploaded_file.name)[1].lower()
+        path = default_storage.save(f"drive/spool/{uuid.uuid4().hex}{extension}", uploaded_file)
+        job = jobs.enqueue("drive.upload", {
+            "access_token": access_token,
+            "path": path,
+            "name": uploaded_file.name,
+            "content_type": uploaded_file.content_type,
+            "description": request.POST.get("description", "")[:1000],
+        })
+        remember_job(request.session, job)
+        return JsonResponse({"message": "Upload queued", **job_status(job)}, status=202)
+
+
+class JobStatusView(View):
+    """
+    A background job started by this session, or any job for staff.
+    """
+
+    def get(self, request, pk):
+        job = Job.objects.filter(pk=pk).first()
+        if job is None or not (request.user.is_staff or pk in request.session.get("jobs", [])):
+            return JsonResponse({"error": "Not found"}, status=404)
+        return JsonResponse(job_status(job))
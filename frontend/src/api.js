@@ -146,6 +146,13 @@ export async function get(url, cfg) {
   return r.data;
 }
 
+// --- cursor-paginated lists ({ next, previous, results }) ---
+// Pass the list url for the first page, then the returned `next` url for more.
+export async function getPage(url, cfg) {
+  const r = await api.get(url, cfg);
+  return { results: r.data.results || [], next: r.data.next || null };
+}
+
 export async function post(url, data, cfg) {
   const r = await api.post(url, data, cfg);
   return r.data;
@@ -166,4 +173,17 @@ export async function del(url, cfg) {
   return r.data;
 }
 
+// --- live updates (Server-Sent Events) ---
+// Calls onEvent({ kind, topic, data }) for each delta on the given topics
+// ("wishes", "gallery", "gifts") and onReset() when the client missed too much
+// and should refetch. EventSource reconnects by itself and resumes from the
+// last event it saw. Returns a function that closes the stream.
+export function subscribeLive(topics, onEvent, onReset) {
+  const url = `${API_BASE.replace(/\/+$/, "")}/live/?topics=${topics.join(",")}`;
+  const source = new EventSource(url);
+  source.onmessage = (e) => onEvent(JSON.parse(e.data));
+  source.addEventListener("reset", () => onReset && onReset());
+  return () => source.close();
+}
+
 export default api;
@@ -1,9 +1,10 @@
 import React, { useEffect, useRef, useState } from "react";
-import api from "../api";
+import api, { getPage, subscribeLive } from "../api";
 import GiftFormModal from "./GiftFormModal";
 
 export default function GiftCarousel() {
   const [gifts, setGifts] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
   const [index, setIndex] = useState(0);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -23,6 +24,17 @@ export default function GiftCarousel() {
     window.addEventListener("keydown", onKey);
     return () => window.removeEventListener("keydown", onKey);
   }, []);
+
+  // Reservations made by other guests show up without reloading the list
+  useEffect(() => subscribeLive(["gifts"], applyGiftEvent, fetchGifts), []);
+
+  function applyGiftEvent({ kind, data }) {
+    if (kind === "gift.removed") {
+      setGifts((gs) => gs.filter((g) => g.id !== data.id));
+    } else if (kind === "gift") {
+      setGifts((gs) => gs.map((g) => (g.id === data.id ? { ...g, ...data } : g)));
+    }
+  }
   
   useEffect(() => {
     if (showModal || gifts.length <= 1) return;
@@ -34,8 +46,9 @@ export default function GiftCarousel() {
     setLoading(true);
     setError(null);
     try {
-      const res = await api.get("api/gifts/");
-      setGifts(res.data || []);
+      const page = await getPage("api/gifts/");
+      setGifts(page.results);
+      setNextPage(page.next);
       setIndex(0);
     } catch (err) {
       console.error(err);
@@ -45,6 +58,25 @@ export default function GiftCarousel() {
     }
   }
 
+  // Fetch the next cursor page as the carousel approaches the last loaded gift
+  async function loadMore() {
+    if (!nextPage) return;
+    const url = nextPage;
+    setNextPage(null);
+    try {
+      const page = await getPage(url);
+      setGifts((g) => g.concat(page.results));
+      setNextPage(page.next);
+    } catch (err) {
+      console.error(err);
+      setNextPage(url);
+    }
+  }
+
+  useEffect(() => {
+    if (gifts.length && index >= gifts.length - 2) loadMore();
+  }, [index, gifts.length, nextPage]);
+
   function prev() {
     setIndex((i) => (gifts.length ? (i - 1 + gifts.length) % gifts.length : 0));
   }
@@ -74,15 +106,9 @@ export default function GiftCarousel() {
   async function handleGuestSubmit(guestData) {
     if (!selectedGift) return;
     try {
-      const guestResp = await api.post("api/guests/rsvp/", guestData);
-      const guestId =
-        guestResp.data.id ??
-        guestResp.data.pk ??
-        guestResp.data.uuid ??
-        guestResp.data;
-
-      await api.patch(`/gifts/${selectedGift.id}/reserve/`, { guest_id: guestId });
-      await fetchGifts();
+      // One request: RSVP (returning guests are matched by email) and reserve
+      const { data } = await api.post(`/gifts/${selectedGift.id}/rsvp-and-reserve/`, guestData);
+      setGifts((gs) => gs.map((g) => (g.id === data.id ? data : g)));
       setShowModal(false);
       setSelectedGift(null);
       alert("Gift reserved — thank you!");
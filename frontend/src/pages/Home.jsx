@@ -16,7 +16,7 @@ export default function Home() {
   const [isSubmitting, setIsSubmitting] = useState(false);
   const [message, setMessage] = useState(null);
 
-  const [file, setFile] = useState(null);
+  const [files, setFiles] = useState([]);
   const [uploadedBy, setUploadedBy] = useState("");
   const [uploading, setUploading] = useState(false);
   const [photoMessage, setPhotoMessage] = useState("");
@@ -73,27 +73,67 @@ export default function Home() {
     }
   };
 
+  const sha256Hex = async (file) => {
+    const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+  };
+
+  const filterKnownPhotos = async (selected) => {
+    // crypto.subtle needs a secure context; without it just upload everything
+    if (!window.crypto?.subtle) return selected;
+    try {
+      const digests = await Promise.all(selected.map(sha256Hex));
+      const response = await fetch(`${API_URL}/api/gallery/check-hashes/`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ sha256: digests }),
+      });
+      if (!response.ok) return selected;
+      const { known } = await response.json();
+      return selected.filter((_, i) => !known[digests[i]]);
+    } catch (error) {
+      console.error("Duplicate check failed:", error);
+      return selected;
+    }
+  };
+
+  // The server answers 429 while it is busy with other uploads; wait as told
+  // (plus jitter, so phones do not all come back at once) and try again
+  async function postHonouringRetryAfter(url, body, attempts = 3) {
+    for (let attempt = 1; ; attempt++) {
+      const response = await fetch(url, { method: "POST", body });
+      if (response.status !== 429 || attempt >= attempts) return response;
+      const wait = Number(response.headers.get("Retry-After")) || 5;
+      await new Promise((resolve) => setTimeout(resolve, (wait + Math.random() * wait) * 1000));
+    }
+  }
+
   const handlePhotoSubmit = async (e) => {
     e.preventDefault();
 
-    if (!file || !uploadedBy) {
-      setPhotoMessage("Weka jina na picha kwanza, ndugu 😅");
+    if (!files.length) {
+      setPhotoMessage("Chagua picha kwanza, ndugu 😅");
       return;
     }
 
-    const formData = new FormData();
-    formData.append("image", file);
-    formData.append("uploaded_by", uploadedBy);
-
     try {
       setUploading(true);
       setPhotoMessage("");
-      await fetch(`${API_URL}/api/weddings/gallery/upload/`, {
-        method: "POST",
-        body: formData,
-      });
+
+      // Skip photos the gallery already has (same bytes), so they are not sent again
+      const fresh = await filterKnownPhotos(files);
+
+      if (fresh.length) {
+        // Send every remaining photo in one request; the server uploads them in parallel
+        const formData = new FormData();
+        fresh.forEach((f) => formData.append("files", f));
+        if (uploadedBy) formData.append("uploaded_by", uploadedBy);
+
+        const response = await postHonouringRetryAfter(`${API_URL}/api/gallery/upload-batch/`, formData);
+        if (!response.ok) throw new Error(`Upload failed with ${response.status}`);
+      }
       setPhotoMessage("Picha imeingia safi sana! Asante 🥳");
-      setFile(null);
+      setFiles([]);
       setUploadedBy("");
     } catch (error) {
       console.error("Upload failed:", error);
@@ -273,7 +313,8 @@ export default function Home() {
         >
           <input
             type="file"
-            onChange={(e) => setFile(e.target.files[0])}
+            multiple
+            onChange={(e) => setFiles(Array.from(e.target.files))}
             accept="image/*"
             className="w-full rounded-xl border border-gray-200 p-3 shadow-sm bg-white"
             required